@@ -0,0 +1,61 @@
+"""
+Compare table-driven Caesar encoding with the per-character calc path.
+
+Usage: python -m benchmarks.caesar_translate [--size-mb 100] [--key 3]
+"""
+import argparse
+import glob
+import os
+import time
+
+from main.encode import Encoder, CaesarEncoder
+
+SRC_PATTERN = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tests', 'src', '*.txt')
+
+
+def build_corpus(size: int):
+    """
+    Build corpus of given size from tests/src texts
+    :param size: Corpus size in characters
+    :return: Corpus text
+    """
+    sample = ''.join(open(filename, 'r').read() for filename in sorted(glob.glob(SRC_PATTERN)))
+    return (sample * (size // len(sample) + 1))[:size]
+
+
+def measure(function, text: str):
+    """
+    Measure function run time on text
+    :param function: Function to run
+    :param text: Function argument
+    :return: Run time in seconds and function result
+    """
+    start = time.perf_counter()
+    result = function(text)
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Caesar translate benchmark')
+    parser.add_argument('--size-mb', type=float, default=100, help='Corpus size in megabytes')
+    parser.add_argument('--key', type=int, default=3, help='Caesar key')
+    args = parser.parse_args()
+
+    text = build_corpus(int(args.size_mb * 1024 * 1024))
+    encoder = CaesarEncoder(args.key)
+
+    table_time, table_result = measure(encoder.encode, text)
+    loop_time, loop_result = measure(lambda data: Encoder.encode_chunk(encoder, data, 0)[0], text)
+
+    if table_result != loop_result:
+        raise Exception('Translation table result differs from calc result')
+
+    size_mb = len(text) / 1024 / 1024
+    print('size: {:.1f} MB'.format(size_mb))
+    print('calc loop: {:.3f} s ({:.2f} MB/s)'.format(loop_time, size_mb / loop_time))
+    print('translate: {:.3f} s ({:.2f} MB/s)'.format(table_time, size_mb / table_time))
+    print('speedup: {:.1f}x'.format(loop_time / table_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+"""
+Measure throughput of hacking many short messages with one shared model.
+
+Usage: python -m benchmarks.hack_many [--messages 2000] [--length 200]
+"""
+import argparse
+import random
+import string
+import time
+
+from benchmarks.caesar_translate import build_corpus
+from main.encode import CaesarEncoder, VigenereEncoder
+from main.hack import CaesarHacker, CaesarBonusHacker, VigenereHacker
+from main.model import compile_model
+from main.train import DefaultTrainer, BonusTrainer
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Batched hacking benchmark')
+    parser.add_argument('--messages', type=int, default=2000, help='Number of messages')
+    parser.add_argument('--length', type=int, default=200, help='Message length in characters')
+    parser.add_argument('--n', type=int, default=3, help='Size of a n-chart model')
+    args = parser.parse_args()
+
+    corpus = build_corpus(1 << 20)
+    starts = [random.randrange(len(corpus) - args.length) for _ in range(args.messages)]
+    messages = [corpus[start:start + args.length] for start in starts]
+
+    trainer = DefaultTrainer()
+    trainer.feed(corpus)
+    model = compile_model(trainer.get_model())
+    bonus_trainer = BonusTrainer(args.n)
+    bonus_trainer.feed(corpus)
+    bonus_model = compile_model(bonus_trainer.get_model(), args.n)
+
+    caesar_messages = [CaesarEncoder(random.randrange(26)).encode(message) for message in messages]
+    vigenere_messages = [VigenereEncoder(''.join(random.choice(string.ascii_lowercase) for _ in range(3)))
+                         .encode(message) for message in messages]
+
+    cases = [
+        ('CaesarHacker', CaesarHacker(model), caesar_messages),
+        ('CaesarBonusHacker', CaesarBonusHacker(bonus_model, args.n), caesar_messages),
+        ('VigenereHacker', VigenereHacker(model), vigenere_messages)
+    ]
+    for name, hacker, texts in cases:
+        start = time.perf_counter()
+        results = list(hacker.hack_many(texts))
+        elapsed = time.perf_counter() - start
+        accuracy = sum(result == message for result, message in zip(results, messages)) / len(messages)
+        print('{}: {:.0f} messages/s, accuracy {:.1%}'.format(name, len(texts) / elapsed, accuracy))
+
+
+if __name__ == '__main__':
+    main()
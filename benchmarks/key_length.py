@@ -0,0 +1,70 @@
+"""
+Compare single-pass key length search with per-character coincidence index calculation for every length.
+
+Usage: python -m benchmarks.key_length [--size-mb 1] [--key-length 31]
+"""
+import argparse
+import random
+import string
+
+from benchmarks.caesar_translate import build_corpus, measure
+from main.encode import VigenereEncoder
+from main.hack import VigenereHacker
+from main.key_length import letter_codes, coincidence_curve, max_key_length
+from main.train import DefaultTrainer
+
+
+def legacy_check_length(text: str, length: int):
+    """
+    Per-character coincidence index of the first column, as VigenereHacker used to calculate it
+    :param text: Letters of text
+    :param length: Key length
+    :return: Coincidence index for length
+    """
+    count = [0 for letter in range(26)]
+    sum_count = 0
+    for letter in text[0::length]:
+        if letter.isalpha():
+            count[ord(letter.lower()) - ord('a')] += 1
+            sum_count += 1
+    if sum_count <= 2:
+        return 0
+    result = 0
+    for letter in range(26):
+        result += (count[letter] * (count[letter] - 1)) / (sum_count * (sum_count - 1))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Key length search benchmark')
+    parser.add_argument('--size-mb', type=float, default=1, help='Ciphertext size in megabytes')
+    parser.add_argument('--key-length', type=int, default=31, help='Vigenere key length')
+    args = parser.parse_args()
+
+    text = build_corpus(int(args.size_mb * 1024 * 1024))
+    key = ''.join(random.choice(string.ascii_lowercase) for _ in range(args.key_length))
+    encrypted_text = VigenereEncoder(key).encode(text)
+
+    trainer = DefaultTrainer()
+    trainer.feed(text)
+    hacker = VigenereHacker(trainer.get_model())
+
+    letter_text = ''.join(letter.lower() for letter in encrypted_text if letter.isalpha())
+    lengths = range(1, max_key_length(len(letter_text)) + 1)
+
+    loop_time, loop_curve = measure(
+        lambda data: [legacy_check_length(data, length) for length in lengths], letter_text)
+    curve_time, curve = measure(lambda data: coincidence_curve(letter_codes(data)), encrypted_text)
+
+    if loop_curve != curve:
+        raise Exception('Coincidence curves differ')
+
+    print('size: {:.1f} MB, letters: {}, lengths: {}'.format(len(text) / 1024 / 1024, len(letter_text), len(lengths)))
+    print('per-character loop: {:.3f} s'.format(loop_time))
+    print('coincidence curve: {:.3f} s'.format(curve_time))
+    print('speedup: {:.1f}x'.format(loop_time / curve_time))
+    print('estimated key length: {}'.format(hacker.estimate_key_length(letter_codes(encrypted_text))[0]))
+
+
+if __name__ == '__main__':
+    main()
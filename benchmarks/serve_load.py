@@ -0,0 +1,118 @@
+"""
+Load test of encryptor server on localhost: many connections send encode, decode or hack requests.
+
+Usage: python -m benchmarks.serve_load [--port 8765 | --unix PATH] [--connections 16] [--requests 200]
+       [--command hack] [--cipher caesar] [--model default] [--length 200]
+
+Without --port and --unix a server with a model trained on tests/src texts is started in this process.
+"""
+import argparse
+import asyncio
+import os
+import random
+import string
+import tempfile
+import time
+
+from benchmarks.caesar_translate import build_corpus
+from benchmarks.suite import percentile
+from main.encode import CaesarEncoder, VigenereEncoder
+from main.server import EncryptorServer, send_request
+from main.train import DefaultTrainer
+
+
+def build_requests(args, corpus: str):
+    """
+    Build requests for one connection
+    :param args: Command line arguments
+    :param corpus: Text to take messages from
+    :return: List of requests
+    """
+    requests = []
+    for index in range(args.requests):
+        start = random.randrange(len(corpus) - args.length)
+        text = corpus[start:start + args.length]
+        request = {'id': index, 'command': args.command, 'cipher': args.cipher}
+        key = random.randrange(26) if args.cipher == 'caesar' else \
+            ''.join(random.choice(string.ascii_lowercase) for _ in range(5))
+        if args.command == 'hack':
+            encoder = CaesarEncoder(key) if args.cipher == 'caesar' else VigenereEncoder(key)
+            request.update(text=encoder.encode(text), model=args.model)
+        else:
+            request.update(text=text, key=key)
+        requests.append(request)
+    return requests
+
+
+async def run_connection(args, requests: list, latencies: list):
+    if args.unix:
+        reader, writer = await asyncio.open_unix_connection(args.unix)
+    else:
+        reader, writer = await asyncio.open_connection(args.host, args.port)
+    errors = 0
+    for request in requests:
+        start = time.perf_counter()
+        response = await send_request(reader, writer, request)
+        latencies.append(time.perf_counter() - start)
+        errors += not response['ok']
+    writer.close()
+    await writer.wait_closed()
+    return errors
+
+
+async def run_load(args, corpus: str):
+    connections = [build_requests(args, corpus) for _ in range(args.connections)]
+    latencies = []
+    start = time.perf_counter()
+    errors = await asyncio.gather(*(run_connection(args, requests, latencies) for requests in connections))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    print('{} requests in {:.2f} s: {:.0f} requests/s, {} errors'.format(
+        len(latencies), elapsed, len(latencies) / elapsed, sum(errors)))
+    print('latency p50 {:.2f} ms, p95 {:.2f} ms, p99 {:.2f} ms, max {:.2f} ms'.format(
+        *(1000 * percentile(latencies, share) for share in (0.5, 0.95, 0.99, 1))))
+
+
+async def run_with_server(args, corpus: str, model_path: str):
+    server = EncryptorServer({args.model: (model_path, None)}, args.workers)
+    try:
+        listener = await server.start(args.host, 0)
+        args.port = listener.sockets[0].getsockname()[1]
+        await run_load(args, corpus)
+    finally:
+        server.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Encryptor server load test')
+    parser.add_argument('--host', default='127.0.0.1', help='Server host')
+    parser.add_argument('--port', type=int, help='Server port, a local server is started if not given')
+    parser.add_argument('--unix', help='Server Unix socket path')
+    parser.add_argument('--workers', type=int, help='Worker processes of the local server')
+    parser.add_argument('--connections', type=int, default=16, help='Number of concurrent connections')
+    parser.add_argument('--requests', type=int, default=200, help='Number of requests per connection')
+    parser.add_argument('--command', choices=['encode', 'decode', 'hack'], default='hack', help='Request command')
+    parser.add_argument('--cipher', choices=['caesar', 'vigenere'], default='caesar', help='Cipher type')
+    parser.add_argument('--model', default='default', help='Model name for hack requests')
+    parser.add_argument('--length', type=int, default=200, help='Message length in characters')
+    args = parser.parse_args()
+
+    corpus = build_corpus(1 << 20).encode('ascii', 'ignore').decode('ascii')
+    if args.port or args.unix:
+        asyncio.run(run_load(args, corpus))
+        return
+
+    trainer = DefaultTrainer()
+    trainer.feed(corpus)
+    descriptor, model_path = tempfile.mkstemp(suffix='.bin')
+    with os.fdopen(descriptor, 'wb') as model_file:
+        model_file.write(trainer.get_binary_model())
+    try:
+        asyncio.run(run_with_server(args, corpus, model_path))
+    finally:
+        os.remove(model_path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,386 @@
+"""
+Benchmark suite of ciphers, trainers and hackers: throughput, latency percentiles and peak memory of every case.
+
+Usage: python -m benchmarks.suite run [--sizes 1KB,64KB,1MB] [--key-lengths 1,5,500] [--cases CaesarEncoder,...]
+       [--repeat 5] [--output results.json]
+       python -m benchmarks.suite compare OLD.json NEW.json [--threshold 0.1]
+
+The same commands are available as `encryptor.py benchmark run` and `encryptor.py benchmark compare`.
+Results are saved as json, compare exits with code 1 if the new run has regressions.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import string
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from benchmarks.caesar_translate import build_corpus
+from main import vectorized
+from main.alphabet import CYRILLIC
+from main.encode import CaesarEncoder, VigenereEncoder, VernamEncoder, ByteVernamEncoder
+from main.hack import CaesarHacker, CaesarBonusHacker, VigenereHacker
+from main.model import compile_model
+from main.train import DefaultTrainer, BonusTrainer
+
+SIZE_UNITS = {'MB': 1 << 20, 'KB': 1 << 10, 'B': 1}
+
+DEFAULT_SIZES = '1KB,64KB,1MB'
+FULL_SIZES = '1KB,64KB,1MB,10MB,100MB'
+DEFAULT_KEY_LENGTHS = '1,5,500'
+
+# every case runs at least repeat times and then until it took MIN_TIME seconds, but no more than MAX_RUNS times
+DEFAULT_REPEAT = 5
+MIN_TIME = 0.5
+MAX_RUNS = 1000
+
+# relative change of throughput or peak memory reported as regression by compare
+DEFAULT_THRESHOLD = 0.1
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# size of corpus the hackers' models are trained on
+MODEL_CORPUS_SIZE = 1 << 20
+BONUS_MODEL_N = 3
+
+# records of VigenereEncoder[records] case: size in characters and number of distinct keys
+RECORD_SIZE = 100
+RECORD_KEYS = 300
+
+
+def parse_size(size: str):
+    """
+    Parse input size
+    :param size: Size like 512, 64KB or 1.5MB
+    :return: Size in characters
+    """
+    size = size.strip().upper()
+    for unit, multiplier in SIZE_UNITS.items():
+        if size.endswith(unit):
+            return int(float(size[:-len(unit)]) * multiplier)
+    return int(size)
+
+
+def format_size(size: int):
+    """
+    Format input size
+    :param size: Size in characters
+    :return: Size like 64KB
+    """
+    for unit, multiplier in SIZE_UNITS.items():
+        if size >= multiplier and size % multiplier == 0:
+            return '{}{}'.format(size // multiplier, unit)
+    return str(size)
+
+
+def percentile(values: list, share: float):
+    """
+    Get percentile of values
+    :param values: Sorted list of values
+    :param share: Percentile in range [0, 1]
+    :return: Value
+    """
+    return values[min(int(share * len(values)), len(values) - 1)]
+
+
+def random_key(key_length: int, letters: str = string.ascii_lowercase):
+    return ''.join(random.choice(letters) for _ in range(key_length))
+
+
+def to_cyrillic(text: str):
+    # english letters are replaced by cyrillic ones, so that alphabet cases process the same letters
+    letters = CYRILLIC.letters[:26]
+    return text.translate(str.maketrans(string.ascii_lowercase + string.ascii_uppercase, letters + letters.upper()))
+
+
+def random_number_key(key_length: int):
+    return int.from_bytes(bytes(random.randrange(1, 256) for _ in range(key_length)), 'big')
+
+
+class Models:
+    """
+    Models for hacker cases, trained once on demand
+    """
+
+    def __init__(self):
+        self.models = {}
+
+    def get(self, n: int = None):
+        """
+        Get compiled model
+        :param n: Size of a n-chart model, None for frequency model
+        :return: Compiled model
+        """
+        if n not in self.models:
+            trainer = BonusTrainer(n) if n else DefaultTrainer()
+            trainer.feed(build_corpus(MODEL_CORPUS_SIZE))
+            self.models[n] = compile_model(trainer.get_model(), n)
+        return self.models[n]
+
+
+def caesar_encoder(text, key_length, models):
+    encoder = CaesarEncoder(random.randrange(1, 26))
+    return lambda: encoder.encode(text)
+
+
+def vigenere_encoder(text, key_length, models):
+    encoder = VigenereEncoder(random_key(key_length))
+    return lambda: encoder.encode(text)
+
+
+def vigenere_record_encoder(text, key_length, models):
+    # small records, each with its own encoder, keys repeat like in a stream of records of a few hundred users
+    keys = [random_key(key_length) for _ in range(RECORD_KEYS)]
+    records = [text[start:start + RECORD_SIZE] for start in range(0, len(text), RECORD_SIZE)]
+    return lambda: [VigenereEncoder(keys[index % RECORD_KEYS]).encode(record) for index, record in enumerate(records)]
+
+
+def cyrillic_caesar_encoder(text, key_length, models):
+    encoder, text = CaesarEncoder(random.randrange(1, CYRILLIC.power), CYRILLIC), to_cyrillic(text)
+    return lambda: encoder.encode(text)
+
+
+def cyrillic_vigenere_encoder(text, key_length, models):
+    encoder, text = VigenereEncoder(random_key(key_length, CYRILLIC.letters), alphabet=CYRILLIC), to_cyrillic(text)
+    return lambda: encoder.encode(text)
+
+
+def vernam_encoder(text, key_length, models):
+    encoder = VernamEncoder(random_number_key(key_length))
+    return lambda: encoder.encode(text)
+
+
+def byte_vernam_encoder(text, key_length, models):
+    encoder = ByteVernamEncoder(random_number_key(key_length))
+    return lambda: encoder.encode(text)
+
+
+def default_trainer(text, key_length, models):
+    def run():
+        trainer = DefaultTrainer()
+        trainer.feed(text)
+        return trainer.get_model()
+    return run
+
+
+def bonus_trainer(n):
+    def setup(text, key_length, models):
+        def run():
+            trainer = BonusTrainer(n)
+            trainer.feed(text)
+            return trainer.get_model()
+        return run
+    return setup
+
+
+def caesar_hacker(text, key_length, models):
+    hacker = CaesarHacker(models.get())
+    encrypted_text = CaesarEncoder(random.randrange(1, 26)).encode(text)
+    return lambda: hacker.hack(encrypted_text)
+
+
+def caesar_bonus_hacker(text, key_length, models):
+    hacker = CaesarBonusHacker(models.get(BONUS_MODEL_N), BONUS_MODEL_N)
+    encrypted_text = CaesarEncoder(random.randrange(1, 26)).encode(text)
+    return lambda: hacker.hack(encrypted_text)
+
+
+def vigenere_hacker(text, key_length, models):
+    hacker = VigenereHacker(models.get())
+    encrypted_text = VigenereEncoder(random_key(key_length)).encode(text)
+    return lambda: hacker.hack(encrypted_text)
+
+
+def startup(text, key_length, models):
+    return lambda: subprocess.run([sys.executable, '-c', 'pass'], check=True)
+
+
+def command(*arguments):
+    def setup(text, key_length, models):
+        command_line = [sys.executable, os.path.join(ROOT, 'encryptor.py'), *arguments]
+        # corpus has a few non-english letters, which the command line rejects
+        ascii_text = text.encode('ascii', 'ignore').decode('ascii')
+        return lambda: subprocess.run(command_line, input=ascii_text, stdout=subprocess.DEVNULL, check=True, text=True)
+    return setup
+
+
+# case name: (setup function returning the measured call, whether the case depends on key length)
+CASES = dict([
+    ('CaesarEncoder', (caesar_encoder, False)),
+    ('VigenereEncoder', (vigenere_encoder, True)),
+    ('VigenereEncoder[records]', (vigenere_record_encoder, True)),
+    ('CaesarEncoder[cyrillic]', (cyrillic_caesar_encoder, False)),
+    ('VigenereEncoder[cyrillic]', (cyrillic_vigenere_encoder, True)),
+    ('VernamEncoder', (vernam_encoder, True)),
+    ('ByteVernamEncoder', (byte_vernam_encoder, True)),
+    ('DefaultTrainer', (default_trainer, False))
+] + [
+    ('BonusTrainer[n={}]'.format(n), (bonus_trainer(n), False)) for n in range(2, 7)
+] + [
+    ('CaesarHacker', (caesar_hacker, False)),
+    ('CaesarBonusHacker', (caesar_bonus_hacker, False)),
+    ('VigenereHacker', (vigenere_hacker, True)),
+    # cold start of a process: bare interpreter, and command line encoding with imports of its command
+    ('Startup[python]', (startup, False)),
+    ('CLI[encode caesar]', (command('encode', '--cipher', 'caesar', '--key', '3'), False)),
+    ('CLI[encode vigenere]', (command('encode', '--cipher', 'vigenere', '--key', 'lemon'), False))
+])
+
+
+def measure_case(run, size: int, repeat: int = DEFAULT_REPEAT):
+    """
+    Measure call run time and peak memory
+    :param run: Measured call without arguments
+    :param size: Input size in characters
+    :param repeat: Minimal number of runs
+    :return: Dict with number of runs, throughput in MB/s, latency percentiles in seconds and peak memory in bytes
+    """
+    times = []
+    while len(times) < repeat or (sum(times) < MIN_TIME and len(times) < MAX_RUNS):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    times.sort()
+
+    # memory is measured in a separate run, tracing slows calls down
+    tracemalloc.start()
+    try:
+        run()
+        peak_memory = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'runs': len(times),
+        'mb_per_s': size / (1 << 20) / percentile(times, 0.5),
+        'latency': {'p50': percentile(times, 0.5), 'p95': percentile(times, 0.95), 'p99': percentile(times, 0.99)},
+        'peak_memory': peak_memory
+    }
+
+
+def run_suite(sizes: list, key_lengths: list, cases: list = None, repeat: int = DEFAULT_REPEAT, report=None):
+    """
+    Run benchmark cases for every input size and key length
+    :param sizes: Input sizes in characters
+    :param key_lengths: Key lengths, used by cases which depend on key length
+    :param cases: Names of cases from CASES, all cases by default
+    :param repeat: Minimal number of runs of every case
+    :param report: Function called with every result as soon as it is measured
+    :return: Dict with environment description and list of results
+    """
+    models = Models()
+    results = []
+    for name in cases or CASES:
+        if name not in CASES:
+            raise Exception('Unknown benchmark case: {}'.format(name))
+        setup, keyed = CASES[name]
+        for size in sizes:
+            text = build_corpus(size)
+            for key_length in key_lengths if keyed else [None]:
+                result = dict(case=name, size=size, key_length=key_length,
+                              **measure_case(setup(text, key_length, models), size, repeat))
+                if report:
+                    report(result)
+                results.append(result)
+    return {
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'numpy': vectorized.HAS_NUMPY,
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S')
+        },
+        'results': results
+    }
+
+
+def compare_results(old: dict, new: dict, threshold: float = DEFAULT_THRESHOLD):
+    """
+    Compare results of two runs
+    :param old: Baseline run from run_suite
+    :param new: New run from run_suite
+    :param threshold: Relative throughput drop or peak memory growth reported as regression
+    :return: List of (result key, throughput ratio, peak memory ratio, is regression) for results present in both runs
+    """
+    baseline = {(result['case'], result['size'], result['key_length']): result for result in old['results']}
+    comparison = []
+    for result in new['results']:
+        key = (result['case'], result['size'], result['key_length'])
+        if key not in baseline:
+            continue
+        speed = result['mb_per_s'] / baseline[key]['mb_per_s']
+        memory = (result['peak_memory'] + 1) / (baseline[key]['peak_memory'] + 1)
+        comparison.append((key, speed, memory, speed < 1 - threshold or memory > 1 + threshold))
+    return comparison
+
+
+def describe(case: str, size: int, key_length: int):
+    return '{} {}{}'.format(case, format_size(size), '' if key_length is None else ' key={}'.format(key_length))
+
+
+def print_result(result: dict):
+    print('{:<40} {:>10.2f} MB/s  p50 {:>9.3f} ms  p95 {:>9.3f} ms  p99 {:>9.3f} ms  peak {:>9.1f} KB'.format(
+        describe(result['case'], result['size'], result['key_length']), result['mb_per_s'],
+        *(1000 * result['latency'][share] for share in ('p50', 'p95', 'p99')), result['peak_memory'] / 1024))
+
+
+def run(args):
+    sizes = [parse_size(size) for size in (FULL_SIZES if args.full else args.sizes).split(',')]
+    key_lengths = [int(key_length) for key_length in args.key_lengths.split(',')]
+    cases = args.cases.split(',') if args.cases else None
+    results = run_suite(sizes, key_lengths, cases, args.repeat, print_result)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+
+
+def compare(args):
+    with open(args.old, 'r') as old_file, open(args.new, 'r') as new_file:
+        comparison = compare_results(json.load(old_file), json.load(new_file), args.threshold)
+    for key, speed, memory, regression in comparison:
+        print('{:<40} speed {:>+7.1%}  memory {:>+7.1%}{}'.format(
+            describe(*key), speed - 1, memory - 1, '  REGRESSION' if regression else ''))
+    regressions = sum(regression for *_, regression in comparison)
+    print('{} regressions in {} compared cases'.format(regressions, len(comparison)))
+    if regressions:
+        sys.exit(1)
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    """
+    Add run and compare subcommands to parser
+    :param parser: Argument parser
+    """
+    subparsers = parser.add_subparsers()
+
+    parser_run = subparsers.add_parser('run', help='Run benchmarks')
+    parser_run.set_defaults(func=run)
+    parser_run.add_argument('--sizes', default=DEFAULT_SIZES, help='Comma separated input sizes, like 1KB,1MB')
+    parser_run.add_argument('--full', action='store_true', help='Use input sizes {}'.format(FULL_SIZES))
+    parser_run.add_argument('--key-lengths', default=DEFAULT_KEY_LENGTHS, help='Comma separated key lengths')
+    parser_run.add_argument('--cases', help='Comma separated case names: {}'.format(', '.join(CASES)))
+    parser_run.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help='Minimal number of runs of a case')
+    parser_run.add_argument('--output', help='Json file for results')
+
+    parser_compare = subparsers.add_parser('compare', help='Compare results of two runs')
+    parser_compare.set_defaults(func=compare)
+    parser_compare.add_argument('old', help='Json results of baseline run')
+    parser_compare.add_argument('new', help='Json results of new run')
+    parser_compare.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                                help='Relative throughput drop or memory growth reported as regression')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark suite')
+    add_arguments(parser)
+    args = parser.parse_args()
+    if not hasattr(args, 'func'):
+        parser.error('Command is required: run or compare')
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,105 +1,399 @@
 import argparse
-import json
+import contextlib
+import mmap
+import os
 import sys
 
-from main.encode import CaesarEncoder, VigenereEncoder, CaesarDecoder, VigenereDecoder, VernamEncoder, VernamDecoder
-from main.hack import CaesarHacker, CaesarBonusHacker, VigenereHacker
-from main.text_checker import TextChecker
-from main.train import DefaultTrainer, BonusTrainer
+from main.config import DEFAULT_CHUNK_SIZE, DEFAULT_MAX_REQUEST_SIZE, DEFAULT_PREFIX_SIZE
+
+# modules of a command are imported when the command runs and only its own arguments are added to the parser,
+# so that a short encode does not pay for hacking, training, model and server machinery
+PROFILED_COMMANDS = ('encode', 'decode', 'train', 'hack')
+
+RECORD_DELIMITERS = {'newline': '\n', 'nul': '\0'}
+
+ALPHABET_HELP = 'Alphabet: latin, cyrillic, digits, names joined by + (e.g. latin+cyrillic) or custom letters'
+
+
+def read_records(input_file, delimiter: str, chunk_size: int = DEFAULT_CHUNK_SIZE):
+    tail = ''
+    for chunk in iter(lambda: input_file.read(chunk_size), ''):
+        records = (tail + chunk).split(delimiter)
+        tail = records.pop()
+        yield from records
+    if tail:
+        yield tail
+
+
+def open_file(path: str, mode: str, default):
+    # standard streams are used for missing paths and '-', they are not closed
+    if not path or path == '-':
+        return contextlib.nullcontext(default)
+    return open(path, mode)
+
+
+def same_files(args):
+    return bool(args.input_file and args.output_file) and os.path.exists(args.input_file) and \
+        os.path.exists(args.output_file) and os.path.samefile(args.input_file, args.output_file)
+
+
+def open_files(args):
+    if same_files(args):
+        raise Exception('Input and output files must differ, use --mmap to process a file in place')
+    return open_file(args.input_file, 'r', sys.stdin), open_file(args.output_file, 'w', sys.stdout)
+
+
+@contextlib.contextmanager
+def map_files(args):
+    if not args.input_file or not args.output_file:
+        raise Exception('Memory-mapped mode requires input and output files')
+    if same_files(args):
+        # the file is processed in place, every chunk is read before its bytes are overwritten
+        with open(args.input_file, 'r+b') as file:
+            if not file.seek(0, 2):
+                yield b'', bytearray()
+                return
+            with mmap.mmap(file.fileno(), 0) as mapping:
+                yield mapping, mapping
+        return
+    with open(args.input_file, 'rb') as input_file, open(args.output_file, 'a+b') as output_file:
+        size = input_file.seek(0, 2)
+        output_file.truncate(size)
+        if not size:
+            yield b'', bytearray()
+            return
+        with mmap.mmap(input_file.fileno(), 0, access=mmap.ACCESS_READ) as source, \
+                mmap.mmap(output_file.fileno(), size) as target:
+            yield source, target
+
+
+def run_encoder(encoder, args, binary_input=False):
+    from main.encode import Encoder
+    from main.text_checker import TextChecker
+
+    alphabet = getattr(encoder, 'alphabet', None)
+    if args.mmap:
+        if not isinstance(encoder, Encoder):
+            raise Exception('Memory-mapped mode is not supported for {} cipher'.format(args.cipher))
+        with map_files(args) as (source, target):
+            TextChecker.check_buffer(source, alphabet=alphabet)
+            encoder.encode_buffer(source, target)
+        return
+    input_opener, output_opener = open_files(args)
+    with input_opener as input_file, output_opener as output_file:
+        if binary_input:
+            output_file.write(encoder.encode(input_file.buffer.read()))
+            return
+        if args.workers > 1:
+            if not isinstance(encoder, Encoder):
+                raise Exception('Parallel mode is not supported for {} cipher'.format(args.cipher))
+            text = input_file.read()
+            TextChecker.check(text, 0, alphabet)
+            output_file.write(encoder.encode_parallel(text, args.workers, args.chunk_size or DEFAULT_CHUNK_SIZE))
+        elif args.chunk_size:
+            if not isinstance(encoder, Encoder):
+                raise Exception('Chunked mode is not supported for {} cipher'.format(args.cipher))
+            chunks = iter(lambda: input_file.read(args.chunk_size), '')
+            for result in encoder.encode_stream(TextChecker.check_stream(chunks, alphabet)):
+                output_file.write(result)
+        else:
+            text = input_file.read()
+            TextChecker.check(text, 0, alphabet)
+            result = encoder.encode(text)
+            if isinstance(result, bytes):
+                output_file.flush()
+                output_file.buffer.write(result)
+            else:
+                output_file.write(result)
 
 
 def encode(args):
+    from main.encode import CaesarEncoder, VigenereEncoder, VernamEncoder, ByteVernamEncoder
+
     if args.cipher == 'vernam':
-        encoder = VernamEncoder(args.key)
-    else:
-        encoder = CaesarEncoder(args.key) if args.cipher == 'caesar' else VigenereEncoder(args.key)
-    text = args.input_file.read() if args.input_file else sys.stdin.read()
-    TextChecker.check(text)
-    if args.output_file:
-        args.output_file.write(encoder.encode(text))
+        if args.vernam_format == 'bits':
+            encoder = VernamEncoder(args.key)
+        else:
+            encoder = ByteVernamEncoder(args.key, args.vernam_format)
     else:
-        sys.stdout.write(encoder.encode(text))
+        encoder = CaesarEncoder(args.key, args.alphabet) if args.cipher == 'caesar' else \
+            VigenereEncoder(args.key, alphabet=args.alphabet)
+    run_encoder(encoder, args)
 
 
 def decode(args):
+    from main.encode import CaesarDecoder, VigenereDecoder, VernamDecoder, ByteVernamDecoder
+
     if args.cipher == 'vernam':
-        decoder = VernamDecoder(args.key)
-    else:
-        decoder = CaesarDecoder(args.key) if args.cipher == 'caesar' else VigenereDecoder(args.key)
-    text = args.input_file.read() if args.input_file else sys.stdin.read()
-    TextChecker.check(text)
-    if args.output_file:
-        args.output_file.write(decoder.encode(text))
+        if args.vernam_format == 'bits':
+            decoder = VernamDecoder(args.key)
+        else:
+            decoder = ByteVernamDecoder(args.key, args.vernam_format)
     else:
-        sys.stdout.write(decoder.encode(text))
+        decoder = CaesarDecoder(args.key, args.alphabet) if args.cipher == 'caesar' else \
+            VigenereDecoder(args.key, alphabet=args.alphabet)
+    run_encoder(decoder, args, binary_input=args.cipher == 'vernam' and args.vernam_format == 'raw')
 
 
 def train(args):
-    trainer = BonusTrainer(args.n) if args.bonus_mode else DefaultTrainer()
-    text = args.text_file.read() if args.text_file else sys.stdin.read()
-    TextChecker.check(text)
-    trainer.feed(text)
-    args.model_file.write(trainer.get_json_model())
+    from main.train import get_trainer, train_files
+
+    if args.bonus_mode and args.n is None:
+        raise Exception('Bonus mode requires --n')
+    n = args.n if args.bonus_mode else None
+    chunk_size = args.chunk_size or DEFAULT_CHUNK_SIZE
+    if args.text_dir:
+        paths = sorted(os.path.join(args.text_dir, name) for name in os.listdir(args.text_dir))
+        trainer = train_files([path for path in paths if os.path.isfile(path)], n, args.workers, args.checkpoint,
+                              chunk_size, args.alphabet)
+    else:
+        trainer = get_trainer(n, args.alphabet)
+        trainer.feed_file(args.text_file if args.text_file else sys.stdin, chunk_size)
+    model_format = args.model_format
+    if model_format == 'auto':
+        model_format = 'json' if args.model_file.name.endswith('.json') else 'binary'
+    if model_format == 'json':
+        args.model_file.write(trainer.get_json_model().encode('utf-8'))
+    else:
+        args.model_file.write(trainer.get_binary_model())
+
+
+def compile_command(args):
+    from main.model import compile_log_model, dump_log_model, load_model
+
+    model = compile_log_model(load_model(args.model_file, args.n), args.n, args.smoothing, args.alpha)
+    args.output_file.write(dump_log_model(model))
 
 
 def hack(args):
-    try:
-        model = json.load(args.model_file)
-    except json.JSONDecodeError:
-        raise Exception('Incorrect model file')
+    import json
+
+    from main.hack import CaesarHacker, CaesarBonusHacker, VigenereHacker, VigenereBonusHacker
+    from main.model import compile_model, load_model
+    from main.text_checker import TextChecker
+
+    model = load_model(args.model_file, args.n if args.bonus_mode else None)
     if args.bonus_mode:
+        model = compile_model(model, args.n, args.alphabet)
         if args.cipher == 'vigenere':
-            raise NotImplementedError('Current version does not support bonus hack for vigenere cipher')
+            hacker = VigenereBonusHacker(model, args.n, args.metric or 'squares', args.key_length_method,
+                                         args.margin, args.prefix_size)
         else:
-            hacker = CaesarBonusHacker(model, args.n)
+            hacker = CaesarBonusHacker(model, args.n, args.margin, args.prefix_size, args.metric)
     else:
-        hacker = CaesarHacker(model) if args.cipher == 'caesar' else VigenereHacker(model)
-    text = args.input_file.read() if args.input_file else sys.stdin.read()
-    TextChecker.check(text)
-    if args.output_file:
-        args.output_file.write(hacker.hack(text))
-    else:
-        sys.stdout.write(hacker.hack(text))
+        if args.cipher == 'caesar':
+            hacker = CaesarHacker(model, args.metric or 'squares', args.margin, args.prefix_size, args.alphabet)
+        else:
+            hacker = VigenereHacker(model, args.metric or 'squares', args.key_length_method, args.margin,
+                                    args.prefix_size, args.alphabet)
 
+    def report(result):
+        if args.result_file:
+            args.result_file.write(json.dumps(result.get_dict()) + '\n')
+            args.result_file.flush()
 
-if __name__ == '__main__':
+    if args.mmap:
+        with map_files(args) as (source, target):
+            TextChecker.check_buffer(source, alphabet=hacker.alphabet)
+            result = hacker.search_buffer(source)
+            result.decoder.encode_buffer(source, target)
+        report(result)
+        return
+    input_opener, output_opener = open_files(args)
+    with input_opener as input_file, output_opener as output_file:
+        if args.records:
+            delimiter = RECORD_DELIMITERS[args.records]
+            for record in TextChecker.check_stream(read_records(input_file, delimiter), hacker.alphabet):
+                result = hacker.get_result(record)
+                output_file.write(result.text + delimiter)
+                output_file.flush()
+                report(result)
+            return
+        text = input_file.read()
+        TextChecker.check(text, 0, hacker.alphabet)
+        result = hacker.get_result(text)
+        output_file.write(result.text)
+        report(result)
+
+
+def parse_model_spec(spec: str):
+    name, _, path = spec.partition('=')
+    if not name or not path:
+        raise Exception('Model must be given as NAME=PATH or NAME=PATH:N: {}'.format(spec))
+    prefix, _, n = path.rpartition(':')
+    if prefix and n.isdigit():
+        return name, (prefix, int(n))
+    return name, (path, None)
+
+
+def serve(args):
+    import asyncio
+
+    from main.server import EncryptorServer
+
+    models = dict(parse_model_spec(spec) for spec in args.model or [])
+    server = EncryptorServer(models, args.workers, args.max_request_size, args.max_pending)
+    try:
+        asyncio.run(server.serve_forever(args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+
+def run_profiled(args):
+    from main.instrument import Profiler
+
+    with Profiler(args.profile_allocations) as profiler:
+        args.func(args)
+    report = profiler.get_json() + '\n' if args.profile == 'json' else profiler.get_prometheus()
+    (args.profile_file or sys.stderr).write(report)
+
+
+def add_encode_arguments(parser: argparse.ArgumentParser):
+    parser.set_defaults(mode='encode', func=encode)
+    parser.add_argument('--cipher', choices=['caesar', 'vigenere', 'vernam'], help='Cipher type', required=True)
+    parser.add_argument('--key', help='Cipher key', required=True)
+    parser.add_argument('--alphabet', help=ALPHABET_HELP + ', latin by default')
+    parser.add_argument('--input-file', help='Input file')
+    parser.add_argument('--output-file', help='Output file')
+    parser.add_argument('--chunk-size', type=int, help='Process input by chunks of given size in characters')
+    parser.add_argument('--mmap', action='store_true', help='Map input and output files into memory')
+    parser.add_argument('--workers', type=int, default=1, help='Number of worker processes')
+    parser.add_argument('--vernam-format', choices=['bits', 'hex', 'raw'], default='bits',
+                        help='Vernam ciphertext format: legacy bit string, hex or raw bytes of utf-8 text')
+
+
+def add_decode_arguments(parser: argparse.ArgumentParser):
+    parser.set_defaults(mode='decode', func=decode)
+    parser.add_argument('--cipher', choices=['caesar', 'vigenere', 'vernam'], help='Cipher type', required=True)
+    parser.add_argument('--key', help='Cipher key', required=True)
+    parser.add_argument('--alphabet', help=ALPHABET_HELP + ', latin by default')
+    parser.add_argument('--input-file', help='Input file')
+    parser.add_argument('--output-file', help='Output file')
+    parser.add_argument('--chunk-size', type=int, help='Process input by chunks of given size in characters')
+    parser.add_argument('--mmap', action='store_true', help='Map input and output files into memory')
+    parser.add_argument('--workers', type=int, default=1, help='Number of worker processes')
+    parser.add_argument('--vernam-format', choices=['bits', 'hex', 'raw'], default='bits',
+                        help='Vernam ciphertext format: legacy bit string, hex or raw bytes of utf-8 text')
+
+
+def add_train_arguments(parser: argparse.ArgumentParser):
+    parser.set_defaults(mode='train', func=train)
+    parser.add_argument('--text-file', type=argparse.FileType('r'), help='Input file')
+    parser.add_argument('--text-dir', help='Directory of corpus files, they are counted in parallel')
+    parser.add_argument('--workers', type=int, default=1, help='Number of worker processes for --text-dir')
+    parser.add_argument('--checkpoint', help='Checkpoint file for --text-dir, training resumes from it')
+    parser.add_argument('--chunk-size', type=int, help='Read corpus by chunks of given size in characters')
+    parser.add_argument('--model-file', type=argparse.FileType('wb'), help='Model file', required=True)
+    parser.add_argument('--model-format', choices=['auto', 'binary', 'json'], default='auto',
+                        help='Model file format, auto is json for .json files and binary otherwise')
+    parser.add_argument('--bonus', dest='bonus_mode', action='store_true')
+    parser.add_argument('--n', type=int, help='Size of a n-chart model')
+    parser.add_argument('--alphabet', help=ALPHABET_HELP + ' of frequency model, latin by default')
+
+
+def add_compile_arguments(parser: argparse.ArgumentParser):
+    parser.set_defaults(mode='compile', func=compile_command)
+    parser.add_argument('--model-file', help='N-chart model file in json or binary format', required=True)
+    parser.add_argument('--n', type=int, help='Size of a n-chart model', required=True)
+    parser.add_argument('--output-file', type=argparse.FileType('wb'), help='Compiled model file', required=True)
+    parser.add_argument('--smoothing', choices=['good_turing', 'additive'], default='good_turing',
+                        help='Smoothing of n-chart probabilities')
+    parser.add_argument('--alpha', type=float, default=1.0, help='Count added to every n-chart by additive smoothing')
+
+
+def add_hack_arguments(parser: argparse.ArgumentParser):
+    parser.set_defaults(mode='hack', func=hack)
+    parser.add_argument('--cipher', choices=['caesar', 'vigenere'], help='Cipher type', required=True)
+    parser.add_argument('--input-file', help='Input file')
+    parser.add_argument('--output-file', help='Output file')
+    parser.add_argument('--model-file', help='Model file in json or binary format', required=True)
+    parser.add_argument('--bonus', dest='bonus_mode', action='store_true')
+    parser.add_argument('--n', type=int, help='Size of a n-chart model')
+    parser.add_argument('--alphabet', help=ALPHABET_HELP + ' of text, by default alphabet of the model')
+    parser.add_argument('--metric', choices=['squares', 'chi_squared', 'log_likelihood', 'counts'],
+                        help='Scoring metric: squares (default), chi_squared or log_likelihood for frequency model, '
+                             'counts or log_likelihood for Caesar n-chart model, default for compiled model')
+    parser.add_argument('--key-length-method', choices=['first-column', 'mean-ic', 'autocorrelation', 'kasiski'],
+                        default='autocorrelation', help='Vigenere key length detection method')
+    parser.add_argument('--records', choices=['newline', 'nul'],
+                        help='Hack every newline or NUL delimited record of input separately')
+    parser.add_argument('--mmap', action='store_true', help='Map input and output files into memory')
+    parser.add_argument('--margin', type=float,
+                        help='Score growing prefixes of text until relative margin of the best key reaches it')
+    parser.add_argument('--prefix-size', type=int, default=DEFAULT_PREFIX_SIZE,
+                        help='Size of the first scored prefix in characters for --margin')
+    parser.add_argument('--result-file', type=argparse.FileType('w'),
+                        help='Write found key, confidence and scores of every text as json lines')
+
+
+def add_serve_arguments(parser: argparse.ArgumentParser):
+    parser.set_defaults(mode='serve', func=serve)
+    parser.add_argument('--host', default='127.0.0.1', help='TCP host')
+    parser.add_argument('--port', type=int, default=8765, help='TCP port')
+    parser.add_argument('--unix', help='Unix socket path, used instead of TCP')
+    parser.add_argument('--model', action='append',
+                        help='Model for hack requests as NAME=PATH, or NAME=PATH:N for a n-chart model')
+    parser.add_argument('--workers', type=int, help='Number of worker processes, by default number of CPUs')
+    parser.add_argument('--max-request-size', type=int, default=DEFAULT_MAX_REQUEST_SIZE,
+                        help='Maximal request size in bytes')
+    parser.add_argument('--max-pending', type=int,
+                        help='Maximal number of requests processed by workers at once, by default twice workers')
+
+
+def add_benchmark_arguments(parser: argparse.ArgumentParser):
+    from benchmarks import suite
+
+    parser.set_defaults(mode='benchmark', func=lambda args: parser.print_help())
+    suite.add_arguments(parser)
+
+
+COMMANDS = {
+    'encode': ('Encode help', add_encode_arguments),
+    'decode': ('Decode help', add_decode_arguments),
+    'train': ('Train help', add_train_arguments),
+    'compile': ('Compile help', add_compile_arguments),
+    'hack': ('Hack help', add_hack_arguments),
+    'serve': ('Serve help', add_serve_arguments),
+    'benchmark': ('Benchmark help', add_benchmark_arguments)
+}
+
+
+def build_parser(command: str):
     parser = argparse.ArgumentParser(description='Allows you to work with caesar/vigenere/vernam ciphers.',
                                      formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     subparsers = parser.add_subparsers()
 
-    # encode
-    parser_encode = subparsers.add_parser('encode', help='Encode help')
-    parser_encode.set_defaults(mode='encode', func=encode)
-    parser_encode.add_argument('--cipher', choices=['caesar', 'vigenere', 'vernam'], help='Cipher type', required=True)
-    parser_encode.add_argument('--key', help='Cipher key', required=True)
-    parser_encode.add_argument('--input-file', type=argparse.FileType('r'), help='Input file')
-    parser_encode.add_argument('--output-file', type=argparse.FileType('w'), help='Output file')
-
-    # decode
-    parser_decode = subparsers.add_parser('decode', help='Decode help')
-    parser_decode.set_defaults(mode='decode', func=decode)
-    parser_decode.add_argument('--cipher', choices=['caesar', 'vigenere', 'vernam'], help='Cipher type', required=True)
-    parser_decode.add_argument('--key', help='Cipher key', required=True)
-    parser_decode.add_argument('--input-file', type=argparse.FileType('r'), help='Input file')
-    parser_decode.add_argument('--output-file', type=argparse.FileType('w'), help='Output file')
-
-    # train
-    parser_train = subparsers.add_parser('train', help='Train help')
-    parser_train.set_defaults(mode='train', func=train)
-    parser_train.add_argument('--text-file', type=argparse.FileType('r'), help='Input file')
-    parser_train.add_argument('--model-file', type=argparse.FileType('w'), help='Model file', required=True)
-    parser_train.add_argument('--bonus', dest='bonus_mode', action='store_true')
-    parser_train.add_argument('--n', type=int, help='Size of a n-chart model')
-
-    # hack
-    parser_hack = subparsers.add_parser('hack', help='Hack help')
-    parser_hack.set_defaults(mode='hack', func=hack)
-    parser_hack.add_argument('--cipher', choices=['caesar', 'vigenere'], help='Cipher type', required=True)
-    parser_hack.add_argument('--input-file', type=argparse.FileType('r'), help='Input file')
-    parser_hack.add_argument('--output-file', type=argparse.FileType('w'), help='Output file')
-    parser_hack.add_argument('--model-file', type=argparse.FileType('r'), help='Model file', required=True)
-    parser_hack.add_argument('--bonus', dest='bonus_mode', action='store_true')
-    parser_hack.add_argument('--n', type=int, help='Size of a n-chart model')
-
-    arguments = parser.parse_args()
-    arguments.func(arguments)
+    # profiling options of encode, decode, train and hack
+    profile_parser = argparse.ArgumentParser(add_help=False)
+    profile_parser.add_argument('--profile', nargs='?', const='json', choices=['json', 'prometheus'],
+                                help='Report wall time, characters and allocations of every stage')
+    profile_parser.add_argument('--profile-file', type=argparse.FileType('w'),
+                                help='Profile report file, by default stderr')
+    profile_parser.add_argument('--profile-allocations', action='store_true',
+                                help='Trace allocations for --profile, this slows processing down')
+
+    for name, (help_text, add_arguments) in COMMANDS.items():
+        subparser = subparsers.add_parser(name, help=help_text,
+                                          parents=[profile_parser] if name in PROFILED_COMMANDS else [])
+        if name == command:
+            add_arguments(subparser)
+    return parser
+
+
+def main(argv: list = None):
+    argv = sys.argv[1:] if argv is None else argv
+    command = next((argument for argument in argv if not argument.startswith('-')), None)
+    parser = build_parser(command)
+    arguments = parser.parse_args(argv)
+    if not hasattr(arguments, 'func'):
+        parser.error('Command is required')
+    if getattr(arguments, 'profile', None):
+        run_profiled(arguments)
+    else:
+        arguments.func(arguments)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+import re
+import string
+from functools import lru_cache
+
+# alphabets are limited so that letter numbers fit in bytes, see Alphabet.get_codes
+MAX_ALPHABET_POWER = 255
+
+CYRILLIC_LETTERS = 'абвгдеёжзийклмнопрстуфхцчшщъыьэюя'
+
+
+class TranslationTable(dict):
+    """
+    Translation table for str.translate with precomputed letters, other symbols are cached on first lookup
+    """
+
+    def __init__(self, mapping: dict, keep: bool = True):
+        """
+        :param mapping: Dict of letter code to its translation
+        :param keep: True to keep other symbols, False to delete them
+        """
+        super().__init__(mapping)
+        self.keep = keep
+
+    def __missing__(self, code: int):
+        """
+        Cache translation of symbol out of alphabet
+        :param code: symbol's code
+        :return: The same code or None to delete symbol
+        """
+        value = code if self.keep else None
+        self[code] = value
+        return value
+
+    def translate(self, text: str):
+        """
+        Translate text
+        :param text: text to translate
+        :return: Translated text
+        """
+        return text.translate(self)
+
+
+class Alphabet:
+    """
+    Ordered set of cipher letters with precomputed tables from symbol codes to letter numbers and from letter
+    numbers to letters. Letters keep their case, so either all letters have case or none of them, e.g. latin+cyrillic
+    but not latin+digits. Symbols out of alphabet are not changed and not counted
+    """
+
+    def __init__(self, letters: str, name: str = None):
+        """
+        :param letters: Letters in alphabet order, upper case letters are added for every letter that has them
+        :param name: Alphabet name, letters by default
+        :raises: Exception if letters are not unique, too many or mix letters with and without case
+        """
+        self.letters = letters.lower()
+        self.name = name or self.letters
+        self.power = len(self.letters)
+        if not self.power or len(set(self.letters)) != self.power:
+            raise Exception('Alphabet letters must be unique')
+        if self.power > MAX_ALPHABET_POWER:
+            raise Exception('Alphabet cannot have more than {} letters'.format(MAX_ALPHABET_POWER))
+        self.upper_letters = ''.join(letter.upper() if len(letter.upper()) == 1 else letter
+                                     for letter in self.letters)
+        if len(set(self.upper_letters)) != self.power:
+            raise Exception('Alphabet letters must be unique')
+        # an upper case letter shifted to a letter without case could not be restored by decoding
+        if len({upper != letter for upper, letter in zip(self.upper_letters, self.letters)}) > 1:
+            raise Exception('Alphabet cannot mix letters with and without case')
+
+        # code of every letter of both cases to its number
+        self.numbers = {}
+        for case_letters in (self.upper_letters, self.letters):
+            self.numbers.update((ord(letter), number) for number, letter in enumerate(case_letters))
+        self.letter_set = frozenset(self.letters + self.upper_letters)
+
+        self.shift_tables = [TranslationTable({ord(letter): case_letters[(number + shift) % self.power]
+                                               for case_letters in (self.upper_letters, self.letters)
+                                               for number, letter in enumerate(case_letters)})
+                             for shift in range(self.power)]
+        self.code_table = TranslationTable({code: number for code, number in self.numbers.items()}, False)
+        self.count_table = TranslationTable(dict.fromkeys(self.numbers), True)
+
+        letter_class = '[{}]'.format(re.escape(''.join(sorted(self.letter_set))))
+        self.letter_runs = re.compile('({}+)'.format(letter_class))
+        self.foreign_letter = re.compile('(?!{})[^\\W\\d_]'.format(letter_class))
+
+        # tables for vectorized backend: letter number by code (-1 for other symbols), case by code
+        # and codes of letters by case and number
+        self.number_array = [-1] * (max(self.numbers) + 1)
+        self.upper_array = [False] * (max(self.numbers) + 1)
+        for code, number in self.numbers.items():
+            self.number_array[code] = number
+        for letter in self.upper_letters:
+            self.upper_array[ord(letter)] = letter != letter.lower()
+        self.letter_array = [[ord(letter) for letter in self.letters], [ord(letter) for letter in self.upper_letters]]
+
+    def __repr__(self):
+        return 'Alphabet({!r})'.format(self.name)
+
+    def __reduce__(self):
+        # encoders compare alphabets by identity, so shared alphabets are restored as the same objects in workers
+        return _restore_alphabet, (self.letters, self.name)
+
+    def get_numbers(self, word: str):
+        """
+        Get numbers of letters of word, e.g. of a key
+        :param word: Word of alphabet letters
+        :return: List of letter numbers
+        :raises: Exception if word contains symbols out of alphabet
+        """
+        if any(symbol not in self.letter_set for symbol in word):
+            raise Exception('Key must consist of {} alphabet letters'.format(self.name))
+        return [self.numbers[ord(symbol)] for symbol in word]
+
+    def get_codes(self, text: str):
+        """
+        Encode letters of text into compact array of letter numbers, other symbols are skipped
+        :param text: Text to encode
+        :return: Bytes with number in range [0, power) for every letter of text
+        """
+        return text.translate(self.code_table).encode('latin-1')
+
+    def count(self, text: str):
+        """
+        Count letters in text
+        :param text: text to count letters in
+        :return: Number of letters
+        """
+        return len(text) - len(text.translate(self.count_table))
+
+    def find_foreign_letter(self, text: str):
+        """
+        Find the first letter not from alphabet
+        :param text: text to search in
+        :return: Offset of the letter in text or None
+        """
+        match = self.foreign_letter.search(text)
+        return match.start() if match else None
+
+
+LATIN = Alphabet(string.ascii_lowercase, 'latin')
+CYRILLIC = Alphabet(CYRILLIC_LETTERS, 'cyrillic')
+DIGITS = Alphabet(string.digits, 'digits')
+
+ALPHABETS = {alphabet.name: alphabet for alphabet in (LATIN, CYRILLIC, DIGITS)}
+
+
+def get_alphabet(spec=None):
+    """
+    Get alphabet by name, combination of names or letters
+    :param spec: Alphabet, name from ALPHABETS, names joined by '+' (e.g. 'latin+cyrillic'), custom letters
+    or None for latin alphabet
+    :return: Alphabet, the same object for the same spec
+    """
+    if spec is None:
+        return LATIN
+    if isinstance(spec, Alphabet):
+        return spec
+    return _get_alphabet(spec)
+
+
+@lru_cache(maxsize=None)
+def _get_alphabet(spec: str):
+    if spec in ALPHABETS:
+        return ALPHABETS[spec]
+    names = spec.split('+')
+    if len(names) > 1 and all(name in ALPHABETS for name in names):
+        return Alphabet(''.join(ALPHABETS[name].letters for name in names), spec)
+    alphabet = Alphabet(spec)
+    return next((known for known in ALPHABETS.values() if known.letters == alphabet.letters), alphabet)
+
+
+def _restore_alphabet(letters: str, name: str):
+    try:
+        alphabet = get_alphabet(name)
+    except Exception:
+        alphabet = None
+    if alphabet is not None and alphabet.letters == letters:
+        return alphabet
+    return Alphabet(letters, name)
@@ -1,2 +1,6 @@
 ALPHABET_POWER = 26
 ASCII_BIT_COUNT = 7
+DEFAULT_CHUNK_SIZE = 1 << 20
+DEFAULT_PREFIX_SIZE = 1 << 10
+PREFIX_GROWTH = 4
+DEFAULT_MAX_REQUEST_SIZE = 1 << 24
@@ -1,6 +1,13 @@
 import abc
+import itertools
+import re
+import string
+from functools import lru_cache
 
-from main.config import ALPHABET_POWER, ASCII_BIT_COUNT
+from main import vectorized
+from main.alphabet import LATIN, get_alphabet
+from main.config import ALPHABET_POWER, ASCII_BIT_COUNT, DEFAULT_CHUNK_SIZE
+from main.instrument import instrumented
 
 
 class Encoder:
@@ -11,8 +18,9 @@ class Encoder:
     __metaclass__ = abc.ABCMeta
 
     @abc.abstractmethod
-    def __init__(self, key):
+    def __init__(self, key, alphabet=None):
         self.key = key
+        self.alphabet = get_alphabet(alphabet)
 
     @abc.abstractmethod
     def calc(self, symbol: str, position: int):
@@ -24,51 +32,308 @@ class Encoder:
         """
         pass
 
-    def encode(self, text: str):
+    def encode_chunk(self, text: str, position: int):
         """
-        Encode/decode text
+        Encode/decode part of text
         :param text: text to encode/decode
-        :return: Encoded/decoded text
+        :param position: position of the first letter of the chunk in the whole text
+        :return: Encoded/decoded text and position of the letter following the chunk
         """
         result = []
-        position = 0
         for symbol in text:
             if symbol.isalpha():
                 result.append(self.calc(symbol, position))
                 position += 1
             else:
                 result.append(symbol)
-        return ''.join(result)
+        return ''.join(result), position
 
+    @instrumented
+    def encode(self, text: str):
+        """
+        Encode/decode text
+        :param text: text to encode/decode
+        :return: Encoded/decoded text
+        """
+        return self.encode_chunk(text, 0)[0]
 
-class CaesarEncoder(Encoder):
+    def encode_stream(self, chunks, position: int = 0):
+        """
+        Encode/decode text given by chunks, carrying letter position across chunk boundaries
+        :param chunks: iterable of text chunks
+        :param position: position of the first letter
+        :return: Generator of encoded/decoded chunks
+        """
+        for chunk in chunks:
+            result, position = self.encode_chunk(chunk, position)
+            yield result
+
+    @instrumented
+    def encode_file(self, input_file, output_file, chunk_size: int = DEFAULT_CHUNK_SIZE):
+        """
+        Encode/decode file to file in constant memory
+        :param input_file: text file to read from
+        :param output_file: text file to write to
+        :param chunk_size: number of characters read at once
+        """
+        for result in self.encode_stream(iter(lambda: input_file.read(chunk_size), '')):
+            output_file.write(result)
+
+    @instrumented
+    def encode_parallel(self, text: str, workers: int = None, chunk_size: int = DEFAULT_CHUNK_SIZE):
+        """
+        Encode/decode text by chunks in process pool
+        :param text: text to encode/decode
+        :param workers: number of worker processes, number of CPUs by default
+        :param chunk_size: number of characters in one chunk
+        :return: Encoded/decoded text
+        """
+        chunks = [text[start:start + chunk_size] for start in range(0, len(text), chunk_size)]
+        count = count_letters if self.alphabet is LATIN else self.alphabet.count
+        positions = [0]
+        for chunk in chunks[:-1]:
+            positions.append(positions[-1] + count(chunk))
+
+        # imported on use, concurrent.futures is slow to import and most commands do not need it
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(workers) as executor:
+            return ''.join(result for result, position in executor.map(self.encode_chunk, chunks, positions))
+
+    def encode_bytes_chunk(self, data: bytes, position: int):
+        """
+        Encode/decode part of ascii/utf-8 buffer, only letters of alphabet are changed
+        :param data: bytes-like buffer to encode/decode
+        :param position: position of the first letter of the chunk in the whole text
+        :return: Encoded/decoded bytes and position of the letter following the chunk
+        :raises: Exception if letters of alphabet change utf-8 length of buffer
+        """
+        if self.alphabet is not LATIN:
+            result, position = self.encode_chunk(bytes(data).decode('utf-8', 'surrogateescape'), position)
+            result = result.encode('utf-8', 'surrogateescape')
+            if len(result) != len(data):
+                raise Exception('Letters of {} alphabet have different utf-8 lengths'.format(self.alphabet.name))
+            return result, position
+        # non-ascii bytes become lone surrogates, which are not letters and survive the round trip
+        result, position = self.encode_chunk(bytes(data).decode('ascii', 'surrogateescape'), position)
+        return result.encode('ascii', 'surrogateescape'), position
+
+    def encode_bytes(self, data: bytes):
+        """
+        Encode/decode ascii/utf-8 buffer
+        :param data: bytes-like buffer to encode/decode
+        :return: Encoded/decoded bytes
+        """
+        return self.encode_bytes_chunk(data, 0)[0]
+
+    @instrumented
+    def encode_buffer(self, source, target, position: int = 0, chunk_size: int = DEFAULT_CHUNK_SIZE):
+        """
+        Encode/decode ascii/utf-8 buffer into writable buffer of the same length, e.g. memory-mapped files
+        :param source: bytes-like buffer to encode/decode
+        :param target: writable bytes-like buffer for result
+        :param position: position of the first letter
+        :param chunk_size: number of bytes processed at once
+        :return: Position of the letter following the buffer
+        """
+        with memoryview(source) as source_view, memoryview(target) as target_view:
+            if len(source_view) != len(target_view):
+                raise Exception('Source and target buffers must have the same length')
+            start = 0
+            while start < len(source_view):
+                # chunks end on utf-8 symbol boundaries, so that letters of non-ascii alphabets are not split
+                end = start + chunk_size
+                while start + 1 < end < len(source_view) and source_view[end] & 0xc0 == 0x80:
+                    end -= 1
+                with source_view[start:end] as chunk:
+                    result, position = self.encode_bytes_chunk(chunk, position)
+                target_view[start:start + len(result)] = result
+                start = end
+        return position
+
+
+NON_ASCII = re.compile('[^\x00-\x7f]')
+LETTER_BYTES = (string.ascii_lowercase + string.ascii_uppercase).encode('ascii')
+
+
+def has_non_ascii_letters(text: str):
     """
-    Class for encoding by Caesar cipher
+    Check if text contains letters out of ascii range
+    :param text: text to check
+    :return: True if there is at least one non-ascii letter
     """
+    if text.isascii():
+        return False
+    return any(symbol.isalpha() for symbol in set(NON_ASCII.findall(text)))
 
-    def __init__(self, key):
-        key = int(key) % ALPHABET_POWER
-        super().__init__(key)
 
-    def calc(self, symbol: str, position: int):
+def count_letters(text: str):
+    """
+    Count letters in text
+    :param text: text to count letters in
+    :return: Number of letters
+    """
+    if not has_non_ascii_letters(text):
+        data = text.encode('utf-8', 'surrogatepass')
+        return len(data) - len(data.translate(None, LETTER_BYTES))
+    return sum(1 for symbol in text if symbol.isalpha())
+
+
+def get_backend(backend: str = None):
+    """
+    Choose backend for Vigenere encoders/decoders
+    :param backend: 'numpy', 'python' or None for the fastest available
+    :return: Backend name, 'auto' if numpy is used only for inputs where it pays off, see vectorized.pays_off
+    """
+    if backend is None:
+        return 'auto' if vectorized.HAS_NUMPY else 'python'
+    if backend not in ('numpy', 'python'):
+        raise Exception('Unknown backend: {}'.format(backend))
+    if backend == 'numpy' and not vectorized.HAS_NUMPY:
+        raise Exception('NumPy backend requires numpy to be installed')
+    return backend
+
+
+def use_vectorized(backend: str, size: int):
+    """
+    Check if Vigenere encoder/decoder should process input with vectorized backend
+    :param backend: Backend name from get_backend
+    :param size: Input size
+    :return: True for numpy backend, and for auto backend if numpy pays off
+    """
+    return backend == 'numpy' or backend == 'auto' and vectorized.pays_off(size)
+
+
+class CaesarTable(dict):
+    """
+    Translation table for Caesar shift, usable with str.translate
+    """
+
+    def __init__(self, shift: int):
+        super().__init__()
+        self.shift = shift % ALPHABET_POWER
+        for code in range(128):
+            self[code] = code
+        for alphabet in (string.ascii_lowercase, string.ascii_uppercase):
+            for letter_id, letter in enumerate(alphabet):
+                self[ord(letter)] = alphabet[(letter_id + self.shift) % ALPHABET_POWER]
+        self.byte_table = bytes.maketrans(
+            (string.ascii_lowercase + string.ascii_uppercase).encode('ascii'),
+            ''.join(self[ord(letter)] for letter in string.ascii_lowercase + string.ascii_uppercase).encode('ascii'))
+
+    def __missing__(self, code: int):
         """
-        Get encoded/decoded symbol
-        :param symbol: char to encode/decode
-        :param position: symbol's position in text
-        :return: Calculated symbol
+        Calculate and cache translation for non-ascii symbol the same way as Encoder.calc does
+        :param code: symbol's code
+        :return: Translated symbol
+        """
+        symbol = chr(code)
+        if symbol.isalpha():
+            code_a = ord('A') if symbol.isupper() else ord('a')
+            symbol = chr(code_a + (code - code_a + self.shift) % ALPHABET_POWER)
+        self[code] = symbol
+        return symbol
+
+    def translate(self, text: str):
         """
-        code_a = ord('A') if symbol.isupper() else ord('a')
-        return chr(code_a + (ord(symbol) - code_a + self.key) % ALPHABET_POWER)
+        Translate text, going through bytes when text has no non-ascii letters
+        :param text: text to translate
+        :return: Translated text
+        """
+        if text.isascii():
+            return text.encode('ascii').translate(self.byte_table).decode('ascii')
+        if not has_non_ascii_letters(text):
+            return text.encode('utf-8', 'surrogatepass').translate(self.byte_table).decode('utf-8', 'surrogatepass')
+        return text.translate(self)
+
+
+CAESAR_TABLES = [CaesarTable(shift) for shift in range(ALPHABET_POWER)]
 
 
-class VigenereEncoder(Encoder):
+def get_shift_table(alphabet, shift: int):
     """
-    Class for encoding by Vigenere cipher
+    Get precomputed translation table of Caesar shift
+    :param alphabet: Alphabet
+    :param shift: shift of letters
+    :return: CaesarTable for latin alphabet, alphabet's TranslationTable for others
     """
+    if alphabet is LATIN:
+        return CAESAR_TABLES[shift % ALPHABET_POWER]
+    return alphabet.shift_tables[shift % alphabet.power]
+
+
+def shift_columns(text: str, tables: list, position: int, alphabet):
+    """
+    Shift letters of text by translation tables of key positions, letters of every key position are translated
+    at once and put back by runs
+    :param text: text to shift
+    :param tables: translation table for every key position
+    :param position: position of the first letter of text in the whole text
+    :param alphabet: Alphabet of letters
+    :return: Shifted text and position of the letter following the text
+    """
+    parts = alphabet.letter_runs.split(text)
+    runs = parts[1::2]
+    letters = ''.join(runs)
+    length = len(tables)
+    columns = [letters[start::length].translate(tables[(position + start) % length]) for start in range(length)]
+    shifted = ''.join(map(''.join, itertools.zip_longest(*columns, fillvalue='')))
+    ends = list(itertools.accumulate(map(len, runs)))
+    parts[1::2] = map(shifted.__getitem__, map(slice, [0] + ends[:-1], ends))
+    return ''.join(parts), position + len(letters)
+
+
+# number of compiled Vigenere keys kept for next encoders and decoders with the same key
+KEY_SCHEDULE_CACHE_SIZE = 1024
+
+
+@lru_cache(maxsize=KEY_SCHEDULE_CACHE_SIZE)
+def get_key_schedule(key: str, alphabet, decode: bool):
+    """
+    Compile Vigenere key into shifts and translation tables of its positions, compiled keys are shared by all
+    encoders and decoders, see key_schedule_stats
+    :param key: Vigenere key
+    :param alphabet: Alphabet of key and text
+    :param decode: True for decoding schedule
+    :return: Lower case key, tuple of shifts and tuple of translation tables of key positions
+    :raises: Exception if key is empty or not a word
+    """
+    if not key:
+        raise Exception('Key must not be empty')
+    key = key.lower()
+    if alphabet is LATIN:
+        if decode and not key.isalpha():
+            raise Exception('Key must be single word')
+        offsets = tuple((ord(letter) - ord('a')) % ALPHABET_POWER for letter in key)
+    else:
+        offsets = tuple(alphabet.get_numbers(key))
+    if decode:
+        offsets = tuple(-offset % alphabet.power for offset in offsets)
+    return key, offsets, tuple(get_shift_table(alphabet, offset) for offset in offsets)
+
+
+def key_schedule_stats():
+    """
+    Get statistics of compiled Vigenere keys cache
+    :return: Dict with numbers of hits and misses, number of cached keys and cache size
+    """
+    info = get_key_schedule.cache_info()
+    return {'hits': info.hits, 'misses': info.misses, 'size': info.currsize, 'max_size': info.maxsize}
 
-    def __init__(self, key):
-        key = key.lower()
-        super().__init__(key)
+
+class CaesarCipher(Encoder):
+    """
+    Base class for Caesar encoder and decoder, which translate text with precomputed table of the shift
+    """
+
+    # True for decoder, which shifts letters back
+    decoding = False
+
+    def __init__(self, key, alphabet=None):
+        alphabet = get_alphabet(alphabet)
+        key = int(key) % alphabet.power
+        super().__init__(key, alphabet)
+        self.table = get_shift_table(alphabet, -key if self.decoding else key)
 
     def calc(self, symbol: str, position: int):
         """
@@ -77,19 +342,78 @@ class VigenereEncoder(Encoder):
         :param position: symbol's position in text
         :return: Calculated symbol
         """
-        code_a = ord('A') if symbol.isupper() else ord('a')
-        return chr(
-            code_a + (ord(symbol) + ord(self.key[position % len(self.key)]) - code_a - ord('a')) % ALPHABET_POWER)
+        return symbol.translate(self.table)
+
+    @instrumented
+    def encode(self, text: str):
+        """
+        Encode/decode text with precomputed translation table
+        :param text: text to encode/decode
+        :return: Encoded/decoded text
+        """
+        return self.table.translate(text)
+
+    def encode_chunk(self, text: str, position: int):
+        """
+        Encode/decode part of text with precomputed translation table
+        :param text: text to encode/decode
+        :param position: position of the first letter of the chunk in the whole text
+        :return: Encoded/decoded text and position of the letter following the chunk
+        """
+        if self.alphabet is not LATIN:
+            return self.table.translate(text), position + self.alphabet.count(text)
+        return self.table.translate(text), position + count_letters(text)
+
+    def encode_bytes(self, data: bytes):
+        """
+        Encode/decode ascii bytes with precomputed translation table
+        :param data: bytes to encode/decode
+        :return: Encoded/decoded bytes
+        """
+        if self.alphabet is not LATIN:
+            return super().encode_bytes(data)
+        return data.translate(self.table.byte_table)
+
+    def encode_bytes_chunk(self, data: bytes, position: int):
+        """
+        Encode/decode part of ascii/utf-8 buffer with precomputed translation table
+        :param data: bytes-like buffer to encode/decode
+        :param position: position of the first letter of the chunk in the whole text
+        :return: Encoded/decoded bytes and position of the letter following the chunk
+        """
+        if self.alphabet is not LATIN:
+            return super().encode_bytes_chunk(data, position)
+        data = bytes(data)
+        return data.translate(self.table.byte_table), position + len(data) - len(data.translate(None, LETTER_BYTES))
+
+
+class CaesarEncoder(CaesarCipher):
+    """
+    Class for encoding by Caesar cipher
+    """
 
 
-class CaesarDecoder(Encoder):
+class CaesarDecoder(CaesarCipher):
     """
     Class for decoding by Caesar cipher
     """
 
-    def __init__(self, key):
-        key = int(key) % ALPHABET_POWER
-        super().__init__(key)
+    decoding = True
+
+
+class VigenereCipher(Encoder):
+    """
+    Base class for Vigenere encoder and decoder, which shift letters by compiled key schedule
+    """
+
+    # True for decoder, which shifts letters back
+    decoding = False
+
+    def __init__(self, key, backend: str = None, alphabet=None):
+        alphabet = get_alphabet(alphabet)
+        key, self.offsets, self.tables = get_key_schedule(key, alphabet, self.decoding)
+        super().__init__(key, alphabet)
+        self.backend = get_backend(backend)
 
     def calc(self, symbol: str, position: int):
         """
@@ -98,31 +422,53 @@ class CaesarDecoder(Encoder):
         :param position: symbol's position in text
         :return: Calculated symbol
         """
-        code_a = ord('A') if symbol.isupper() else ord('a')
-        return chr(code_a + (ord(symbol) - code_a + ALPHABET_POWER - self.key) % ALPHABET_POWER)
+        return symbol.translate(self.tables[position % len(self.tables)])
+
+    def encode_chunk(self, text: str, position: int):
+        """
+        Encode/decode part of text, using vectorized backend if it is enabled
+        :param text: text to encode/decode
+        :param position: position of the first letter of the chunk in the whole text
+        :return: Encoded/decoded text and position of the letter following the chunk
+        """
+        if self.alphabet is not LATIN:
+            if use_vectorized(self.backend, len(text)):
+                data, count = vectorized.shift_alphabet_letters(text.encode('utf-32-le', 'surrogatepass'),
+                                                                self.alphabet, self.offsets, position)
+                return data.decode('utf-32-le', 'surrogatepass'), position + count
+            return shift_columns(text, self.tables, position, self.alphabet)
+        if has_non_ascii_letters(text):
+            return super().encode_chunk(text, position)
+        if use_vectorized(self.backend, len(text)):
+            data, count = vectorized.shift_letters(text.encode('utf-8', 'surrogatepass'), self.offsets, position)
+            return data.decode('utf-8', 'surrogatepass'), position + count
+        return shift_columns(text, self.tables, position, self.alphabet)
+
+    def encode_bytes_chunk(self, data: bytes, position: int):
+        """
+        Encode/decode part of ascii/utf-8 buffer, using vectorized backend if it is enabled
+        :param data: bytes-like buffer to encode/decode
+        :param position: position of the first letter of the chunk in the whole text
+        :return: Encoded/decoded bytes and position of the letter following the chunk
+        """
+        if self.alphabet is LATIN and use_vectorized(self.backend, len(data)):
+            data, count = vectorized.shift_letters(data, self.offsets, position)
+            return data, position + count
+        return super().encode_bytes_chunk(data, position)
 
 
-class VigenereDecoder(Encoder):
+class VigenereEncoder(VigenereCipher):
     """
-    Class for decoding by Vigenere cipher
+    Class for encoding by Vigenere cipher
     """
 
-    def __init__(self, key):
-        key = key.lower()
-        if not key.isalpha():
-            raise Exception('Key must be single word')
-        super().__init__(key)
 
-    def calc(self, symbol: str, position: int):
-        """
-        Get encoded/decoded symbol
-        :param symbol: char to encode/decode
-        :param position: symbol's position in text
-        :return: Calculated symbol
-        """
-        code_a = ord('A') if symbol.isupper() else ord('a')
-        return chr(code_a + (ord(symbol) - code_a - ord(self.key[position % len(self.key)]) + ord(
-            'a') + ALPHABET_POWER) % ALPHABET_POWER)
+class VigenereDecoder(VigenereCipher):
+    """
+    Class for decoding by Vigenere cipher
+    """
+
+    decoding = True
 
 
 class VernamEncoder:
@@ -133,6 +479,7 @@ class VernamEncoder:
     def __init__(self, key):
         self.key = int(key)
 
+    @instrumented
     def encode(self, text):
         """
         Encode/decode text
@@ -153,6 +500,7 @@ class VernamDecoder:
     def __init__(self, key):
         self.key = int(key)
 
+    @instrumented
     def encode(self, text: str):
         """
         Encode/decode text
@@ -164,3 +512,83 @@ class VernamDecoder:
         for symbol in range(0, len(binary_result), ASCII_BIT_COUNT):
             result.append(chr(int(binary_result[symbol:symbol + ASCII_BIT_COUNT], 2)))
         return ''.join(result)
+
+
+def xor_keystream(data: bytes, keystream: bytes, offset: int = 0):
+    """
+    XOR buffer with cyclic keystream in one pass
+    :param data: bytes-like buffer
+    :param keystream: key bytes, repeated over data
+    :param offset: position of data's first byte in the whole stream
+    :return: XORed bytes
+    """
+    size = len(data)
+    offset %= len(keystream)
+    keystream = keystream[offset:] + keystream[:offset]
+    if vectorized.pays_off(size):
+        return vectorized.xor_keystream(data, keystream)
+    stream = (keystream * (size // len(keystream) + 1))[:size]
+    return (int.from_bytes(data, 'big') ^ int.from_bytes(stream, 'big')).to_bytes(size, 'big')
+
+
+def get_keystream(key):
+    """
+    Get keystream bytes from integer key
+    :param key: non-negative integer key
+    :return: Key bytes in big-endian order
+    """
+    key = int(key)
+    if key < 0:
+        raise Exception('Key must be non-negative integer')
+    return key.to_bytes(max(1, (key.bit_length() + 7) // 8), 'big')
+
+
+class ByteVernamEncoder:
+    """
+    Class for encoding by Vernam cipher over utf-8 bytes
+    """
+
+    def __init__(self, key, output_format: str = 'hex'):
+        if output_format not in ('hex', 'raw'):
+            raise Exception('Unknown output format: {}'.format(output_format))
+        self.key = get_keystream(key)
+        self.output_format = output_format
+
+    @instrumented
+    def encode(self, text: str):
+        """
+        Encode text
+        :param text: text to encode
+        :return: Encoded text as hex string or raw bytes
+        """
+        result = xor_keystream(text.encode('utf-8'), self.key)
+        return result.hex() if self.output_format == 'hex' else result
+
+
+class ByteVernamDecoder:
+    """
+    Class for decoding by Vernam cipher over utf-8 bytes
+    """
+
+    def __init__(self, key, input_format: str = 'hex'):
+        if input_format not in ('hex', 'raw'):
+            raise Exception('Unknown input format: {}'.format(input_format))
+        self.key = get_keystream(key)
+        self.input_format = input_format
+
+    @instrumented
+    def encode(self, data):
+        """
+        Decode text
+        :param data: hex string or raw bytes to decode
+        :return: Decoded text
+        """
+        if self.input_format == 'hex':
+            try:
+                data = bytes.fromhex(data)
+            except ValueError:
+                raise Exception('Input is not a hex string')
+        try:
+            return xor_keystream(data, self.key).decode('utf-8')
+        except UnicodeDecodeError:
+            raise Exception('Wrong key: decoded data is not utf-8 text')
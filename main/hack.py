@@ -1,105 +1,266 @@
 import abc
-import string
-from copy import deepcopy
 
-from main.encode import CaesarDecoder
-from main.train import DefaultTrainer
-from main.config import ALPHABET_POWER
+from main import vectorized
+from main.alphabet import LATIN
+from main.encode import CaesarDecoder, VigenereDecoder
+from main.config import ALPHABET_POWER, DEFAULT_PREFIX_SIZE, PREFIX_GROWTH
+from main.instrument import instrumented
+from main.model import LogProbabilityModel, compile_model, marginal_counts, marginal_frequency_model
+from main.ngram import NgramCounter, ngram_windows, rotate_ngram
+from main.key_length import METHODS, letter_codes, count_codes, coincidence_index, detect_key_length, \
+    max_key_length
+from main.score import METRICS as SCORE_METRICS, NGRAM_METRICS, REFINE_SAMPLE_SIZE, SEARCH_KEY_LENGTH, \
+    REFINED_KEY_LENGTHS, KEY_LENGTH_TOLERANCE, count_letter_vector, score_shifts, best_shift, relative_margin, \
+    ngram_log_table, pair_log_table, chain_key, score_key, refine_key, score_columns
+
+
+class HackResult:
+    """
+    Result of hacking text: found key, its decoder, scores of candidate keys and confidence in the key
+    """
+
+    def __init__(self, key, decoder, scores: list, confidence: float, size: int):
+        self.key = key
+        self.decoder = decoder
+        self.scores = scores
+        self.confidence = confidence
+        self.size = size
+        self.text = None
+
+    def get_dict(self):
+        """
+        Get result for serialization
+        :return: Dict with key, confidence, number of scored characters and scores
+        """
+        return {'key': self.key, 'confidence': self.confidence, 'size': self.size, 'scores': self.scores}
 
 
 class Hacker:
     """
     Abstract class for hacking text
+
+    With margin given, text is scored on growing prefixes until confidence in the best key reaches the margin
     """
 
     __metaclass__ = abc.ABCMeta
 
     @abc.abstractmethod
-    def __init__(self, model):
+    def __init__(self, model, margin: float = None, prefix_size: int = DEFAULT_PREFIX_SIZE):
         self.model = model
+        self.alphabet = getattr(model, 'alphabet', LATIN)
+        if prefix_size < 1:
+            raise Exception('Prefix size must be positive')
+        self.margin = margin
+        self.prefix_size = prefix_size
 
     @abc.abstractmethod
-    def hack(self, text: str):
+    def evaluate(self, text: str):
         """
-        Decrypt text
+        Find key for the whole text
         :param text: Text to decrypt
-        :return: Decrypted text
+        :return: HackResult without decrypted text
         """
         pass
 
+    def prefix_sizes(self, size: int):
+        """
+        Get sizes of parts of text for scoring
+        :param size: Size of the whole text
+        :return: Generator of the whole size, or with margin given of growing prefix sizes ending with it
+        """
+        if self.margin is not None:
+            prefix_size = self.prefix_size
+            while prefix_size < size:
+                yield prefix_size
+                prefix_size *= PREFIX_GROWTH
+        yield size
+
+    def prefixes(self, text: str):
+        """
+        Get parts of text for scoring
+        :param text: Text to decrypt
+        :return: Generator of the whole text, or with margin given of growing prefixes ending with the whole text
+        """
+        for size in self.prefix_sizes(len(text)):
+            yield text[:size] if size < len(text) else text
 
-class CaesarHacker(Hacker):
-    """
-    Class for hacking Caesar cipher using frequency model
-    """
+    @instrumented
+    def search(self, text: str):
+        """
+        Find key for text, stopping at the first prefix with confidence not less than margin
+        :param text: Text to decrypt
+        :return: HackResult without decrypted text
+        """
+        result = None
+        for prefix in self.prefixes(text):
+            result = self.evaluate(prefix)
+            if self.margin is not None and result.confidence >= self.margin:
+                break
+        return result
 
-    def __init__(self, model):
-        super().__init__(model)
-        self.caesar_decoders = [CaesarDecoder(shift) for shift in range(ALPHABET_POWER)]
-        self.trainer = DefaultTrainer()
+    @instrumented
+    def search_buffer(self, buffer):
+        """
+        Find key for utf-8 buffer, e.g. memory-mapped file, decoding only prefixes that are scored
+        :param buffer: bytes-like buffer with text to decrypt, prefix sizes are in bytes
+        :return: HackResult without decrypted text
+        """
+        result = None
+        with memoryview(buffer) as view:
+            for size in self.prefix_sizes(len(view)):
+                # prefixes end on utf-8 symbol boundaries
+                while 0 < size < len(view) and view[size] & 0xc0 == 0x80:
+                    size -= 1
+                with view[:size] as prefix:
+                    result = self.evaluate(str(prefix, 'utf-8'))
+                if self.margin is not None and result.confidence >= self.margin:
+                    break
+        return result
+
+    def get_decoder(self, text: str):
+        """
+        Find decoder for text
+        :param text: Text to decrypt
+        :return: Decoder with found key
+        """
+        return self.search(text).decoder
+
+    @instrumented
+    def get_result(self, text: str):
+        """
+        Find key for text and decrypt it
+        :param text: Text to decrypt
+        :return: HackResult with decrypted text
+        """
+        result = self.search(text)
+        result.text = result.decoder.encode(text)
+        return result
 
+    @instrumented
     def hack(self, text: str):
         """
-        Decrypt text, encrypted by Caesar cipher, with frequency model
+        Decrypt text
         :param text: Text to decrypt
         :return: Decrypted text
         """
-        results = [0 for shift in range(ALPHABET_POWER)]
-        shift_result = 0
+        return self.get_decoder(text).encode(text)
 
-        self.trainer.feed(text)
-        current_model = self.trainer.get_model()
+    def hack_many(self, texts):
+        """
+        Decrypt many texts with the same model
+        :param texts: iterable of texts to decrypt
+        :return: Generator of decrypted texts
+        """
+        for text in texts:
+            yield self.hack(text)
 
-        for shift in range(ALPHABET_POWER):
-            for letter in string.ascii_lowercase:
-                results[shift] += (self.model.get(letter, 0) - current_model.get(letter, 0)) ** 2
 
-            if results[shift] < results[shift_result]:
-                shift_result = shift
+class CaesarHacker(Hacker):
+    """
+    Class for hacking Caesar cipher using frequency model
+    """
 
-            next_model = deepcopy(current_model)
-            for letter_id in range(ALPHABET_POWER):
-                next_model[string.ascii_lowercase[letter_id]] = current_model[
-                    string.ascii_lowercase[(letter_id + 1) % ALPHABET_POWER]]
+    def __init__(self, model, metric: str = 'squares', margin: float = None,
+                 prefix_size: int = DEFAULT_PREFIX_SIZE, alphabet=None):
+        super().__init__(compile_model(model, alphabet=alphabet), margin, prefix_size)
+        if metric not in SCORE_METRICS:
+            raise Exception('Unknown metric: {}'.format(metric))
+        self.metric = metric
+        self.caesar_decoders = [CaesarDecoder(shift, self.alphabet) for shift in range(self.alphabet.power)]
 
-            current_model = next_model
+    def score(self, text: str):
+        """
+        Score every shift of text, encrypted by Caesar cipher, against frequency model
+        :param text: Text to decrypt
+        :return: Best shift and list of scores for every shift, lower score is better
+        """
+        return self.score_counts(*count_letter_vector(text, self.alphabet))
 
-        self.trainer.clear()
+    @instrumented
+    def score_counts(self, counts: list, total: int):
+        """
+        Score every shift of letter counts of text, encrypted by Caesar cipher, against frequency model
+        :param counts: List of letter counts for every letter of alphabet
+        :param total: Total number of letters in text
+        :return: Best shift and list of scores for every shift, lower score is better
+        """
+        scores = score_shifts(counts, total, self.model, self.metric)
+        return best_shift(scores), scores
 
-        return self.caesar_decoders[shift_result].encode(text)
+    @instrumented
+    def evaluate(self, text: str):
+        """
+        Find shift of text, encrypted by Caesar cipher, with frequency model
+        :param text: Text to decrypt
+        :return: HackResult with shift as key, confidence is relative margin of the best score
+        """
+        shift, scores = self.score(text)
+        return HackResult(shift, self.caesar_decoders[shift], scores, relative_margin(scores), len(text))
 
 
 class CaesarBonusHacker(Hacker):
     """
-    Class for hacking Caesar cipher using n-chart frequency model
+    Class for hacking Caesar cipher using n-chart frequency model. N-charts of text are counted once and every shift
+    is scored by looking up rotated n-chart codes in the model, so candidate texts are never decoded.
+    Metric is counts by default, compiled LogProbabilityModel supports only (and defaults to) log_likelihood
     """
 
-    def __init__(self, model, n):
-        super().__init__(model)
+    def __init__(self, model, n, margin: float = None, prefix_size: int = DEFAULT_PREFIX_SIZE,
+                 metric: str = None):
+        super().__init__(compile_model(model, n), margin, prefix_size)
+        log_model = isinstance(self.model, LogProbabilityModel)
+        if metric is None:
+            metric = 'log_likelihood' if log_model else 'counts'
+        if metric not in NGRAM_METRICS:
+            raise Exception('Unknown metric: {}'.format(metric))
+        if metric == 'counts' and log_model:
+            raise Exception('Counts metric needs n-chart count model')
         self.n = n
+        self.metric = metric
+        self.log_table = ngram_log_table(self.model) if metric == 'log_likelihood' else None
         self.caesar_decoders = [CaesarDecoder(shift) for shift in range(ALPHABET_POWER)]
 
-    def hack(self, text: str):
+    def score(self, text: str):
         """
-        Decrypt text, encrypted by Caesar cipher, with 3-chart frequency model
+        Score every shift of text, encrypted by Caesar cipher, against n-chart model without decoding text
         :param text: Text to decrypt
-        :return: Decrypted text
+        :return: Best shift and list of scores for every shift, higher score is better for counts metric and lower
+        score (negative log-likelihood) is better for log_likelihood metric
         """
-        results = [0 for shift in range(ALPHABET_POWER)]
-        shift_result = 0
-
-        for shift in range(ALPHABET_POWER):
-            current_text = self.caesar_decoders[shift].encode(text).lower()
-
-            for index in range(0, len(current_text) - self.n + 1):
-                current_slice = current_text[index:index + self.n]
-                if current_slice.isalpha():
-                    results[shift] += self.model.get(current_slice, 0)
-
-            if results[shift] > results[shift_result]:
-                shift_result = shift
-
-        return self.caesar_decoders[shift_result].encode(text)
+        # texts shorter than dense array of all n-charts are counted in hash table
+        counter = NgramCounter(self.n, None if len(text) >= ALPHABET_POWER ** self.n else False)
+        counter.feed(text)
+        items = counter.items()
+
+        if vectorized.HAS_NUMPY:
+            # model arrays exist only with numpy, see NgramModel
+            codes, values, floor = (self.model.codes, self.model.values, 0) if self.log_table is None else \
+                self.log_table
+            scores = vectorized.score_rotations([code for code, count in items], [count for code, count in items],
+                                                self.n, ALPHABET_POWER, codes, values, floor)
+        elif self.log_table is None:
+            scores = [sum(self.model.get(rotate_ngram(code, shift, self.n)) * count for code, count in items)
+                      for shift in range(ALPHABET_POWER)]
+        else:
+            codes, values, floor = self.log_table
+            scores = [sum(values.get(rotate_ngram(code, shift, self.n), floor) * count for code, count in items)
+                      for shift in range(ALPHABET_POWER)]
+
+        if self.log_table is None:
+            return scores.index(max(scores)), scores
+        scores = [-score for score in scores]
+        return best_shift(scores), scores
+
+    @instrumented
+    def evaluate(self, text: str):
+        """
+        Find shift of text, encrypted by Caesar cipher, with n-chart frequency model
+        :param text: Text to decrypt
+        :return: HackResult with shift as key, confidence is relative margin of the best score
+        """
+        shift, scores = self.score(text)
+        return HackResult(shift, self.caesar_decoders[shift], scores,
+                          relative_margin(scores, self.log_table is None), len(text))
 
 
 class VigenereHacker(Hacker):
@@ -107,12 +268,16 @@ class VigenereHacker(Hacker):
     Class for hacking Vigenere cipher using frequency model and coincidence index method
     """
 
-    def __init__(self, model):
-        super().__init__(model)
-        try:
-            self.coincidence_index = self.model['coincidence_index']
-        except KeyError:
+    def __init__(self, model, metric: str = 'squares', key_length_method: str = 'autocorrelation',
+                 margin: float = None, prefix_size: int = DEFAULT_PREFIX_SIZE, alphabet=None):
+        super().__init__(compile_model(model, alphabet=alphabet), margin, prefix_size)
+        self.coincidence_index = self.model.coincidence_index
+        if self.coincidence_index is None:
             raise KeyError('Wrong model format')
+        if key_length_method not in METHODS:
+            raise Exception('Unknown key length method: {}'.format(key_length_method))
+        self.key_length_method = key_length_method
+        self.caesar_hacker = CaesarHacker(self.model, metric)
 
     def calc_coincidence_index(self, text: str):
         """
@@ -120,22 +285,7 @@ class VigenereHacker(Hacker):
         :param text: Text for calculating
         :return: Coincidence index for text
         """
-        count = [0 for letter in range(ALPHABET_POWER)]
-        sum_count = 0
-
-        for letter in text:
-            if letter.isalpha():
-                count[ord(letter.lower()) - ord('a')] += 1
-                sum_count += 1
-
-        if sum_count <= 2:
-            return 0
-
-        result = 0
-        for letter in range(ALPHABET_POWER):
-            result += (count[letter] * (count[letter] - 1)) / (sum_count * (sum_count - 1))
-
-        return result
+        return coincidence_index(count_codes(letter_codes(text, self.alphabet), self.alphabet.power))
 
     def check_length(self, text: str, length: int):
         """
@@ -144,58 +294,149 @@ class VigenereHacker(Hacker):
         :param length: Key length
         :return: Calculated coincidence index for length
         """
-        current_text = []
-        for position in range(0, len(text), length):
-            current_text.append(text[position])
-        return self.calc_coincidence_index(''.join(current_text))
+        return self.calc_coincidence_index(text[0::length])
 
-    def hack(self, text: str):
+    @instrumented
+    def estimate_key_length(self, codes: bytes):
+        """
+        Estimate cipher's key length with chosen key length method
+        :param codes: Letter numbers of text, see key_length.letter_codes
+        :return: Key length and curve of method's values for key lengths 1, 2, ...
         """
-        Decrypt text, encrypted by Vigenere cipher, with frequency model and coincidence index method
+        return detect_key_length(codes, self.coincidence_index, self.key_length_method,
+                                 alphabet_power=self.alphabet.power)
+
+    @instrumented
+    def get_key(self, text: str):
+        """
+        Find key of text, encrypted by Vigenere cipher, with frequency model and coincidence index method
         :param text: Text to decrypt
-        :return: Decrypted text
+        :return: List of key shifts
         """
-        letters = []
-        for letter in text:
-            if letter.isalpha():
-                letters.append(letter.lower())
+        codes = letter_codes(text, self.alphabet)
+        return self.get_column_key(codes, self.estimate_key_length(codes)[0])
 
-        letter_text = ''.join(letters)
+    @instrumented
+    def get_column_key(self, codes: bytes, key_len: int):
+        """
+        Find key of given length by frequency analysis of every column
+        :param codes: Letter numbers of text, see key_length.letter_codes
+        :param key_len: Key length
+        :return: List of key shifts
+        """
+        key = []
+        for index in range(key_len):
+            counts = count_codes(codes[index::key_len], self.alphabet.power)
+            key.append(self.caesar_hacker.score_counts(counts, sum(counts))[0])
+        return key
 
-        len_ic = []
-        current_length = 1
-        while current_length * current_length < len(letter_text):
-            len_ic.append(self.check_length(letter_text, current_length))
-            current_length += 1
+    @instrumented
+    def score_key_columns(self, text: str, key: list):
+        """
+        Score every shift of every key column
+        :param text: Text to decrypt
+        :param key: List of key shifts
+        :return: List of scores of every shift for every column, lower score is better
+        """
+        codes = letter_codes(text, self.alphabet)
+        scores = []
+        for index in range(len(key)):
+            counts = count_codes(codes[index::len(key)], self.alphabet.power)
+            scores.append(self.caesar_hacker.score_counts(counts, sum(counts))[1])
+        return scores
+
+    @instrumented
+    def evaluate(self, text: str):
+        """
+        Find key of text, encrypted by Vigenere cipher
+        :param text: Text to decrypt
+        :return: HackResult with key string, confidence is the least relative margin of the best column score
+        """
+        shifts = self.get_key(text)
+        key = ''.join(self.alphabet.letters[shift] for shift in shifts)
+        scores = self.score_key_columns(text, shifts)
+        confidence = min((relative_margin(column) for column in scores), default=0.0)
+        return HackResult(key, VigenereDecoder(key, alphabet=self.alphabet), scores, confidence, len(text))
 
-        key_len = 1
-        for length, coincidence_index in enumerate(len_ic):
-            if self.coincidence_index < coincidence_index:
-                key_len = length + 1
-                break
-            if abs(coincidence_index - self.coincidence_index) < abs(len_ic[key_len - 1] - self.coincidence_index):
-                key_len = length + 1
+    def get_decoder(self, text: str):
+        """
+        Find decoder for text, encrypted by Vigenere cipher
+        :param text: Text to decrypt
+        :return: Vigenere decoder with found key
+        """
+        if self.margin is not None:
+            return super().get_decoder(text)
+        return VigenereDecoder(''.join(self.alphabet.letters[shift] for shift in self.get_key(text)),
+                               alphabet=self.alphabet)
+
+
+class VigenereBonusHacker(VigenereHacker):
+    """
+    Class for hacking Vigenere cipher using n-chart frequency model: keys found by bigram (or for 1-chart model
+    by letter) frequencies are refined column by column with n-chart log-likelihood, and key length is chosen by
+    log-likelihood of keys
+    """
 
-        strings = ['' for index in range(key_len)]
-        for position, symbol in enumerate(letter_text):
-            strings[position % key_len] += symbol
+    def __init__(self, model, n, metric: str = 'squares', key_length_method: str = 'autocorrelation',
+                 margin: float = None, prefix_size: int = DEFAULT_PREFIX_SIZE):
+        ngram_model = compile_model(model, n)
+        super().__init__(marginal_frequency_model(ngram_model), metric, key_length_method, margin, prefix_size)
+        self.ngram_model = ngram_model
+        self.n = n
+        self.log_table = ngram_log_table(ngram_model)
+        self.pair_table = pair_log_table(marginal_counts(ngram_model, 2)) if n > 1 else None
 
-        caesar_hacker = CaesarHacker(self.model)
+    def get_seed_key(self, codes: bytes, letters: bytes, pair_starts, key_len: int):
+        """
+        Find initial key of given length
+        :param codes: Letter numbers of text, see key_length.letter_codes
+        :param letters: The same letter numbers, see ngram.ngram_windows
+        :param pair_starts: Starts of bigram windows in letters
+        :param key_len: Key length
+        :return: List of key shifts
+        """
+        if self.pair_table is None:
+            return self.get_column_key(codes, key_len)
+        return chain_key(letters, pair_starts, key_len, self.pair_table)
 
-        for index in range(key_len):
-            strings[index] = caesar_hacker.hack(strings[index])
-
-        result = []
-
-        letter_id = 0
-        for letter in text:
-            if letter.isalpha():
-                symbol = strings[letter_id % key_len][letter_id // key_len]
-                if letter.isupper():
-                    symbol = symbol.upper()
-                result.append(symbol)
-                letter_id += 1
-            else:
-                result.append(letter)
-
-        return ''.join(result)
+    @instrumented
+    def get_key(self, text: str):
+        """
+        Find key of text, encrypted by Vigenere cipher, with n-chart frequency model
+        :param text: Text to decrypt
+        :return: List of key shifts
+        """
+        codes = letter_codes(text)
+        letters, starts = ngram_windows(text, self.n)
+        starts = starts[:REFINE_SAMPLE_SIZE]
+        pair_starts = starts if self.n == 2 else ngram_windows(text, 2)[1][:REFINE_SAMPLE_SIZE]
+        key_len = self.estimate_key_length(codes)[0]
+        if not len(starts):
+            return self.get_column_key(codes, key_len)
+
+        keys = {length: self.get_seed_key(codes, letters, pair_starts, length)
+                for length in {key_len, *range(1, min(max_key_length(len(codes)), SEARCH_KEY_LENGTH) + 1)}}
+        scores = {length: score_key(letters, starts, key, self.n, self.log_table) for length, key in keys.items()}
+
+        lengths = {key_len, *sorted(scores, key=scores.get, reverse=True)[:REFINED_KEY_LENGTHS]}
+        lengths.update(divisor for length in list(lengths) for divisor in range(1, length) if length % divisor == 0)
+        for length in lengths:
+            key = keys[length] if length in keys else self.get_seed_key(codes, letters, pair_starts, length)
+            keys[length] = refine_key(letters, starts, key, self.n, self.log_table)
+            scores[length] = score_key(letters, starts, keys[length], self.n, self.log_table)
+
+        best = max(sorted(lengths), key=scores.get)
+        threshold = scores[best] - KEY_LENGTH_TOLERANCE * abs(scores[best])
+        return keys[min(length for length in lengths if best % length == 0 and scores[length] >= threshold)]
+
+    @instrumented
+    def score_key_columns(self, text: str, key: list):
+        """
+        Score every shift of every key column by n-chart log-likelihood, other columns are fixed
+        :param text: Text to decrypt
+        :param key: List of key shifts
+        :return: List of ALPHABET_POWER negated log-likelihoods for every column, lower score is better
+        """
+        letters, starts = ngram_windows(text, self.n)
+        scores = score_columns(letters, starts[:REFINE_SAMPLE_SIZE], key, self.n, self.log_table)
+        return [[-score for score in column] for column in scores]
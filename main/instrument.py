@@ -0,0 +1,183 @@
+import functools
+import mmap
+import threading
+import time
+
+# json and tracemalloc are imported on use, they are needed only while profiling
+
+# callbacks called with record of every finished stage, instrumented calls only check this list while it is empty
+HOOKS = []
+
+SIZED_TYPES = (str, bytes, bytearray, memoryview, mmap.mmap)
+
+_state = threading.local()
+
+
+def add_hook(hook):
+    """
+    Start calling hook for every finished stage
+    :param hook: Function called with stage record: dict with stage name, parent stage name, depth, seconds,
+    characters (None if unknown), allocated and peak bytes (None if tracemalloc is not tracing, peak is also None
+    before Python 3.9)
+    """
+    HOOKS.append(hook)
+
+
+def remove_hook(hook):
+    """
+    Stop calling hook
+    :param hook: Function passed to add_hook
+    """
+    HOOKS.remove(hook)
+
+
+def _run_stage(name: str, function, args, kwargs, first_argument: int):
+    import tracemalloc
+
+    characters = next((len(arg) for arg in args[first_argument:] if isinstance(arg, SIZED_TYPES)), None)
+    stack = getattr(_state, 'stack', None)
+    if stack is None:
+        stack = _state.stack = []
+
+    # frame is [name, traced memory at start, peak of the stage before the last reset of tracemalloc peak]
+    tracing = tracemalloc.is_tracing()
+    # tracemalloc.reset_peak appeared in Python 3.9, without it peaks of stages are not reported
+    resetting = tracing and hasattr(tracemalloc, 'reset_peak')
+    current = 0
+    if tracing:
+        current, peak = tracemalloc.get_traced_memory()
+    if resetting:
+        if stack:
+            stack[-1][2] = max(stack[-1][2], peak)
+        tracemalloc.reset_peak()
+    frame = [name, current, current]
+    parent = stack[-1][0] if stack else None
+    stack.append(frame)
+
+    start = time.perf_counter()
+    try:
+        return function(*args, **kwargs)
+    finally:
+        seconds = time.perf_counter() - start
+        stack.pop()
+        record = {'stage': name, 'parent': parent, 'depth': len(stack), 'seconds': seconds,
+                  'characters': characters, 'allocated': None, 'peak': None}
+        if tracing and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            record['allocated'] = current - frame[1]
+            if resetting:
+                peak = max(peak, frame[2])
+                record['peak'] = peak - frame[1]
+                if stack:
+                    stack[-1][2] = max(stack[-1][2], peak)
+        for hook in list(HOOKS):
+            hook(record)
+
+
+def instrumented(function=None, name: str = None):
+    """
+    Decorator of Encoder, Trainer, Hacker and TextChecker operations, which reports them as stages to hooks.
+    Without hooks the call costs one list check.
+    :param function: Decorated function
+    :param name: Stage name, by default class name of self and method name
+    :return: Decorated function
+    """
+    if function is None:
+        return functools.partial(instrumented, name=name)
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if not HOOKS:
+            return function(*args, **kwargs)
+        if name is not None:
+            return _run_stage(name, function, args, kwargs, 0)
+        return _run_stage('{}.{}'.format(type(args[0]).__name__, function.__name__), function, args, kwargs, 1)
+
+    return wrapper
+
+
+class Profiler:
+    """
+    Hook which collects stage records and summarizes them by stage, used as context manager
+    """
+
+    def __init__(self, allocations: bool = False):
+        """
+        :param allocations: Trace allocations with tracemalloc while profiler is active
+        """
+        self.allocations = allocations
+        self.records = []
+        self.started_tracing = False
+
+    def __call__(self, record: dict):
+        self.records.append(record)
+
+    def __enter__(self):
+        import tracemalloc
+
+        if self.allocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_tracing = True
+        add_hook(self)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        import tracemalloc
+
+        remove_hook(self)
+        if self.started_tracing:
+            tracemalloc.stop()
+            self.started_tracing = False
+
+    def get_summary(self):
+        """
+        Summarize records by stage
+        :return: List of dicts with stage name, number of calls, total seconds, characters and allocated bytes and
+        the largest peak bytes, in order of the first finished call
+        """
+        summary = {}
+        for record in self.records:
+            stage = summary.setdefault(record['stage'], {'stage': record['stage'], 'calls': 0, 'seconds': 0.0,
+                                                         'characters': None, 'allocated': None, 'peak': None})
+            stage['calls'] += 1
+            stage['seconds'] += record['seconds']
+            if record['characters'] is not None:
+                stage['characters'] = (stage['characters'] or 0) + record['characters']
+            if record['allocated'] is not None:
+                stage['allocated'] = (stage['allocated'] or 0) + record['allocated']
+            if record['peak'] is not None:
+                stage['peak'] = max(stage['peak'] or 0, record['peak'])
+        return list(summary.values())
+
+    def get_json(self):
+        """
+        Get summary in json format
+        :return: Json with list of stages
+        """
+        import json
+
+        return json.dumps({'stages': self.get_summary()})
+
+    def get_prometheus(self):
+        """
+        Get summary in Prometheus text exposition format
+        :return: Metrics text
+        """
+        metrics = [
+            ('encryptor_stage_calls_total', 'counter', 'Number of calls of the stage', 'calls'),
+            ('encryptor_stage_seconds_total', 'counter', 'Wall time of the stage in seconds', 'seconds'),
+            ('encryptor_stage_characters_total', 'counter', 'Characters processed by the stage', 'characters'),
+            ('encryptor_stage_allocated_bytes_total', 'counter', 'Memory allocated and kept by the stage',
+             'allocated'),
+            ('encryptor_stage_peak_bytes', 'gauge', 'The largest peak of memory allocated by the stage', 'peak')
+        ]
+        summary = self.get_summary()
+        lines = []
+        for metric, metric_type, description, field in metrics:
+            values = [(stage['stage'], stage[field]) for stage in summary if stage[field] is not None]
+            if not values:
+                continue
+            lines.append('# HELP {} {}'.format(metric, description))
+            lines.append('# TYPE {} {}'.format(metric, metric_type))
+            lines.extend('{}{{stage="{}"}} {}'.format(metric, stage, value) for stage, value in values)
+        return '\n'.join(lines) + '\n'
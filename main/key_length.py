@@ -0,0 +1,259 @@
+import math
+from collections import Counter
+
+from main import vectorized
+from main.alphabet import LATIN, get_alphabet
+from main.config import ALPHABET_POWER
+from main.encode import has_non_ascii_letters, LETTER_BYTES
+
+LETTER_CODES = bytes.maketrans(LETTER_BYTES, bytes(range(ALPHABET_POWER)) * 2)
+NON_LETTER_BYTES = bytes(code for code in range(256) if code not in LETTER_BYTES)
+
+METHODS = ('first-column', 'mean-ic', 'autocorrelation', 'kasiski')
+
+# number of leading letters used by mean-ic, autocorrelation and kasiski methods,
+# every one of them looks at all letters of the sample, so it doesn't need the whole text
+SAMPLE_SIZE = 1 << 16
+
+# share of multiples of key length with high autocorrelation
+PERIOD_SHARE = 0.6
+
+# minimal number of standard deviations, by which share of repeat distances divisible by key length
+# should exceed the share for random distances
+KASISKI_SIGNIFICANCE = 4
+
+
+def letter_codes(text: str, alphabet=None):
+    """
+    Encode letters of text into compact array of letter numbers
+    :param text: Text with letters of alphabet
+    :param alphabet: Alphabet or its spec, latin by default
+    :return: Bytes with number in range [0, alphabet power) for every letter of text
+    """
+    alphabet = get_alphabet(alphabet)
+    if alphabet is not LATIN:
+        return alphabet.get_codes(text)
+    if has_non_ascii_letters(text):
+        raise Exception('Text cannot contain non-english alphabet letters')
+    return text.encode('utf-8', 'surrogatepass').translate(LETTER_CODES, NON_LETTER_BYTES)
+
+
+def count_codes(codes: bytes, alphabet_power: int = ALPHABET_POWER):
+    """
+    Count every letter number
+    :param codes: Letter numbers
+    :param alphabet_power: Number of letters in alphabet
+    :return: List of alphabet_power counts
+    """
+    if vectorized.HAS_NUMPY:
+        return vectorized.count_bytes(codes)[:alphabet_power]
+    return [codes.count(code) for code in range(alphabet_power)]
+
+
+def coincidence_index(counts: list):
+    """
+    Calculate coincidence index
+    :param counts: List of letter counts
+    :return: Coincidence index for counts
+    """
+    sum_count = sum(counts)
+    if sum_count <= 2:
+        return 0
+
+    result = 0
+    for count in counts:
+        result += (count * (count - 1)) / (sum_count * (sum_count - 1))
+    return result
+
+
+def max_key_length(letter_count: int):
+    """
+    Get maximal key length worth checking
+    :param letter_count: Number of letters in text
+    :return: Maximal key length, its square is less than letter count
+    """
+    length = 0
+    while (length + 1) * (length + 1) < letter_count:
+        length += 1
+    return length
+
+
+def coincidence_curve(codes: bytes, max_length: int = None, alphabet_power: int = ALPHABET_POWER):
+    """
+    Calculate coincidence index of the first column for every key length
+    :param codes: Letter numbers
+    :param max_length: Maximal key length, by default its square is less than number of letters
+    :param alphabet_power: Number of letters in alphabet
+    :return: List of coincidence indexes for key lengths 1..max_length
+    """
+    if max_length is None:
+        max_length = max_key_length(len(codes))
+    return [coincidence_index(count_codes(codes[0::length], alphabet_power)) for length in range(1, max_length + 1)]
+
+
+def choose_key_length(curve: list, model_coincidence_index: float):
+    """
+    Choose key length by coincidence index curve
+    :param curve: List of coincidence indexes for key lengths 1, 2, ...
+    :param model_coincidence_index: Coincidence index of language model
+    :return: First key length with coincidence index above model's or the closest one
+    """
+    key_len = 1
+    for length, index in enumerate(curve):
+        if model_coincidence_index < index:
+            return length + 1
+        if abs(index - model_coincidence_index) < abs(curve[key_len - 1] - model_coincidence_index):
+            key_len = length + 1
+    return key_len
+
+
+def choose_period(curve: list, model_coincidence_index: float, alphabet_power: int = ALPHABET_POWER):
+    """
+    Choose key length by autocorrelation curve, whose values are high at multiples of key length
+    :param curve: List of coincidence rates for shifts 1, 2, ...
+    :param model_coincidence_index: Coincidence index of language model
+    :param alphabet_power: Number of letters in alphabet
+    :return: Smallest length, most of whose multiples have high coincidence rate
+    """
+    threshold = (model_coincidence_index + 1 / alphabet_power) / 2
+    for length in range(1, len(curve) + 1):
+        multiples = curve[length - 1::length]
+        if sum(rate > threshold for rate in multiples) > PERIOD_SHARE * len(multiples):
+            return length
+    return choose_key_length(curve, model_coincidence_index)
+
+
+def choose_kasiski_length(curve: list, distance_count: int):
+    """
+    Choose key length by shares of repeat distances divisible by key length
+    :param curve: List of shares for key lengths 1, 2, ...
+    :param distance_count: Number of repeat distances the curve was calculated on
+    :return: Length, whose share exceeds share of random distances 1 / length the most significantly
+    """
+    key_len = 1
+    best_score = KASISKI_SIGNIFICANCE
+    for length in range(2, len(curve) + 1):
+        random_share = 1 / length
+        score = (curve[length - 1] - random_share) / math.sqrt(random_share * (1 - random_share) / distance_count)
+        if score > best_score:
+            key_len, best_score = length, score
+    return key_len
+
+
+def mean_coincidence_curve(codes: bytes, max_length: int = None, alphabet_power: int = ALPHABET_POWER):
+    """
+    Calculate coincidence index averaged over all columns for every key length
+    :param codes: Letter numbers
+    :param max_length: Maximal key length, by default its square is less than number of letters
+    :param alphabet_power: Number of letters in alphabet
+    :return: List of mean coincidence indexes for key lengths 1..max_length
+    """
+    if max_length is None:
+        max_length = max_key_length(len(codes))
+    codes = codes[:SAMPLE_SIZE]
+
+    curve = []
+    for length in range(1, max_length + 1):
+        if vectorized.HAS_NUMPY:
+            curve.append(vectorized.mean_coincidence_index(codes, length, alphabet_power))
+            continue
+        indexes = [coincidence_index(count_codes(codes[column::length], alphabet_power)) for column in range(length)
+                   if len(codes[column::length]) > 2]
+        curve.append(sum(indexes) / len(indexes) if indexes else 0)
+    return curve
+
+
+def autocorrelation_curve(codes: bytes, max_length: int = None):
+    """
+    Calculate share of letters equal to the letter shifted by every key length
+    :param codes: Letter numbers
+    :param max_length: Maximal key length, by default its square is less than number of letters
+    :return: List of coincidence rates for shifts 1..max_length
+    """
+    if max_length is None:
+        max_length = max_key_length(len(codes))
+    codes = codes[:SAMPLE_SIZE]
+
+    curve = []
+    for shift in range(1, max_length + 1):
+        size = len(codes) - shift
+        if size <= 0:
+            curve.append(0)
+        elif vectorized.HAS_NUMPY:
+            curve.append(vectorized.coincidence_rate(codes, shift) / size)
+        else:
+            # equal letters give zero bytes in xor of the text with its shifted copy
+            difference = int.from_bytes(codes[:-shift], 'big') ^ int.from_bytes(codes[shift:], 'big')
+            curve.append(difference.to_bytes(size, 'big').count(0) / size)
+    return curve
+
+
+def repeat_distances(codes: bytes, alphabet_power: int = ALPHABET_POWER):
+    """
+    Count distances between consecutive occurrences of every trigram
+    :param codes: Letter numbers
+    :param alphabet_power: Number of letters in alphabet
+    :return: Counter of distances
+    """
+    codes = codes[:SAMPLE_SIZE]
+    if vectorized.HAS_NUMPY:
+        return Counter(vectorized.repeat_distances(codes, alphabet_power).tolist())
+
+    distances = Counter()
+    last_position = {}
+    for position in range(len(codes) - 2):
+        trigram = codes[position:position + 3]
+        if trigram in last_position:
+            distances[position - last_position[trigram]] += 1
+        last_position[trigram] = position
+    return distances
+
+
+def kasiski_curve(codes: bytes, max_length: int = None, distances: Counter = None):
+    """
+    Calculate share of distances between repeated trigrams divisible by every key length
+    :param codes: Letter numbers
+    :param max_length: Maximal key length, by default its square is less than number of letters
+    :param distances: Precalculated repeat_distances of codes
+    :return: List of shares for key lengths 1..max_length
+    """
+    if max_length is None:
+        max_length = max_key_length(len(codes))
+    if distances is None:
+        distances = repeat_distances(codes)
+
+    total = sum(distances.values())
+    if not total:
+        return [0 for length in range(max_length)]
+    longest = max(distances)
+    return [sum(distances[distance] for distance in range(length, longest + 1, length)) / total
+            for length in range(1, max_length + 1)]
+
+
+def detect_key_length(codes: bytes, model_coincidence_index: float, method: str = 'first-column',
+                      max_length: int = None, alphabet_power: int = ALPHABET_POWER):
+    """
+    Detect cipher's key length
+    :param codes: Letter numbers, shared by all methods
+    :param model_coincidence_index: Coincidence index of language model
+    :param method: 'first-column' for coincidence index of the first column, 'mean-ic' for coincidence index
+    averaged over columns, 'autocorrelation' for coincidences of text with its shifts or 'kasiski' for distances
+    between repeated trigrams
+    :param max_length: Maximal key length, by default its square is less than number of letters
+    :param alphabet_power: Number of letters in alphabet
+    :return: Key length and curve of method's values for key lengths 1, 2, ...
+    """
+    if method == 'first-column':
+        curve = coincidence_curve(codes, max_length, alphabet_power)
+    elif method == 'mean-ic':
+        curve = mean_coincidence_curve(codes, max_length, alphabet_power)
+    elif method == 'autocorrelation':
+        curve = autocorrelation_curve(codes, max_length)
+        return choose_period(curve, model_coincidence_index, alphabet_power), curve
+    elif method == 'kasiski':
+        distances = repeat_distances(codes, alphabet_power)
+        curve = kasiski_curve(codes, max_length, distances)
+        return choose_kasiski_length(curve, sum(distances.values())), curve
+    else:
+        raise Exception('Unknown key length method: {}'.format(method))
+    return choose_key_length(curve, model_coincidence_index), curve
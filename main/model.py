@@ -0,0 +1,442 @@
+import array
+import bisect
+import json
+import math
+import mmap
+import os
+import string
+import struct
+import sys
+from collections import Counter
+from functools import lru_cache
+
+from main import vectorized
+from main.alphabet import LATIN, get_alphabet
+from main.config import ALPHABET_POWER
+from main.ngram import NgramCounter, encode_ngram, decode_ngram
+from main.score import MIN_FREQUENCY, smoothed_log_probabilities
+
+MODEL_CACHE_SIZE = 16
+
+# log probability models are dense float32 tables of all n-charts, 5-chart table takes 45MB
+LOG_MAX_N = 5
+
+# binary model: header, alphabet, padding to ALIGNMENT, then little-endian 8 byte arrays:
+# frequencies of letters for frequency model, counts of all n-charts for dense n-chart model,
+# number of n-charts, their sorted codes and their counts for sparse n-chart model.
+# Latin alphabet is written in ascii, other alphabets of frequency models in utf-32-le with ALPHABET_VERSION.
+# Log probability model has LOG_VERSION, its body is 8 byte log probability of unseen n-charts followed by
+# little-endian 4 byte log probabilities of all n-charts
+MAGIC = b'ENCM'
+FORMAT_VERSION = 1
+ALPHABET_VERSION = 2
+LOG_VERSION = 3
+FREQUENCY_KIND, DENSE_KIND, SPARSE_KIND, LOG_KIND = range(4)
+HEADER = struct.Struct('<4sBBBBQd')
+ALIGNMENT = 8
+
+
+class FrequencyModel:
+    """
+    Letter frequency model, preprocessed once for scoring Caesar shifts
+    """
+
+    def __init__(self, model: dict, alphabet=None):
+        """
+        :param model: Model from DefaultTrainer.get_model
+        :param alphabet: Alphabet or its spec, by default alphabet of model or latin
+        """
+        self.alphabet = get_alphabet(alphabet if alphabet is not None else model.get('alphabet'))
+        self.coincidence_index = model.get('coincidence_index')
+        self.frequencies = [model.get(letter, 0) for letter in self.alphabet.letters]
+        self.log_frequencies = [math.log(max(frequency, MIN_FREQUENCY)) for frequency in self.frequencies]
+        self.expected_frequencies = [max(frequency, MIN_FREQUENCY) for frequency in self.frequencies]
+
+    def get_dict(self):
+        """
+        Get model in Trainer.get_model format
+        :return: Dict of letter frequencies with coincidence index
+        """
+        result = dict(zip(self.alphabet.letters, self.frequencies))
+        result['coincidence_index'] = self.coincidence_index
+        if self.alphabet is not LATIN:
+            result['alphabet'] = self.alphabet.name
+        return result
+
+
+class NgramModel:
+    """
+    N-chart count model, preprocessed once for scoring Caesar shifts
+    """
+
+    def __init__(self, model: dict, n: int = None):
+        if n is None:
+            n = len(next(iter(model))) if model else 1
+        if any(len(ngram) != n for ngram in model):
+            raise Exception('Model is not a {}-chart model'.format(n))
+        self.n = n
+        self.counts = model
+        self.table = {encode_ngram(ngram): count for ngram, count in model.items()}
+        if vectorized.HAS_NUMPY:
+            self.codes, self.values = vectorized.sorted_table(self.table)
+
+    def get(self, code: int):
+        """
+        Get model value of n-chart
+        :param code: Code of n-chart
+        :return: N-chart count
+        """
+        return self.table.get(code, 0)
+
+    def items(self):
+        """
+        Get model n-charts
+        :return: Iterable of pairs of n-chart code and its count
+        """
+        return self.table.items()
+
+    def get_dict(self):
+        """
+        Get model in Trainer.get_model format
+        :return: Dict of n-chart counts
+        """
+        return self.counts
+
+
+class MappedNgramModel:
+    """
+    N-chart count model over a buffer with binary model, queried without deserializing it
+    """
+
+    def __init__(self, buffer, n: int, dense: bool, offset: int):
+        self.buffer = buffer
+        self.n = n
+        view = memoryview(buffer)
+        if dense:
+            size = ALPHABET_POWER ** n
+            self.codes = None
+            self.values = view[offset:offset + 8 * size].cast('q')
+        else:
+            size = struct.unpack_from('<Q', buffer, offset)[0]
+            offset += 8
+            self.codes = view[offset:offset + 8 * size].cast('q')
+            self.values = view[offset + 8 * size:offset + 16 * size].cast('q')
+        if vectorized.HAS_NUMPY:
+            self.codes, self.values = vectorized.int64_views(self.codes, self.values)
+
+    def get(self, code: int):
+        """
+        Get model value of n-chart
+        :param code: Code of n-chart
+        :return: N-chart count
+        """
+        if self.codes is None:
+            return int(self.values[code])
+        index = bisect.bisect_left(self.codes, code)
+        if index < len(self.codes) and self.codes[index] == code:
+            return int(self.values[index])
+        return 0
+
+    def items(self):
+        """
+        Get model n-charts
+        :return: Iterable of pairs of n-chart code and its count
+        """
+        if self.codes is None:
+            return ((code, int(count)) for code, count in enumerate(self.values) if count)
+        return ((int(code), int(count)) for code, count in zip(self.codes, self.values))
+
+    def get_dict(self):
+        """
+        Get model in Trainer.get_model format
+        :return: Dict of n-chart counts
+        """
+        if self.codes is None:
+            return {decode_ngram(code, self.n): int(count) for code, count in enumerate(self.values) if count}
+        return {decode_ngram(int(code), self.n): int(count) for code, count in zip(self.codes, self.values)}
+
+
+class LogProbabilityModel:
+    """
+    Smoothed n-chart log probabilities in a dense float32 table indexed by n-chart code, see compile_log_model.
+    Hackers score n-charts by indexing the table
+    """
+
+    def __init__(self, values, n: int, total: int, floor: float, buffer=None):
+        """
+        :param values: float32 log probabilities of all n-charts, numpy array or buffer
+        :param n: Size of n-chart
+        :param total: Number of n-charts the model was trained on
+        :param floor: Log probability of n-charts unseen in training
+        :param buffer: Buffer with binary model values are in, e.g. memory-mapped model file
+        """
+        self.n = n
+        self.total = total
+        self.floor = floor
+        self.buffer = buffer
+        self.codes = None
+        self.values = vectorized.float32_view(values) if vectorized.HAS_NUMPY else values
+
+    def get(self, code: int, default: float = None):
+        """
+        Get log probability of n-chart, dict-like lookup for scoring
+        :param code: Code of n-chart
+        :param default: Not used, every n-chart has log probability
+        :return: Log probability
+        """
+        return float(self.values[code])
+
+    def items(self):
+        """
+        Get model n-charts
+        :return: Iterable of pairs of n-chart code and its smoothed count
+        """
+        return ((code, math.exp(value) * self.total) for code, value in enumerate(self.values))
+
+    def log_table(self):
+        """
+        Get log probabilities in ngram_log_table format
+        :return: None for codes, table of log probabilities (the model itself without numpy) and floor
+        """
+        return None, self.values if vectorized.HAS_NUMPY else self, self.floor
+
+
+def compile_model(model, n: int = None, alphabet=None):
+    """
+    Preprocess model for scoring, already preprocessed models are returned as is
+    :param model: Model from Trainer.get_model or preprocessed model
+    :param n: Size of a n-chart model, None for frequency model
+    :param alphabet: Alphabet or its spec of frequency model, by default alphabet of model or latin.
+    N-chart models are only latin
+    :return: FrequencyModel, NgramModel, MappedNgramModel or LogProbabilityModel
+    """
+    if n is not None and get_alphabet(alphabet) is not LATIN:
+        raise Exception('N-chart models support only latin alphabet')
+    if isinstance(model, (FrequencyModel, NgramModel, MappedNgramModel, LogProbabilityModel)):
+        if n is not None and getattr(model, 'n', None) != n:
+            raise Exception('Model is not a {}-chart model'.format(n))
+        if alphabet is not None and getattr(model, 'alphabet', LATIN).letters != get_alphabet(alphabet).letters:
+            raise Exception('Model is not a model of {} alphabet'.format(get_alphabet(alphabet).name))
+        return model
+    if n is None:
+        return FrequencyModel(model, alphabet)
+    return NgramModel(model, n)
+
+
+def compile_log_model(model, n: int, smoothing: str = 'good_turing', alpha: float = 1.0):
+    """
+    Compile n-chart count model into dense table of smoothed log probabilities
+    :param model: Model from BonusTrainer.get_model or preprocessed n-chart model
+    :param n: Size of n-chart model
+    :param smoothing: Smoothing method, see score.smoothed_log_probabilities
+    :param alpha: Count added to every n-chart by additive smoothing
+    :return: LogProbabilityModel
+    :raises: Exception if n is too large for dense table
+    """
+    model = compile_model(model, n)
+    if isinstance(model, LogProbabilityModel):
+        return model
+    if n > LOG_MAX_N:
+        raise Exception('Log probability models support n up to {}'.format(LOG_MAX_N))
+    size = ALPHABET_POWER ** n
+
+    if vectorized.HAS_NUMPY:
+        numbers = vectorized.count_numbers(model.values)
+    else:
+        items = [(code, count) for code, count in model.items() if count]
+        numbers = Counter(count for code, count in items)
+    log_probabilities, floor = smoothed_log_probabilities(numbers, size, smoothing, alpha)
+
+    if vectorized.HAS_NUMPY:
+        values = vectorized.smoothed_table(model.codes, model.values, size, log_probabilities, floor)
+    else:
+        values = array.array('f', [floor]) * size
+        for code, count in items:
+            values[code] = log_probabilities[count]
+    return LogProbabilityModel(values, n, sum(count * number for count, number in numbers.items()), floor)
+
+
+def marginal_counts(model, size: int = 1):
+    """
+    Sum counts of n-charts of n-chart model by their first letters
+    :param model: NgramModel, MappedNgramModel or LogProbabilityModel
+    :param size: Number of first letters, not greater than n
+    :return: List of counts indexed by code of first size letters
+    """
+    if vectorized.HAS_NUMPY:
+        values = model.values
+        if isinstance(model, LogProbabilityModel):
+            values = vectorized.expected_counts(values, model.total)
+        return vectorized.marginal_counts(model.codes, values, model.n, ALPHABET_POWER, size)
+    counts = [0] * ALPHABET_POWER ** size
+    for code, count in model.items():
+        counts[code // ALPHABET_POWER ** (model.n - size)] += count
+    return counts
+
+
+def marginal_frequency_model(model):
+    """
+    Get frequency model of first letters of n-charts, e.g. for key length detection with n-chart model
+    :param model: NgramModel or MappedNgramModel
+    :return: FrequencyModel with coincidence index
+    """
+    counts = marginal_counts(model)
+    total = sum(counts)
+
+    result = {'coincidence_index': 0}
+    for letter, count in zip(string.ascii_lowercase, counts):
+        result[letter] = count / total if total else 0
+        if total > 1:
+            result['coincidence_index'] += count * (count - 1) / (total * (total - 1))
+    return FrequencyModel(result)
+
+
+def _pack_model(kind: int, n: int, total: int, coincidence_index: float, body: bytes, alphabet=LATIN):
+    if alphabet is LATIN:
+        version = LOG_VERSION if kind == LOG_KIND else FORMAT_VERSION
+        header = HEADER.pack(MAGIC, version, kind, n, ALPHABET_POWER, total, coincidence_index)
+        header += string.ascii_lowercase.encode('ascii')
+    else:
+        header = HEADER.pack(MAGIC, ALPHABET_VERSION, kind, n, alphabet.power, total, coincidence_index)
+        header += alphabet.letters.encode('utf-32-le')
+    header += bytes(-len(header) % ALIGNMENT)
+    return header + body
+
+
+def _little_endian(values):
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values.tobytes()
+
+
+def dump_frequency_model(model: dict, total: int):
+    """
+    Get frequency model in binary format
+    :param model: Model from DefaultTrainer.get_model
+    :param total: Number of letters model was built on
+    :return: Binary model
+    """
+    alphabet = get_alphabet(model.get('alphabet'))
+    frequencies = struct.pack('<{}d'.format(alphabet.power), *(model.get(letter, 0) for letter in alphabet.letters))
+    return _pack_model(FREQUENCY_KIND, 1, total, model.get('coincidence_index', 0), frequencies, alphabet)
+
+
+def dump_ngram_model(counter):
+    """
+    Get n-chart model in binary format
+    :param counter: NgramCounter with model counts
+    :return: Binary model
+    """
+    items = sorted(counter.items())
+    total = sum(count for code, count in items)
+    if counter.dense:
+        return _pack_model(DENSE_KIND, counter.n, total, 0, _little_endian(array.array('q', counter.counts)))
+    body = struct.pack('<Q', len(items))
+    body += _little_endian(array.array('q', (code for code, count in items)))
+    body += _little_endian(array.array('q', (count for code, count in items)))
+    return _pack_model(SPARSE_KIND, counter.n, total, 0, body)
+
+
+def dump_log_model(model):
+    """
+    Get log probability model in binary format
+    :param model: LogProbabilityModel
+    :return: Binary model
+    """
+    values = array.array('f')
+    values.frombytes(memoryview(model.values).cast('B'))
+    return _pack_model(LOG_KIND, model.n, model.total, 0, struct.pack('<d', model.floor) + _little_endian(values))
+
+
+def dump_model(model):
+    """
+    Get preprocessed model in binary format
+    :param model: FrequencyModel, NgramModel, MappedNgramModel or LogProbabilityModel
+    :return: Binary model
+    """
+    if isinstance(model, LogProbabilityModel):
+        return dump_log_model(model)
+    if isinstance(model, MappedNgramModel):
+        return bytes(model.buffer)
+    if isinstance(model, FrequencyModel):
+        return dump_frequency_model(model.get_dict(), 0)
+    counter = NgramCounter(model.n)
+    for ngram, count in model.get_dict().items():
+        counter.counts[encode_ngram(ngram)] += count
+    return dump_ngram_model(counter)
+
+
+def is_binary_model(buffer):
+    """
+    Check if buffer starts with binary model header
+    :param buffer: bytes-like buffer
+    :return: True for binary model
+    """
+    return bytes(buffer[:len(MAGIC)]) == MAGIC
+
+
+def read_binary_model(buffer, n: int = None):
+    """
+    Read binary model, n-chart counts stay in buffer and are read on demand
+    :param buffer: bytes-like buffer, e.g. memory-mapped model file
+    :param n: Expected size of a n-chart model, None for frequency model
+    :return: FrequencyModel, MappedNgramModel or LogProbabilityModel
+    """
+    if sys.byteorder != 'little':
+        raise Exception('Binary models are supported only on little-endian platforms')
+    try:
+        magic, version, kind, model_n, alphabet_power, total, coincidence_index = HEADER.unpack_from(buffer)
+    except struct.error:
+        raise Exception('Incorrect model file')
+    if magic != MAGIC or version not in (FORMAT_VERSION, ALPHABET_VERSION, LOG_VERSION):
+        raise Exception('Incorrect model file')
+    if version != ALPHABET_VERSION and alphabet_power != ALPHABET_POWER or \
+            version == ALPHABET_VERSION and kind != FREQUENCY_KIND or (version == LOG_VERSION) != (kind == LOG_KIND):
+        raise Exception('Incorrect model file')
+    alphabet = LATIN
+    offset = HEADER.size + alphabet_power
+    if version == ALPHABET_VERSION:
+        try:
+            alphabet = get_alphabet(bytes(buffer[HEADER.size:HEADER.size + 4 * alphabet_power]).decode('utf-32-le'))
+        except Exception:
+            raise Exception('Incorrect model file')
+        offset = HEADER.size + 4 * alphabet_power
+    offset += -offset % ALIGNMENT
+
+    if kind == FREQUENCY_KIND:
+        if n is not None:
+            raise Exception('Model is not a {}-chart model'.format(n))
+        model = dict(zip(alphabet.letters, struct.unpack_from('<{}d'.format(alphabet.power), buffer, offset)))
+        model['coincidence_index'] = coincidence_index
+        return FrequencyModel(model, alphabet)
+    if n is not None and n != model_n:
+        raise Exception('Model is not a {}-chart model'.format(n))
+    if kind == LOG_KIND:
+        floor = struct.unpack_from('<d', buffer, offset)[0]
+        offset += 8
+        values = memoryview(buffer)[offset:offset + 4 * ALPHABET_POWER ** model_n].cast('f')
+        return LogProbabilityModel(values, model_n, total, floor, buffer)
+    return MappedNgramModel(buffer, model_n, kind == DENSE_KIND, offset)
+
+
+def load_model(path: str, n: int = None):
+    """
+    Load and preprocess json or binary model, reusing already loaded models until the file changes
+    :param path: Path to model file
+    :param n: Size of a n-chart model, None for frequency model
+    :return: FrequencyModel, NgramModel or MappedNgramModel
+    """
+    return _load_model(os.path.abspath(path), os.stat(path).st_mtime_ns, n)
+
+
+@lru_cache(maxsize=MODEL_CACHE_SIZE)
+def _load_model(path: str, modification_time: int, n: int):
+    with open(path, 'rb') as model_file:
+        if is_binary_model(model_file.read(len(MAGIC))):
+            return read_binary_model(mmap.mmap(model_file.fileno(), 0, access=mmap.ACCESS_READ), n)
+        model_file.seek(0)
+        try:
+            model = json.load(model_file)
+        except json.JSONDecodeError:
+            raise Exception('Incorrect model file')
+    return compile_model(model, n)
@@ -0,0 +1,76 @@
+import os
+import tempfile
+
+from main.model import compile_model, dump_model, is_binary_model, load_model, MAGIC
+
+# tmpfs keeps hosted model files in memory, every process maps the same pages
+SHARED_DIRECTORY = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+
+class ModelHandle:
+    """
+    Lightweight picklable reference to a model hosted by ModelHost
+    """
+
+    def __init__(self, path: str, n: int = None):
+        self.path = path
+        self.n = n
+
+    def get_model(self):
+        """
+        Get model in current process, its data is memory-mapped and shared with other processes
+        :return: FrequencyModel or MappedNgramModel, loaded once per process
+        """
+        return load_model(self.path, self.n)
+
+
+class ModelHost:
+    """
+    Class for hosting read-only models once for many worker processes
+
+    Models are stored in binary format in memory-mapped files, so N workers using the model
+    take one copy of it in memory. Pass handles to workers and call get_model there:
+
+        with ModelHost() as host:
+            handle = host.host('model.bin', n=3)
+            with ProcessPoolExecutor() as executor:
+                executor.map(work, repeat(handle), texts)
+    """
+
+    def __init__(self, directory: str = SHARED_DIRECTORY):
+        self.directory = directory
+        self.paths = []
+
+    def host(self, model, n: int = None):
+        """
+        Host model
+        :param model: Path to json or binary model file, model from Trainer.get_model or preprocessed model
+        :param n: Size of a n-chart model, None for frequency model
+        :return: ModelHandle for the model
+        """
+        if isinstance(model, str):
+            with open(model, 'rb') as model_file:
+                if is_binary_model(model_file.read(len(MAGIC))):
+                    return ModelHandle(os.path.abspath(model), n)
+            model = load_model(model, n)
+
+        data = dump_model(compile_model(model, n))
+        descriptor, path = tempfile.mkstemp(suffix='.bin', prefix='encryptor-model-', dir=self.directory)
+        with os.fdopen(descriptor, 'wb') as model_file:
+            model_file.write(data)
+        self.paths.append(path)
+        return ModelHandle(path, n)
+
+    def close(self):
+        """
+        Remove hosted model files, processes that already use them keep their mappings
+        """
+        for path in self.paths:
+            os.remove(path)
+        self.paths = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
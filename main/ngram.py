@@ -0,0 +1,208 @@
+import array
+import string
+from collections import Counter
+
+from main import vectorized
+from main.config import ALPHABET_POWER
+from main.encode import LETTER_BYTES
+
+# letter numbers for every byte, everything that is not an english letter becomes SEPARATOR
+SEPARATOR = ALPHABET_POWER
+LETTER_NUMBERS = bytes.maketrans(
+    bytes(range(256)),
+    bytes(LETTER_BYTES.index(code) % ALPHABET_POWER if code in LETTER_BYTES else SEPARATOR for code in range(256)))
+
+# n-chart counts are kept in dense array up to this n, 26 ** 4 counts take 3.6 MB
+DENSE_MAX_N = 4
+
+# texts are counted by chunks of about this size, arrays of n-chart codes take 16 bytes per character of a chunk
+COUNT_CHUNK_SIZE = 1 << 18
+
+
+def letter_numbers(text: str):
+    """
+    Map every byte of text to its letter number, non-letters to SEPARATOR
+    :param text: Text to map
+    :return: Bytes with numbers in range [0, ALPHABET_POWER]
+    """
+    return text.encode('utf-8', 'surrogatepass').translate(LETTER_NUMBERS)
+
+
+def encode_ngram(ngram: str):
+    """
+    Get code of n-chart
+    :param ngram: String of n english letters
+    :return: Number of n-chart in base ALPHABET_POWER
+    """
+    code = 0
+    for number in letter_numbers(ngram):
+        if number == SEPARATOR:
+            raise Exception('N-chart must contain only english letters: {}'.format(ngram))
+        code = code * ALPHABET_POWER + number
+    return code
+
+
+def decode_ngram(code: int, n: int):
+    """
+    Get n-chart by its code
+    :param code: Number of n-chart in base ALPHABET_POWER
+    :param n: Size of n-chart
+    :return: String of n lower case letters
+    """
+    letters = []
+    for _ in range(n):
+        code, number = divmod(code, ALPHABET_POWER)
+        letters.append(string.ascii_lowercase[number])
+    return ''.join(reversed(letters))
+
+
+def ngram_codes(text: str, n: int):
+    """
+    Get codes of all windows of n consecutive letters with rolling base ALPHABET_POWER hash
+    :param text: Text to split into n-charts
+    :param n: Size of n-chart
+    :return: List (or numpy array) of n-chart codes in order of appearance
+    """
+    numbers = letter_numbers(text)
+    if vectorized.HAS_NUMPY:
+        return vectorized.ngram_codes(numbers, n, ALPHABET_POWER, SEPARATOR)
+
+    modulo = ALPHABET_POWER ** n
+    codes = []
+    for run in numbers.split(bytes([SEPARATOR])):
+        if len(run) < n:
+            continue
+        code = 0
+        for number in run[:n - 1]:
+            code = code * ALPHABET_POWER + number
+        for number in run[n - 1:]:
+            code = (code * ALPHABET_POWER + number) % modulo
+            codes.append(code)
+    return codes
+
+
+def ngram_windows(text: str, n: int):
+    """
+    Get english letters of text and positions of windows of n consecutive letters among them
+    :param text: Text to split into n-charts
+    :param n: Size of n-chart
+    :return: Bytes with letter numbers of every english letter and list (or numpy array) of window starts
+    """
+    numbers = letter_numbers(text)
+    if vectorized.HAS_NUMPY:
+        return vectorized.ngram_windows(numbers, n, SEPARATOR)
+
+    letters = numbers.replace(bytes([SEPARATOR]), b'')
+    starts = []
+    position = 0
+    for run in numbers.split(bytes([SEPARATOR])):
+        starts.extend(range(position, position + len(run) - n + 1))
+        position += len(run)
+    return letters, starts
+
+
+def overlapping_chunks(text: str, overlap: int, chunk_size: int = COUNT_CHUNK_SIZE):
+    """
+    Split text into chunks starting with the last overlap characters of the previous chunk, so that every window
+    of up to overlap + 1 characters ends in exactly one chunk and is fully contained in it
+    :param text: Text to split
+    :param overlap: Number of repeated characters, n - 1 for counting n-charts
+    :param chunk_size: Number of new characters in every chunk
+    :return: Generator of chunks
+    """
+    for start in range(0, len(text), chunk_size):
+        yield text[max(start - overlap, 0):start + chunk_size]
+
+
+def rotate_ngram(code: int, shift: int, n: int):
+    """
+    Get code of n-chart with every letter shifted back by Caesar shift
+    :param code: Number of n-chart in base ALPHABET_POWER
+    :param shift: Caesar shift
+    :param n: Size of n-chart
+    :return: Code of decoded n-chart
+    """
+    result = 0
+    power = 1
+    for _ in range(n):
+        code, number = divmod(code, ALPHABET_POWER)
+        result += (number - shift) % ALPHABET_POWER * power
+        power *= ALPHABET_POWER
+    return result
+
+
+class NgramCounter:
+    """
+    Class for counting n-charts by their codes, in dense array for small n or hash table for large n
+    """
+
+    def __init__(self, n: int, dense: bool = None):
+        """
+        :param n: Size of n-chart
+        :param dense: Count in dense array, by default for n up to DENSE_MAX_N. Hash table is faster for texts
+        much shorter than the array
+        """
+        self.n = n
+        self.dense = n <= DENSE_MAX_N if dense is None else dense
+        self.counts = None
+        self.clear()
+
+    def feed(self, text: str):
+        """
+        Count n-charts of text by chunks, so that memory for their codes does not grow with text
+        :param text: Text for counting
+        """
+        chunks = overlapping_chunks(text, self.n - 1, COUNT_CHUNK_SIZE) if len(text) > COUNT_CHUNK_SIZE else (text,)
+        for chunk in chunks:
+            codes = ngram_codes(chunk, self.n)
+            if vectorized.HAS_NUMPY:
+                vectorized.count_codes(codes, self.counts, self.dense)
+            else:
+                for code in codes:
+                    self.counts[code] += 1
+
+    def update(self, other):
+        """
+        Add counts of other counter
+        :param other: NgramCounter with the same n
+        """
+        if other.n != self.n:
+            raise Exception('Cannot merge counters of {}-charts and {}-charts'.format(self.n, other.n))
+        if other.dense != self.dense:
+            for code, count in other.items():
+                self.counts[code] += count
+        elif not self.dense:
+            self.counts.update(other.counts)
+        elif vectorized.HAS_NUMPY:
+            vectorized.add_counts(self.counts, other.counts)
+        else:
+            for code, count in enumerate(other.counts):
+                if count:
+                    self.counts[code] += count
+
+    def clear(self):
+        """
+        Clear all data
+        """
+        if self.dense:
+            self.counts = array.array('q', bytes(8 * ALPHABET_POWER ** self.n))
+        else:
+            self.counts = Counter()
+
+    def items(self):
+        """
+        Get counted n-charts
+        :return: List of pairs of n-chart code and its count
+        """
+        if self.dense and vectorized.HAS_NUMPY:
+            return vectorized.nonzero_counts(self.counts)
+        if self.dense:
+            return [(code, count) for code, count in enumerate(self.counts) if count]
+        return list(self.counts.items())
+
+    def get_dict(self):
+        """
+        Get counts by n-chart strings
+        :return: Dict of n-chart counts
+        """
+        return {decode_ngram(code, self.n): count for code, count in self.items()}
@@ -0,0 +1,330 @@
+import math
+import string
+from collections import Counter
+
+from main import vectorized
+from main.alphabet import LATIN, get_alphabet
+from main.config import ALPHABET_POWER
+from main.encode import has_non_ascii_letters, count_letters
+from main.ngram import DENSE_MAX_N
+
+METRICS = ('squares', 'chi_squared', 'log_likelihood')
+
+# n-chart model scoring metrics of Caesar shifts: sum of model counts or log-likelihood of decoded n-charts
+NGRAM_METRICS = ('counts', 'log_likelihood')
+
+# frequency used instead of zero model frequencies, so that logarithms and ratios stay finite
+MIN_FREQUENCY = 1e-6
+
+# count given to n-charts missing in n-chart model, less than count of any seen n-chart
+UNSEEN_COUNT = 0.01
+
+# smoothing methods of n-chart log probability models, see smoothed_log_probabilities
+SMOOTHING_METHODS = ('good_turing', 'additive')
+
+# counts up to this one are discounted by Good-Turing estimate, larger counts are reliable as they are
+GOOD_TURING_MAX_COUNT = 5
+
+# Good-Turing gives unseen n-charts at most this share of probability, e.g. for models of distinct words
+MAX_UNSEEN_MASS = 0.5
+
+# maximal number of passes over key columns when refining Vigenere key
+REFINE_ROUNDS = 10
+
+# number of n-chart windows used for refining Vigenere key, enough for every column of the longest searched key
+REFINE_SAMPLE_SIZE = 1 << 12
+
+# Vigenere key lengths up to this one are compared by n-chart log-likelihood of their keys
+SEARCH_KEY_LENGTH = 20
+
+# number of key lengths with the best initial keys, which are refined
+REFINED_KEY_LENGTHS = 2
+
+# relative log-likelihood loss allowed for choosing a divisor of the best key length
+KEY_LENGTH_TOLERANCE = 0.02
+
+
+def count_letter_vector(text: str, alphabet=None):
+    """
+    Count every letter of alphabet in text, ignoring case
+    :param text: Text for counting
+    :param alphabet: Alphabet or its spec, latin by default
+    :return: List of letter counts for every letter of alphabet and total number of letters in text
+    """
+    alphabet = get_alphabet(alphabet)
+    if alphabet is not LATIN:
+        codes = alphabet.get_codes(text)
+        if vectorized.HAS_NUMPY:
+            return vectorized.count_bytes(codes)[:alphabet.power], len(codes)
+        return [codes.count(number) for number in range(alphabet.power)], len(codes)
+    if vectorized.HAS_NUMPY:
+        counts = vectorized.count_bytes(text.encode('utf-8', 'surrogatepass'))
+        counts = [counts[ord(lower)] + counts[ord(upper)]
+                  for lower, upper in zip(string.ascii_lowercase, string.ascii_uppercase)]
+    else:
+        counts = [text.count(lower) + text.count(upper)
+                  for lower, upper in zip(string.ascii_lowercase, string.ascii_uppercase)]
+    total = count_letters(text) if has_non_ascii_letters(text) else sum(counts)
+    return counts, total
+
+
+def score_shifts(counts: list, total: int, model, metric: str = 'squares'):
+    """
+    Score every Caesar shift of letter counts against frequency model, lower score is better
+    :param counts: List of letter counts of encrypted text for every letter of model's alphabet
+    :param total: Total number of letters in encrypted text
+    :param model: FrequencyModel
+    :param metric: 'squares' for sum of squared frequency differences, 'chi_squared' or 'log_likelihood'
+    :return: List of scores for every shift
+    """
+    power = len(counts)
+    if metric == 'squares':
+        frequencies = [count / total if total else 0 for count in counts]
+        return [sum((model.frequencies[letter] - frequencies[(letter + shift) % power]) ** 2
+                    for letter in range(power)) for shift in range(power)]
+    if metric == 'chi_squared':
+        expected = [total * frequency for frequency in model.expected_frequencies]
+        return [sum((counts[(letter + shift) % power] - expected[letter]) ** 2 / expected[letter]
+                    for letter in range(power)) if total else 0 for shift in range(power)]
+    if metric == 'log_likelihood':
+        return [-sum(counts[(letter + shift) % power] * model.log_frequencies[letter]
+                     for letter in range(power)) for shift in range(power)]
+    raise Exception('Unknown metric: {}'.format(metric))
+
+
+def relative_margin(scores: list, higher_is_better: bool = False):
+    """
+    Get relative margin of the best non-negative score over the runner-up
+    :param scores: List of non-negative scores
+    :param higher_is_better: True if the best score is the highest
+    :return: Margin in range [0, 1], 0 if the best score is not unique
+    """
+    if len(scores) < 2:
+        return 1.0
+    best, runner_up = sorted(scores, reverse=higher_is_better)[:2]
+    if higher_is_better:
+        return (best - runner_up) / best if best else 0.0
+    return (runner_up - best) / runner_up if runner_up else 0.0
+
+
+def best_shift(scores: list):
+    """
+    Get shift with the lowest score
+    :param scores: List of scores
+    :return: First shift with the lowest score
+    """
+    return min(range(len(scores)), key=scores.__getitem__)
+
+
+def ngram_log_table(model):
+    """
+    Get log probabilities of n-charts of n-chart model
+    :param model: NgramModel, MappedNgramModel or LogProbabilityModel, whose table is used as is
+    :return: Sorted array of known n-chart codes (None if log probabilities are indexed by code),
+    array of their log probabilities and log probability of unknown n-charts. Without numpy codes are None
+    and log probabilities are a dict (or LogProbabilityModel) by code
+    """
+    if hasattr(model, 'log_table'):
+        return model.log_table()
+    if vectorized.HAS_NUMPY:
+        total = int(model.values.sum())
+        floor = math.log(UNSEEN_COUNT / total) if total else 0.0
+        codes, values = model.codes, vectorized.log_probabilities(model.values, total, floor)
+        if codes is not None and model.n <= DENSE_MAX_N:
+            codes, values = None, vectorized.dense_table(codes, values, ALPHABET_POWER ** model.n, floor)
+        return codes, values, floor
+
+    table = dict(model.items())
+    total = sum(table.values())
+    floor = math.log(UNSEEN_COUNT / total) if total else 0.0
+    return None, {code: math.log(count / total) for code, count in table.items() if count}, floor
+
+
+def smoothed_log_probabilities(count_numbers: dict, size: int, smoothing: str = 'good_turing', alpha: float = 1.0):
+    """
+    Get smoothed log probabilities of n-charts by their counts. Additive smoothing adds alpha to every count,
+    Good-Turing counts n-charts seen r times as (r + 1) * N(r + 1) / N(r), where N(r) is number of n-charts seen
+    r times, and gives unseen n-charts N(1) / total of probability
+    :param count_numbers: Dict of positive count to number of n-charts with this count
+    :param size: Number of all possible n-charts, seen or not
+    :param smoothing: Smoothing method from SMOOTHING_METHODS
+    :param alpha: Count added to every n-chart by additive smoothing
+    :return: Dict of count to log probability of n-chart with this count and log probability of unseen n-charts
+    :raises: Exception for unknown smoothing, non-positive alpha or empty counts
+    """
+    if smoothing not in SMOOTHING_METHODS:
+        raise Exception('Unknown smoothing: {}'.format(smoothing))
+    total = sum(count * number for count, number in count_numbers.items())
+    if not total:
+        raise Exception('Model has no n-charts')
+    unseen = size - sum(count_numbers.values())
+
+    if smoothing == 'additive':
+        if alpha <= 0:
+            raise Exception('Additive smoothing needs positive alpha')
+        denominator = total + alpha * size
+        return {count: math.log((count + alpha) / denominator) for count in count_numbers}, \
+            math.log(alpha / denominator)
+
+    adjusted = {count: (count + 1) * count_numbers[count + 1] / number
+                if count <= GOOD_TURING_MAX_COUNT and count_numbers.get(count + 1) else count
+                for count, number in count_numbers.items()}
+    unseen_mass = min(max(count_numbers.get(1, 0), UNSEEN_COUNT) / total, MAX_UNSEEN_MASS) if unseen else 0.0
+    seen_total = sum(adjusted[count] * number for count, number in count_numbers.items())
+    log_probabilities = {count: math.log(adjusted[count] / seen_total * (1 - unseen_mass)) for count in adjusted}
+    floor = math.log(unseen_mass / unseen) if unseen else min(log_probabilities.values())
+    return log_probabilities, floor
+
+
+def pair_log_table(counts: list):
+    """
+    Get log probabilities of bigrams
+    :param counts: List of bigram counts indexed by code, see model.marginal_counts
+    :return: List of log probabilities indexed by code
+    """
+    total = sum(counts)
+    floor = math.log(UNSEEN_COUNT / total) if total else 0.0
+    return [math.log(count / total) if count else floor for count in counts]
+
+
+def chain_key(letters: bytes, starts, length: int, pair_table: list):
+    """
+    Find Vigenere key with the best bigram log-likelihood of decoded text. Every bigram depends only on two
+    neighbouring key columns, so the best key is found exactly by dynamic programming over the cycle of columns
+    :param letters: Letter numbers of encrypted text, see ngram.ngram_windows
+    :param starts: Starts of bigram windows in letters
+    :param length: Key length
+    :param pair_table: Log probabilities from pair_log_table
+    :return: List of key shifts
+    """
+    if vectorized.HAS_NUMPY:
+        return vectorized.chain_key(letters, starts, length, ALPHABET_POWER, pair_table)
+
+    shifts = range(ALPHABET_POWER)
+    # rotated[first][second][shift] is log probability of bigram (first, second - shift)
+    rotated = [[[pair_table[first * ALPHABET_POWER + (second - shift) % ALPHABET_POWER] for shift in shifts]
+                for second in shifts] for first in shifts]
+
+    scores = []
+    for column in range(length):
+        pairs = Counter(letters[start] * ALPHABET_POWER + letters[start + 1]
+                        for start in starts if start % length == column)
+        rows = [[0.0] * ALPHABET_POWER for _ in shifts]
+        for pair, count in sorted(pairs.items()):
+            first, second = divmod(pair, ALPHABET_POWER)
+            for shift in shifts:
+                values = rotated[(first - shift) % ALPHABET_POWER][second]
+                rows[shift] = [total + count * value for total, value in zip(rows[shift], values)]
+        scores.append(rows)
+
+    best = scores[0]
+    back = []
+    for column in range(1, length):
+        transposed = list(zip(*scores[column]))
+        next_best, choices = [], []
+        for row in best:
+            sums = [[previous + value for previous, value in zip(row, values)] for values in transposed]
+            maxima = [max(values) for values in sums]
+            choices.append([values.index(maximum) for values, maximum in zip(sums, maxima)])
+            next_best.append(maxima)
+        best = next_best
+        back.append(choices)
+    first = max(shifts, key=lambda shift: best[shift][shift])
+
+    key = [first]
+    for choices in reversed(back):
+        key.append(choices[first][key[-1]])
+    return [first] + key[:0:-1]
+
+
+def score_key(letters: bytes, starts, key: list, n: int, log_table: tuple):
+    """
+    Score Vigenere key by n-chart log-likelihood of decoded text, higher is better
+    :param letters: Letter numbers of encrypted text, see ngram.ngram_windows
+    :param starts: Starts of n-chart windows in letters
+    :param key: List of key shifts
+    :param n: Size of n-chart
+    :param log_table: Log probabilities from ngram_log_table
+    :return: Sum of log probabilities of decoded n-charts
+    """
+    table_codes, table_values, floor = log_table
+    if vectorized.HAS_NUMPY:
+        return vectorized.score_key(letters, starts, key, n, ALPHABET_POWER, table_codes, table_values, floor)
+
+    length = len(key)
+    return sum(table_values.get(sum((letters[start + offset] - key[(start + offset) % length]) % ALPHABET_POWER *
+                                    ALPHABET_POWER ** (n - 1 - offset) for offset in range(n)), floor)
+               for start in starts)
+
+
+def refine_key(letters: bytes, starts, key: list, n: int, log_table: tuple, rounds: int = REFINE_ROUNDS):
+    """
+    Improve Vigenere key by coordinate descent over its columns, maximizing n-chart log-likelihood of decoded text.
+    A column change re-scores only windows that contain letters of the column
+    :param letters: Letter numbers of encrypted text, see ngram.ngram_windows
+    :param starts: Starts of n-chart windows in letters
+    :param key: List of key shifts, e.g. found by frequency analysis of every column
+    :param n: Size of n-chart
+    :param log_table: Log probabilities from ngram_log_table
+    :param rounds: Maximal number of passes over all columns
+    :return: List of key shifts
+    """
+    table_codes, table_values, floor = log_table
+    if vectorized.HAS_NUMPY:
+        return vectorized.refine_key(letters, starts, key, n, ALPHABET_POWER, table_codes, table_values, floor,
+                                     rounds)
+
+    key = list(key)
+    affected = _column_windows(starts, len(key), n)
+    for _ in range(rounds):
+        changed = False
+        for column, windows in enumerate(affected):
+            if not windows:
+                continue
+            current = key[column]
+            scores = _column_shift_scores(letters, windows, key, column, n, table_values, floor)
+            best = scores.index(max(scores))
+            key[column] = best if scores[best] > scores[current] else current
+            changed = changed or key[column] != current
+        if not changed:
+            break
+    return key
+
+
+def score_columns(letters: bytes, starts, key: list, n: int, log_table: tuple):
+    """
+    Score every shift of every Vigenere key column by n-chart log-likelihood, other columns are fixed
+    :param letters: Letter numbers of encrypted text, see ngram.ngram_windows
+    :param starts: Starts of n-chart windows in letters
+    :param key: List of key shifts
+    :param n: Size of n-chart
+    :param log_table: Log probabilities from ngram_log_table
+    :return: List of ALPHABET_POWER log-likelihoods of windows with letters of the column for every column,
+    higher is better
+    """
+    table_codes, table_values, floor = log_table
+    if vectorized.HAS_NUMPY:
+        return vectorized.score_columns(letters, starts, key, n, ALPHABET_POWER, table_codes, table_values, floor)
+    return [_column_shift_scores(letters, windows, list(key), column, n, table_values, floor)
+            for column, windows in enumerate(_column_windows(starts, len(key), n))]
+
+
+def _column_windows(starts, length: int, n: int):
+    affected = [[] for _ in range(length)]
+    for start in starts:
+        for column in {(start + offset) % length for offset in range(n)}:
+            affected[column].append(start)
+    return affected
+
+
+def _column_shift_scores(letters: bytes, starts: list, key: list, column: int, n: int, table: dict, floor: float):
+    length = len(key)
+    powers = [ALPHABET_POWER ** (n - 1 - offset) for offset in range(n)]
+    current = key[column]
+    scores = []
+    for shift in range(ALPHABET_POWER):
+        key[column] = shift
+        scores.append(sum(table.get(sum((letters[start + offset] - key[(start + offset) % length]) % ALPHABET_POWER *
+                                        powers[offset] for offset in range(n)), floor) for start in starts))
+    key[column] = current
+    return scores
@@ -0,0 +1,257 @@
+import asyncio
+import json
+import multiprocessing
+import os
+import struct
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+from main.config import DEFAULT_MAX_REQUEST_SIZE
+from main.encode import CaesarEncoder, CaesarDecoder, VigenereEncoder, VigenereDecoder, VernamEncoder, \
+    VernamDecoder, ByteVernamEncoder, ByteVernamDecoder
+from main.hack import CaesarHacker, CaesarBonusHacker, VigenereHacker, VigenereBonusHacker
+from main.model import compile_model, load_model
+from main.model_host import ModelHost
+from main.text_checker import TextChecker
+
+# every frame is a 4-byte big-endian length followed by utf-8 json
+FRAME_HEADER = struct.Struct('>I')
+
+# texts longer than this are encoded in worker processes, shorter ones in the event loop
+INLINE_SIZE = 1 << 16
+
+COMMANDS = ('encode', 'decode', 'hack')
+
+# workers are started lazily, forked ones would inherit sockets of open connections and keep them alive
+WORKER_START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+
+async def read_frame(reader: asyncio.StreamReader, max_size: int = None):
+    """
+    Read framed json message
+    :param reader: Stream reader
+    :param max_size: Maximal message size in bytes, None for no limit
+    :return: Decoded message or None at the end of stream
+    :raises: Exception if message is larger than max_size
+    """
+    try:
+        header = await reader.readexactly(FRAME_HEADER.size)
+    except asyncio.IncompleteReadError:
+        return None
+    size = FRAME_HEADER.unpack(header)[0]
+    if max_size is not None and size > max_size:
+        raise Exception('Request size {} exceeds limit {}'.format(size, max_size))
+    return json.loads(await reader.readexactly(size))
+
+
+async def write_frame(writer: asyncio.StreamWriter, message: dict):
+    """
+    Write framed json message, waiting while the peer does not read
+    :param writer: Stream writer
+    :param message: Message to send
+    """
+    body = json.dumps(message).encode('utf-8')
+    writer.write(FRAME_HEADER.pack(len(body)) + body)
+    await writer.drain()
+
+
+async def send_request(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, request: dict):
+    """
+    Send request to server and wait for its response
+    :param reader: Stream reader of connection
+    :param writer: Stream writer of connection
+    :param request: Request, see EncryptorServer
+    :return: Response
+    """
+    await write_frame(writer, request)
+    return await read_frame(reader)
+
+
+def get_encoder(request: dict):
+    """
+    Get encoder or decoder for request
+    :param request: Encode or decode request
+    :return: Encoder
+    """
+    cipher, key, decode = request.get('cipher'), request.get('key'), request['command'] == 'decode'
+    alphabet = request.get('alphabet')
+    if cipher == 'caesar':
+        return CaesarDecoder(key, alphabet) if decode else CaesarEncoder(key, alphabet)
+    if cipher == 'vigenere':
+        return VigenereDecoder(key, alphabet=alphabet) if decode else VigenereEncoder(key, alphabet=alphabet)
+    if cipher == 'vernam':
+        vernam_format = request.get('vernam_format', 'bits')
+        if vernam_format == 'bits':
+            return VernamDecoder(key) if decode else VernamEncoder(key)
+        if vernam_format == 'hex':
+            return ByteVernamDecoder(key, 'hex') if decode else ByteVernamEncoder(key, 'hex')
+        raise Exception('Unknown vernam format: {}'.format(vernam_format))
+    raise Exception('Unknown cipher: {}'.format(cipher))
+
+
+@lru_cache(maxsize=64)
+def get_hacker(path: str, n: int, cipher: str, metric: str, key_length_method: str, margin: float,
+               alphabet: str = None):
+    """
+    Get hacker with model file, hackers are kept in every process for next requests
+    :param path: Model file path
+    :param n: Size of a n-chart model, None for frequency model
+    :param cipher: 'caesar' or 'vigenere'
+    :param metric: Scoring metric, by default squares for frequency model, see CaesarBonusHacker for n-chart model
+    :param key_length_method: Vigenere key length detection method
+    :param margin: Early exit margin, None to score the whole text
+    :param alphabet: Alphabet spec of text, by default alphabet of model
+    :return: Hacker
+    """
+    model = load_model(path, n)
+    if n is not None:
+        model = compile_model(model, n, alphabet)
+    if cipher == 'caesar':
+        return CaesarHacker(model, metric or 'squares', margin, alphabet=alphabet) if n is None else \
+            CaesarBonusHacker(model, n, margin, metric=metric)
+    if cipher == 'vigenere':
+        if n is None:
+            return VigenereHacker(model, metric or 'squares', key_length_method, margin, alphabet=alphabet)
+        return VigenereBonusHacker(model, n, metric or 'squares', key_length_method, margin)
+    raise Exception('Unknown cipher: {}'.format(cipher))
+
+
+def run_request(request: dict, model_path: str = None, n: int = None):
+    """
+    Process request, in event loop or in worker process
+    :param request: Request with checked text
+    :param model_path: Model file path for hack request
+    :param n: Size of a n-chart model, None for frequency model
+    :return: Response without request id
+    """
+    text = request['text']
+    if request['command'] != 'hack':
+        return {'ok': True, 'text': get_encoder(request).encode(text)}
+    hacker = get_hacker(model_path, n, request.get('cipher'), request.get('metric'),
+                        request.get('key_length_method', 'autocorrelation'), request.get('margin'),
+                        request.get('alphabet'))
+    result = hacker.get_result(text)
+    return {'ok': True, 'text': result.text, 'key': result.key, 'confidence': result.confidence}
+
+
+class EncryptorServer:
+    """
+    Asyncio server, which keeps models resident and processes encode, decode and hack requests.
+
+    Requests and responses are framed json messages, see read_frame. Request is
+    {"id": any, "command": "encode" | "decode" | "hack", "cipher": ..., "text": ...} with "key" (and optional
+    "vernam_format") for encode and decode or "model" name (and optional "metric", "key_length_method", "margin")
+    for hack, and optional "alphabet" of text, see alphabet.get_alphabet. Response is
+    {"id": ..., "ok": true, "text": ...}, with "key" and "confidence" for hack, or {"id": ..., "ok": false,
+    "error": ...}. Hosted n-chart models may be compiled log probability models, see model.compile_log_model.
+
+    Hacks and long texts are processed in worker processes, which share hosted models. Every connection is served
+    request by request and no more than max_pending requests wait for workers, so clients are slowed down instead
+    of queueing unbounded work.
+    """
+
+    def __init__(self, models: dict, workers: int = None, max_request_size: int = DEFAULT_MAX_REQUEST_SIZE,
+                 max_pending: int = None):
+        """
+        :param models: Dict of model name to pair of model file path and size of n-chart model or None
+        :param workers: Number of worker processes, by default number of CPUs
+        :param max_request_size: Maximal request size in bytes
+        :param max_pending: Maximal number of requests processed by workers at once, by default twice workers
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.max_request_size = max_request_size
+        self.max_pending = max_pending or 2 * self.workers
+        self.host = ModelHost()
+        self.models = {name: self.host.host(path, n) for name, (path, n) in models.items()}
+        self.executor = ProcessPoolExecutor(self.workers, multiprocessing.get_context(WORKER_START_METHOD))
+        self.semaphore = None
+        self.server = None
+
+    async def process(self, request: dict):
+        """
+        Process request
+        :param request: Request
+        :return: Response
+        """
+        if not isinstance(request, dict):
+            return {'id': None, 'ok': False, 'error': 'Request must be a json object'}
+        try:
+            if request.get('command') not in COMMANDS:
+                raise Exception('Unknown command: {}'.format(request.get('command')))
+            if not isinstance(request.get('text'), str):
+                raise Exception('Request text must be a string')
+            TextChecker.check(request['text'], 0, request.get('alphabet'))
+
+            arguments = ()
+            if request['command'] == 'hack':
+                if request.get('model') not in self.models:
+                    raise Exception('Unknown model: {}'.format(request.get('model')))
+                handle = self.models[request['model']]
+                arguments = (handle.path, handle.n)
+            elif len(request['text']) <= INLINE_SIZE:
+                response = run_request(request)
+                return dict(response, id=request.get('id'))
+
+            async with self.semaphore:
+                loop = asyncio.get_running_loop()
+                response = await loop.run_in_executor(self.executor, run_request, request, *arguments)
+        except Exception as error:
+            response = {'ok': False, 'error': str(error)}
+        return dict(response, id=request.get('id'))
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """
+        Serve requests of one connection until it is closed
+        :param reader: Stream reader
+        :param writer: Stream writer
+        """
+        try:
+            while True:
+                try:
+                    request = await read_frame(reader, self.max_request_size)
+                except Exception as error:
+                    await write_frame(writer, {'id': None, 'ok': False, 'error': str(error)})
+                    break
+                if request is None:
+                    break
+                await write_frame(writer, await self.process(request))
+        except (ConnectionError, asyncio.CancelledError):
+            # connections still open at shutdown are cancelled, this is a normal way to end them
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0, path: str = None):
+        """
+        Start listening on TCP port or Unix socket
+        :param host: TCP host
+        :param port: TCP port, 0 for any free port
+        :param path: Unix socket path, used instead of TCP if given
+        :return: asyncio server
+        """
+        self.semaphore = asyncio.Semaphore(self.max_pending)
+        if path:
+            self.server = await asyncio.start_unix_server(self.handle_connection, path)
+        else:
+            self.server = await asyncio.start_server(self.handle_connection, host, port)
+        return self.server
+
+    async def serve_forever(self, host: str = '127.0.0.1', port: int = 0, path: str = None):
+        """
+        Start server and serve until cancelled
+        :param host: TCP host
+        :param port: TCP port
+        :param path: Unix socket path, used instead of TCP if given
+        """
+        server = await self.start(host, port, path)
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        """
+        Stop worker processes and remove hosted models
+        """
+        if self.server is not None:
+            self.server.close()
+        self.executor.shutdown()
+        self.host.close()
@@ -1,15 +1,122 @@
+import codecs
+import re
+
+from main.alphabet import LATIN, get_alphabet
+from main.config import DEFAULT_CHUNK_SIZE
+from main.instrument import instrumented
+
+NON_ASCII_RUN = re.compile('[^\x00-\x7f]+')
+
+# text is scanned by slices of this size, so that only slices with non-ascii symbols are searched for runs
+SLICE_SIZE = 1 << 16
+
+
+class TextCheckError(Exception):
+    """
+    Exception for incorrect text, keeps offset of the first incorrect symbol
+    """
+
+    def __init__(self, message: str, offset: int):
+        super().__init__('{} at offset {}'.format(message, offset))
+        self.offset = offset
+
+
 class TextChecker:
     """
     Class for check if text is correct
     """
 
     @staticmethod
-    def check(text: str):
+    def get_message(alphabet=None):
+        """
+        Get error message for letters not from alphabet
+        :param alphabet: Alphabet or its spec, latin by default
+        :return: Error message
+        """
+        alphabet = get_alphabet(alphabet)
+        if alphabet is LATIN:
+            return 'Text cannot contain non-english alphabet letters'
+        return 'Text cannot contain letters not from {} alphabet'.format(alphabet.name)
+
+    @staticmethod
+    def find_error(text: str, alphabet=None):
+        """
+        Find the first letter not from alphabet, for english alphabet only non-ascii parts of text are checked
+        symbol by symbol
+        :param text: input text
+        :param alphabet: Alphabet or its spec, latin by default
+        :return: Offset of the letter in text or None if text is correct
+        """
+        alphabet = get_alphabet(alphabet)
+        if alphabet is not LATIN:
+            return alphabet.find_foreign_letter(text)
+        if text.isascii():
+            return None
+        for start in range(0, len(text), SLICE_SIZE):
+            text_slice = text[start:start + SLICE_SIZE]
+            if text_slice.isascii():
+                continue
+            for match in NON_ASCII_RUN.finditer(text_slice):
+                run = match.group()
+                if any(symbol.isalpha() for symbol in set(run)):
+                    return start + match.start() + next(index for index, symbol in enumerate(run) if symbol.isalpha())
+        return None
+
+    @staticmethod
+    @instrumented(name='TextChecker.check')
+    def check(text: str, offset: int = 0, alphabet=None):
         """
         Check if text is correct
         :param text: input text
-        :raises: Exception if text contains letters not from english alphabet
+        :param offset: offset of text in the whole input, used in error
+        :param alphabet: Alphabet or its spec, latin by default
+        :raises: TextCheckError if text contains letters not from alphabet
+        """
+        error = TextChecker.find_error(text, alphabet)
+        if error is not None:
+            raise TextCheckError(TextChecker.get_message(alphabet), offset + error)
+
+    @staticmethod
+    def check_stream(chunks, alphabet=None):
+        """
+        Check text given by chunks while passing them through
+        :param chunks: iterable of text chunks
+        :param alphabet: Alphabet or its spec, latin by default
+        :return: Generator of checked chunks
+        :raises: TextCheckError if text contains letters not from alphabet, offset is in the whole text
+        """
+        offset = 0
+        for chunk in chunks:
+            TextChecker.check(chunk, offset, alphabet)
+            offset += len(chunk)
+            yield chunk
+
+    @staticmethod
+    @instrumented(name='TextChecker.check_buffer')
+    def check_buffer(buffer, chunk_size: int = DEFAULT_CHUNK_SIZE, alphabet=None):
+        """
+        Check if utf-8 buffer is correct, for english alphabet decoding only chunks with non-ascii bytes
+        :param buffer: bytes-like buffer, e.g. memory-mapped file
+        :param chunk_size: number of bytes checked at once
+        :param alphabet: Alphabet or its spec, latin by default
+        :raises: Exception if buffer is not utf-8, TextCheckError with byte offset if it contains letters not from
+        alphabet
         """
-        for letter in text:
-            if letter.isalpha() and ord(letter) > 122:
-                raise Exception('Text cannot contain non-english alphabet letters')
+        alphabet = get_alphabet(alphabet)
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        with memoryview(buffer) as view:
+            size = len(view)
+            try:
+                for start in range(0, size, chunk_size):
+                    chunk = view[start:start + chunk_size].tobytes()
+                    pending = decoder.getstate()[0]
+                    if alphabet is LATIN and chunk.isascii() and not pending:
+                        continue
+                    text = decoder.decode(chunk)
+                    error = TextChecker.find_error(text, alphabet)
+                    if error is not None:
+                        raise TextCheckError(TextChecker.get_message(alphabet),
+                                             start - len(pending) + len(text[:error].encode('utf-8')))
+                decoder.decode(b'', final=True)
+            except UnicodeDecodeError:
+                raise Exception('Text must be in utf-8 encoding')
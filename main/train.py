@@ -1,6 +1,19 @@
 import abc
 import json
-import string
+import os
+import re
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from main.alphabet import LATIN, get_alphabet
+from main.config import DEFAULT_CHUNK_SIZE
+from main.instrument import instrumented
+from main.model import dump_frequency_model, dump_ngram_model
+from main.ngram import NgramCounter, encode_ngram
+from main.text_checker import TextChecker
+
+# trailing english letters of a chunk, they may continue a n-chart in the next chunk
+TRAILING_LETTERS = re.compile(r'[A-Za-z]*\Z')
 
 
 class Trainer:
@@ -10,9 +23,12 @@ class Trainer:
 
     __metaclass__ = abc.ABCMeta
 
+    # number of the last letters of a chunk that are fed again with the next chunk, see feed_file
+    carry = 0
+
     @abc.abstractmethod
-    def __init__(self):
-        pass
+    def __init__(self, alphabet=None):
+        self.alphabet = get_alphabet(alphabet)
 
     @abc.abstractmethod
     def feed(self, text: str):
@@ -37,6 +53,61 @@ class Trainer:
         """
         pass
 
+    @abc.abstractmethod
+    def get_state(self):
+        """
+        Get raw counts of trainer, they can be serialized to json and merged
+        :return: Dict with trainer state
+        """
+        pass
+
+    @abc.abstractmethod
+    def merge(self, other):
+        """
+        Add counts of other trainer of the same type
+        :param other: Trainer
+        """
+        pass
+
+    @staticmethod
+    def from_state(state: dict):
+        """
+        Restore trainer from state
+        :param state: Dict from get_state
+        :return: DefaultTrainer or BonusTrainer
+        """
+        if state.get('trainer') == 'default':
+            trainer = DefaultTrainer(state.get('alphabet'))
+            trainer.count.update(state['count'])
+            trainer.letter_count = state['letter_count']
+        elif state.get('trainer') == 'bonus':
+            trainer = BonusTrainer(state['n'])
+            for ngram, count in state['count'].items():
+                trainer.counter.counts[encode_ngram(ngram)] += count
+        else:
+            raise Exception('Wrong trainer state format')
+        return trainer
+
+    def __add__(self, other):
+        result = Trainer.from_state(self.get_state())
+        result.merge(other)
+        return result
+
+    @instrumented
+    def feed_file(self, text_file, chunk_size: int = DEFAULT_CHUNK_SIZE):
+        """
+        Update model with text file, reading it by chunks
+        :param text_file: Text file object
+        :param chunk_size: Number of characters read at once
+        :raises: Exception if text contains letters not from trainer's alphabet
+        """
+        tail = ''
+        for chunk in TextChecker.check_stream(iter(lambda: text_file.read(chunk_size), ''), self.alphabet):
+            chunk = tail + chunk
+            self.feed(chunk)
+            # carried letters are fewer than n, so they are counted again only in n-charts that cross chunks
+            tail = TRAILING_LETTERS.search(chunk[max(len(chunk) - self.carry, 0):]).group() if self.carry else ''
+
     def get_json_model(self):
         """
         Get model in json format
@@ -44,26 +115,39 @@ class Trainer:
         """
         return json.dumps(self.get_model())
 
+    @abc.abstractmethod
+    def get_binary_model(self):
+        """
+        Get model in binary format, see main.model
+        :return: Model in binary format
+        """
+        pass
+
 
 class DefaultTrainer(Trainer):
     """
     Class for building frequency model and calculating coincidence index
     """
 
-    def __init__(self):
-        super().__init__()
+    def __init__(self, alphabet=None):
+        """
+        :param alphabet: Alphabet or its spec, latin by default
+        """
+        super().__init__(alphabet)
         self.count = {}
         self.letter_count = 0
 
+    @instrumented
     def feed(self, text: str):
         """
         Update model
         :param text: Text for feeding
         """
-        for symbol in text.lower():
-            if symbol.isalpha():
-                self.count[symbol] = self.count.get(symbol, 0) + 1
-                self.letter_count += 1
+        is_letter = str.isalpha if self.alphabet is LATIN else self.alphabet.letter_set.__contains__
+        for symbol, count in Counter(text.lower()).items():
+            if is_letter(symbol):
+                self.count[symbol] = self.count.get(symbol, 0) + count
+                self.letter_count += count
 
     def clear(self):
         """
@@ -72,14 +156,17 @@ class DefaultTrainer(Trainer):
         self.count.clear()
         self.letter_count = 0
 
+    @instrumented
     def get_model(self):
         """
         Get frequency model with coincidence index
         :return: Frequency model with coincidence index
         """
         result = {'coincidence_index': 0}
+        if self.alphabet is not LATIN:
+            result['alphabet'] = self.alphabet.name
 
-        for letter in string.ascii_lowercase:
+        for letter in self.alphabet.letters:
             result[letter] = self.count.get(letter, 0) / self.letter_count
             if self.letter_count > 1:
                 result['coincidence_index'] += (self.count.get(letter, 0) * (self.count.get(letter, 0) - 1)) / \
@@ -87,6 +174,36 @@ class DefaultTrainer(Trainer):
 
         return result
 
+    def get_binary_model(self):
+        """
+        Get frequency model with coincidence index in binary format
+        :return: Frequency model in binary format
+        """
+        return dump_frequency_model(self.get_model(), self.letter_count)
+
+    def get_state(self):
+        """
+        Get letter counts
+        :return: Dict with trainer state
+        """
+        state = {'trainer': 'default', 'count': dict(self.count), 'letter_count': self.letter_count}
+        if self.alphabet is not LATIN:
+            state['alphabet'] = self.alphabet.name
+        return state
+
+    def merge(self, other):
+        """
+        Add letter counts of other trainer
+        :param other: DefaultTrainer with the same alphabet
+        """
+        if not isinstance(other, DefaultTrainer):
+            raise Exception('Cannot merge {} into DefaultTrainer'.format(type(other).__name__))
+        if other.alphabet.letters != self.alphabet.letters:
+            raise Exception('Cannot merge models of different alphabets')
+        for symbol, count in other.count.items():
+            self.count[symbol] = self.count.get(symbol, 0) + count
+        self.letter_count += other.letter_count
+
 
 class BonusTrainer(Trainer):
     """
@@ -95,29 +212,145 @@ class BonusTrainer(Trainer):
 
     def __init__(self, n):
         super().__init__()
-        self.count = {}
         self.n = n
+        self.carry = n - 1
+        self.counter = NgramCounter(n)
 
+    @instrumented
     def feed(self, text: str):
         """
         Update model
         :param text: Text for feeding
         """
-        text = text.lower()
-        for index in range(0, len(text) - self.n + 1):
-            current_slice = text[index:index + self.n]
-            if current_slice.isalpha():
-                self.count[current_slice] = self.count.get(current_slice, 0) + 1
+        self.counter.feed(text)
 
     def clear(self):
         """
         Clear all data
         """
-        self.count = {}
+        self.counter.clear()
 
+    @instrumented
     def get_model(self):
         """
         Get n-chart frequency model
         :return: n-chart frequency model
         """
-        return self.count
+        return self.counter.get_dict()
+
+    def get_binary_model(self):
+        """
+        Get n-chart frequency model in binary format
+        :return: n-chart frequency model in binary format
+        """
+        return dump_ngram_model(self.counter)
+
+    def get_state(self):
+        """
+        Get n-chart counts
+        :return: Dict with trainer state
+        """
+        return {'trainer': 'bonus', 'n': self.n, 'count': self.counter.get_dict()}
+
+    def merge(self, other):
+        """
+        Add n-chart counts of other trainer
+        :param other: BonusTrainer with the same n
+        """
+        if not isinstance(other, BonusTrainer):
+            raise Exception('Cannot merge {} into BonusTrainer'.format(type(other).__name__))
+        self.counter.update(other.counter)
+
+
+def get_trainer(n: int = None, alphabet=None):
+    """
+    Get empty trainer
+    :param n: Size of a n-chart model, None for frequency model
+    :param alphabet: Alphabet or its spec of frequency model, n-chart models are only latin
+    :return: BonusTrainer if n is given, DefaultTrainer otherwise
+    :raises: Exception if n is not positive or alphabet of n-chart model is not latin
+    """
+    if n is None:
+        return DefaultTrainer(alphabet)
+    if n < 1:
+        raise Exception('Size of a n-chart model must be positive')
+    if get_alphabet(alphabet) is not LATIN:
+        raise Exception('N-chart models support only latin alphabet')
+    return BonusTrainer(n)
+
+
+def save_checkpoint(path: str, trainer: Trainer, files: list):
+    """
+    Atomically save trainer state with list of processed files
+    :param path: Checkpoint file path
+    :param trainer: Trainer
+    :param files: Paths of processed corpus files
+    """
+    with open(path + '.tmp', 'w') as checkpoint_file:
+        json.dump({'files': files, 'state': trainer.get_state()}, checkpoint_file)
+    os.replace(path + '.tmp', path)
+
+
+def load_checkpoint(path: str):
+    """
+    Load trainer state with list of processed files
+    :param path: Checkpoint file path
+    :return: Trainer and list of processed files
+    """
+    with open(path, 'r') as checkpoint_file:
+        checkpoint = json.load(checkpoint_file)
+    return Trainer.from_state(checkpoint['state']), checkpoint['files']
+
+
+def train_file(path: str, n: int = None, chunk_size: int = DEFAULT_CHUNK_SIZE, alphabet=None):
+    """
+    Count one corpus file
+    :param path: Corpus file path
+    :param n: Size of a n-chart model, None for frequency model
+    :param chunk_size: Number of characters read at once
+    :param alphabet: Alphabet or its spec of frequency model
+    :return: Trainer state for the file
+    """
+    trainer = get_trainer(n, alphabet)
+    with open(path, 'r') as text_file:
+        trainer.feed_file(text_file, chunk_size)
+    return trainer.get_state()
+
+
+@instrumented(name='train_files')
+def train_files(paths: list, n: int = None, workers: int = 1, checkpoint: str = None,
+                chunk_size: int = DEFAULT_CHUNK_SIZE, alphabet=None):
+    """
+    Count corpus files in worker processes and merge their counts
+    :param paths: Corpus file paths
+    :param n: Size of a n-chart model, None for frequency model
+    :param workers: Number of worker processes
+    :param checkpoint: Checkpoint file path, training resumes from it and saves it after every file
+    :param chunk_size: Number of characters read at once
+    :param alphabet: Alphabet or its spec of frequency model
+    :return: Trainer with counts of all files
+    """
+    trainer, done = get_trainer(n, alphabet), []
+    if checkpoint and os.path.exists(checkpoint):
+        trainer, done = load_checkpoint(checkpoint)
+        if type(trainer) is not type(get_trainer(n, alphabet)) or getattr(trainer, 'n', None) != n or \
+                trainer.alphabet.letters != get_alphabet(alphabet).letters:
+            raise Exception('Checkpoint was made for other model type')
+    paths = [path for path in paths if path not in done]
+
+    def add(path, state):
+        trainer.merge(Trainer.from_state(state))
+        done.append(path)
+        if checkpoint:
+            save_checkpoint(checkpoint, trainer, done)
+
+    if workers <= 1:
+        for path in paths:
+            add(path, train_file(path, n, chunk_size, alphabet))
+        return trainer
+
+    with ProcessPoolExecutor(workers) as executor:
+        futures = {executor.submit(train_file, path, n, chunk_size, alphabet): path for path in paths}
+        for future in as_completed(futures):
+            add(futures[future], future.result())
+    return trainer
@@ -0,0 +1,523 @@
+import importlib
+import importlib.util
+
+from main.config import ALPHABET_POWER
+
+
+class LazyNumpy:
+    """
+    Stand-in for numpy module, which imports numpy on the first use and replaces itself with it, so that commands
+    without vectorized code do not pay for numpy import
+    """
+
+    def __getattr__(self, name):
+        global numpy
+        numpy = importlib.import_module('numpy')
+        return getattr(numpy, name)
+
+
+HAS_NUMPY = importlib.util.find_spec('numpy') is not None
+numpy = LazyNumpy() if HAS_NUMPY else None
+
+# until numpy is imported, shorter inputs are left to python code, which processes them faster than numpy imports
+IMPORT_MIN_SIZE = 1 << 18
+
+
+def pays_off(size: int):
+    """
+    Check if vectorized code should process input of given size
+    :param size: Input size
+    :return: True if numpy is installed and either is imported already or input is large enough to pay for import
+    """
+    return HAS_NUMPY and (size >= IMPORT_MIN_SIZE or not isinstance(numpy, LazyNumpy))
+
+
+def shift_letters(data: bytes, offsets: list, position: int = 0):
+    """
+    Shift ascii letters of buffer by key offsets, tiled over letter positions only
+    :param data: ascii/utf-8 buffer
+    :param offsets: shift for every key position
+    :param position: position of the first letter in the whole text
+    :return: Buffer with shifted letters and number of letters in it
+    """
+    source = numpy.frombuffer(data, dtype=numpy.uint8)
+    # case bit is 0x20, so folding to lower case maps both 'A' and 'a' to the same index
+    index = (source | 0x20) - numpy.uint8(ord('a'))
+    mask = index < ALPHABET_POWER
+    letters = source[mask]
+    if not letters.size:
+        return bytes(data), 0
+
+    key = numpy.roll(numpy.asarray(offsets, dtype=numpy.uint8), -(position % len(offsets)))
+    shift = numpy.tile(key, letters.size // key.size + 1)[:letters.size]
+
+    result = source.copy()
+    result[mask] = (letters & 0x20 | ord('A')) + (index[mask] + shift) % ALPHABET_POWER
+    return result.tobytes(), letters.size
+
+
+def shift_alphabet_letters(data: bytes, alphabet, offsets: list, position: int = 0):
+    """
+    Shift letters of any alphabet by key offsets, tiled over letter positions only
+    :param data: utf-32-le buffer
+    :param alphabet: Alphabet with lookup arrays
+    :param offsets: shift for every key position
+    :param position: position of the first letter in the whole text
+    :return: utf-32-le buffer with shifted letters and number of letters in it
+    """
+    source = numpy.frombuffer(data, dtype='<u4')
+    numbers = numpy.asarray(alphabet.number_array, dtype=numpy.int16)
+    # codes above the last letter are looked up as -1 too, so that every code is one array index
+    index = numbers[numpy.minimum(source, numbers.size - 1)]
+    index[source >= numbers.size] = -1
+    mask = index >= 0
+    if not mask.any():
+        return bytes(data), 0
+
+    positions = numpy.flatnonzero(mask)
+    key = numpy.roll(numpy.asarray(offsets, dtype=numpy.int16), -(position % len(offsets)))
+    shift = numpy.tile(key, positions.size // key.size + 1)[:positions.size]
+
+    upper = numpy.asarray(alphabet.upper_array, dtype=numpy.intp)[source[positions]]
+    result = source.copy()
+    result[positions] = numpy.asarray(alphabet.letter_array, dtype='<u4')[
+        upper, (index[positions] + shift) % alphabet.power]
+    return result.tobytes(), positions.size
+
+
+def xor_keystream(data: bytes, keystream: bytes):
+    """
+    XOR buffer with cyclic keystream
+    :param data: bytes-like buffer
+    :param keystream: key bytes, repeated over data
+    :return: XORed bytes
+    """
+    source = numpy.frombuffer(data, dtype=numpy.uint8)
+    key = numpy.frombuffer(keystream, dtype=numpy.uint8)
+    return (source ^ numpy.tile(key, source.size // key.size + 1)[:source.size]).tobytes()
+
+
+def count_bytes(data: bytes):
+    """
+    Count every byte value in buffer
+    :param data: bytes-like buffer
+    :return: List of 256 counts
+    """
+    return numpy.bincount(numpy.frombuffer(data, dtype=numpy.uint8), minlength=256).tolist()
+
+
+def mean_coincidence_index(codes: bytes, length: int, alphabet_power: int):
+    """
+    Calculate coincidence index averaged over all columns for key length
+    :param codes: Letter numbers
+    :param length: Key length
+    :param alphabet_power: Number of letters in alphabet
+    :return: Mean coincidence index of columns with more than 2 letters
+    """
+    source = numpy.frombuffer(codes, dtype=numpy.uint8).astype(numpy.int64)
+    columns = numpy.arange(source.size) % length
+    counts = numpy.bincount(columns * alphabet_power + source, minlength=length * alphabet_power)
+    counts = counts.reshape(length, alphabet_power)
+    sizes = counts.sum(axis=1)
+    mask = sizes > 2
+    if not mask.any():
+        return 0
+    indexes = (counts[mask] * (counts[mask] - 1)).sum(axis=1) / (sizes[mask] * (sizes[mask] - 1))
+    return float(indexes.mean())
+
+
+def coincidence_rate(codes: bytes, shift: int):
+    """
+    Count letters equal to the letter shift positions further
+    :param codes: Letter numbers
+    :param shift: Distance between compared letters
+    :return: Number of equal pairs
+    """
+    source = numpy.frombuffer(codes, dtype=numpy.uint8)
+    return int(numpy.count_nonzero(source[:-shift] == source[shift:]))
+
+
+def repeat_distances(codes: bytes, alphabet_power: int):
+    """
+    Find distances between consecutive occurrences of every trigram
+    :param codes: Letter numbers
+    :param alphabet_power: Number of letters in alphabet
+    :return: Array of distances
+    """
+    source = numpy.frombuffer(codes, dtype=numpy.uint8).astype(numpy.int64)
+    trigrams = (source[:-2] * alphabet_power + source[1:-1]) * alphabet_power + source[2:]
+    order = numpy.argsort(trigrams, kind='stable')
+    same = trigrams[order[1:]] == trigrams[order[:-1]]
+    return (order[1:] - order[:-1])[same]
+
+
+def ngram_codes(numbers: bytes, n: int, alphabet_power: int, separator: int):
+    """
+    Get codes of all windows of n consecutive letters
+    :param numbers: Letter numbers of every symbol, non-letters are separator
+    :param n: Size of n-chart
+    :param alphabet_power: Number of letters in alphabet
+    :param separator: Number of non-letter symbols
+    :return: Array of n-chart codes in order of appearance
+    """
+    source = numpy.frombuffer(numbers, dtype=numpy.uint8)
+    size = source.size - n + 1
+    if size <= 0:
+        return numpy.zeros(0, dtype=numpy.int64)
+
+    separators = numpy.concatenate(([0], numpy.cumsum(source == separator)))
+    valid = separators[n:] == separators[:size]
+
+    codes = numpy.zeros(size, dtype=numpy.int64)
+    for offset in range(n):
+        codes = codes * alphabet_power + source[offset:offset + size]
+    return codes[valid]
+
+
+def ngram_windows(numbers: bytes, n: int, separator: int):
+    """
+    Get letters and starts of windows of n consecutive letters among them
+    :param numbers: Letter numbers of every symbol, non-letters are separator
+    :param n: Size of n-chart
+    :param separator: Number of non-letter symbols
+    :return: Bytes with letter numbers and array of window starts
+    """
+    source = numpy.frombuffer(numbers, dtype=numpy.uint8)
+    positions = numpy.flatnonzero(source != separator)
+    starts = numpy.flatnonzero(positions[n - 1:] - positions[:max(positions.size - n + 1, 0)] == n - 1)
+    return source[positions].tobytes(), starts
+
+
+def marginal_counts(codes, values, n: int, alphabet_power: int, size: int):
+    """
+    Sum n-chart counts by their first letters
+    :param codes: Array of model n-chart codes, None if values are indexed by code
+    :param values: Array of n-chart counts
+    :param n: Size of n-chart
+    :param alphabet_power: Number of letters in alphabet
+    :param size: Number of first letters
+    :return: List of counts for every code of size letters
+    """
+    if codes is None:
+        codes = numpy.arange(values.size, dtype=numpy.int64)
+    first = numpy.asarray(codes, dtype=numpy.int64) // alphabet_power ** (n - size)
+    return numpy.bincount(first, weights=values, minlength=alphabet_power ** size).astype(numpy.int64).tolist()
+
+
+def log_probabilities(values, total: int, floor: float):
+    """
+    Get log probabilities of n-chart counts
+    :param values: Array of n-chart counts
+    :param total: Sum of counts
+    :param floor: Log probability of zero counts
+    :return: Array of log probabilities
+    """
+    result = numpy.full(values.shape, floor)
+    seen = values > 0
+    result[seen] = numpy.log(values[seen] / total)
+    return result
+
+
+def count_numbers(values):
+    """
+    Count n-charts with every count
+    :param values: Array of n-chart counts
+    :return: Dict of positive count to number of n-charts with it
+    """
+    counts, numbers = numpy.unique(values[values > 0], return_counts=True)
+    return dict(zip(counts.tolist(), numbers.tolist()))
+
+
+def smoothed_table(codes, values, size: int, log_probabilities: dict, floor: float):
+    """
+    Get dense float32 table of smoothed n-chart log probabilities
+    :param codes: Array of n-chart codes, None if values are indexed by code
+    :param values: Array of their counts
+    :param size: Number of all n-charts
+    :param log_probabilities: Dict of count to log probability, see score.smoothed_log_probabilities
+    :param floor: Log probability of unseen n-charts
+    :return: Array of size log probabilities indexed by code
+    """
+    result = numpy.full(size, floor, dtype=numpy.float32)
+    seen = values > 0
+    counts, inverse = numpy.unique(values[seen], return_inverse=True)
+    table = numpy.array([log_probabilities[count] for count in counts.tolist()], dtype=numpy.float32)
+    result[numpy.flatnonzero(seen) if codes is None else codes[seen]] = table[inverse]
+    return result
+
+
+def expected_counts(log_probabilities, total: int):
+    """
+    Get n-chart counts expected by log probabilities
+    :param log_probabilities: Array of log probabilities
+    :param total: Number of n-charts
+    :return: Array of float counts
+    """
+    return numpy.exp(log_probabilities, dtype=numpy.float64) * total
+
+
+def float32_view(buffer):
+    """
+    Get numpy array over buffer of 4 byte floats without copying
+    :param buffer: bytes-like buffer
+    :return: Array
+    """
+    return numpy.frombuffer(buffer, dtype=numpy.float32)
+
+
+def dense_table(codes, values, size: int, default: float):
+    """
+    Get array of values indexed by code
+    :param codes: Array of codes
+    :param values: Array of their values
+    :param size: Number of all codes
+    :param default: Value of missing codes
+    :return: Array of size values
+    """
+    result = numpy.full(size, default)
+    result[codes] = values
+    return result
+
+
+def lookup_log_probabilities(codes, table_codes, table_values, floor: float):
+    """
+    Get log probabilities of n-charts
+    :param codes: Array of n-chart codes
+    :param table_codes: Sorted array of known n-chart codes, None if table_values are indexed by code
+    :param table_values: Array of their log probabilities
+    :param floor: Log probability of unknown n-charts
+    :return: Array of log probabilities
+    """
+    if table_codes is None:
+        # float32 tables of compiled models are summed in float64
+        return table_values[codes].astype(numpy.float64, copy=False)
+    if not table_codes.size:
+        return numpy.full(codes.shape, floor)
+    index = numpy.minimum(numpy.searchsorted(table_codes, codes), table_codes.size - 1)
+    return numpy.where(table_codes[index] == codes, table_values[index], floor)
+
+
+def score_key(letters: bytes, starts, key: list, n: int, alphabet_power: int, table_codes, table_values,
+              floor: float):
+    """
+    Score Vigenere key by n-chart log-likelihood of decoded text
+    :param letters: Letter numbers of encrypted text
+    :param starts: Array of starts of n-chart windows in letters
+    :param key: List of key shifts
+    :param n: Size of n-chart
+    :param alphabet_power: Number of letters in alphabet
+    :param table_codes: Sorted array of known n-chart codes, None if table_values are indexed by code
+    :param table_values: Array of their log probabilities
+    :param floor: Log probability of unknown n-charts
+    :return: Sum of log probabilities of decoded n-charts
+    """
+    positions = numpy.asarray(starts, dtype=numpy.int64)[:, None] + numpy.arange(n)
+    window_letters = numpy.frombuffer(letters, dtype=numpy.uint8).astype(numpy.int64)[positions]
+    offsets = numpy.array(key, dtype=numpy.int64)[positions % len(key)]
+    powers = alphabet_power ** numpy.arange(n - 1, -1, -1, dtype=numpy.int64)
+    codes = ((window_letters - offsets) % alphabet_power * powers).sum(axis=1)
+    return float(lookup_log_probabilities(codes, table_codes, table_values, floor).sum())
+
+
+def chain_key(letters: bytes, starts, length: int, alphabet_power: int, pair_table):
+    """
+    Find Vigenere key with the best bigram log-likelihood of decoded text by dynamic programming over the cycle of
+    key columns, as every bigram depends only on two neighbouring columns
+    :param letters: Letter numbers of encrypted text
+    :param starts: Array of starts of bigram windows in letters
+    :param length: Key length
+    :param alphabet_power: Number of letters in alphabet
+    :param pair_table: Log probabilities of bigrams indexed by code
+    :return: List of key shifts
+    """
+    source = numpy.frombuffer(letters, dtype=numpy.uint8).astype(numpy.int64)
+    starts = numpy.asarray(starts, dtype=numpy.int64)
+    table = numpy.asarray(pair_table).reshape(alphabet_power, alphabet_power)
+    shifts = numpy.arange(alphabet_power)
+
+    # scores[column][a, b] is log-likelihood of bigrams starting in column, decoded with shifts a and b
+    scores = numpy.zeros((length, alphabet_power, alphabet_power))
+    for column in range(length):
+        first = starts[starts % length == column]
+        pairs, weights = numpy.unique(source[first] * alphabet_power + source[first + 1], return_counts=True)
+        rows = (pairs // alphabet_power)[:, None, None] - shifts[:, None]
+        columns = (pairs % alphabet_power)[:, None, None] - shifts
+        scores[column] = (table[rows % alphabet_power, columns % alphabet_power] * weights[:, None, None]).sum(axis=0)
+
+    # best[a, b] is the best score of columns before current one with shift a of the first and b of current column
+    best = scores[0]
+    back = []
+    for column in range(1, length):
+        total = best[:, :, None] + scores[column]
+        back.append(total.argmax(axis=1))
+        best = total.max(axis=1)
+    first = int(best.diagonal().argmax())
+
+    key = [first]
+    for choice in reversed(back):
+        key.append(int(choice[first, key[-1]]))
+    return [first] + key[:0:-1]
+
+
+def _column_windows(letters: bytes, starts, length: int, n: int, alphabet_power: int):
+    positions = numpy.asarray(starts, dtype=numpy.int64)[:, None] + numpy.arange(n)
+    window_letters = numpy.frombuffer(letters, dtype=numpy.uint8).astype(numpy.int64)[positions]
+    columns = positions % length
+    powers = alphabet_power ** numpy.arange(n - 1, -1, -1, dtype=numpy.int64)
+    affected = [numpy.flatnonzero((columns == column).any(axis=1)) for column in range(length)]
+    return window_letters, columns, powers, affected
+
+
+def _column_shift_scores(windows: tuple, key, column: int, alphabet_power: int, table_codes, table_values,
+                         floor: float):
+    window_letters, columns, powers, affected = windows
+    index = affected[column]
+    window_columns = columns[index]
+    shifts = numpy.arange(alphabet_power)[:, None, None]
+    offsets = numpy.where(window_columns == column, shifts, key[window_columns])
+    codes = ((window_letters[index] - offsets) % alphabet_power * powers).sum(axis=2)
+    return lookup_log_probabilities(codes, table_codes, table_values, floor).sum(axis=1)
+
+
+def score_columns(letters: bytes, starts, key: list, n: int, alphabet_power: int, table_codes, table_values,
+                  floor: float):
+    """
+    Score every shift of every Vigenere key column by n-chart log-likelihood, other columns are fixed
+    :param letters: Letter numbers of encrypted text
+    :param starts: Array of starts of n-chart windows in letters
+    :param key: List of key shifts
+    :param n: Size of n-chart
+    :param alphabet_power: Number of letters in alphabet
+    :param table_codes: Sorted array of known n-chart codes, None if table_values are indexed by code
+    :param table_values: Array of their log probabilities
+    :param floor: Log probability of unknown n-charts
+    :return: List of alphabet_power log-likelihoods of windows with letters of the column for every column
+    """
+    windows = _column_windows(letters, starts, len(key), n, alphabet_power)
+    key = numpy.array(key, dtype=numpy.int64)
+    return [_column_shift_scores(windows, key, column, alphabet_power, table_codes, table_values, floor).tolist()
+            for column in range(len(key))]
+
+
+def refine_key(letters: bytes, starts, key: list, n: int, alphabet_power: int, table_codes, table_values,
+               floor: float, rounds: int):
+    """
+    Improve Vigenere key by coordinate descent over its columns, maximizing n-chart log-likelihood
+    :param letters: Letter numbers of encrypted text
+    :param starts: Array of starts of n-chart windows in letters
+    :param key: List of key shifts
+    :param n: Size of n-chart
+    :param alphabet_power: Number of letters in alphabet
+    :param table_codes: Sorted array of known n-chart codes, None if table_values are indexed by code
+    :param table_values: Array of their log probabilities
+    :param floor: Log probability of unknown n-charts
+    :param rounds: Maximal number of passes over all columns
+    :return: List of key shifts
+    """
+    windows = _column_windows(letters, starts, len(key), n, alphabet_power)
+    key = numpy.array(key, dtype=numpy.int64)
+
+    for _ in range(rounds):
+        changed = False
+        for column in range(len(key)):
+            if not windows[3][column].size:
+                continue
+            scores = _column_shift_scores(windows, key, column, alphabet_power, table_codes, table_values, floor)
+            best = int(scores.argmax())
+            if scores[best] > scores[key[column]]:
+                key[column] = best
+                changed = True
+        if not changed:
+            break
+    return key.tolist()
+
+
+def count_codes(codes, counts, dense: bool):
+    """
+    Add codes to counts
+    :param codes: Array of codes
+    :param counts: Writable array of counts for dense counting, Counter otherwise
+    :param dense: True if counts is an array indexed by code
+    """
+    if dense:
+        target = numpy.frombuffer(counts, dtype=numpy.int64)
+        target += numpy.bincount(codes, minlength=target.size)
+    else:
+        values, value_counts = numpy.unique(codes, return_counts=True)
+        for value, count in zip(values.tolist(), value_counts.tolist()):
+            counts[value] += count
+
+
+def nonzero_counts(counts):
+    """
+    Get non-zero dense counts
+    :param counts: Array of int64 counts indexed by code
+    :return: List of pairs of code and its count
+    """
+    source = numpy.frombuffer(counts, dtype=numpy.int64)
+    codes = numpy.flatnonzero(source)
+    return list(zip(codes.tolist(), source[codes].tolist()))
+
+
+def add_counts(target, source):
+    """
+    Add dense counts to other dense counts
+    :param target: Writable array of int64 counts
+    :param source: Array of int64 counts of the same size
+    """
+    target = numpy.frombuffer(target, dtype=numpy.int64)
+    target += numpy.frombuffer(source, dtype=numpy.int64)
+
+
+def score_rotations(codes, counts, n: int, alphabet_power: int, model_codes, model_values, floor: float = 0):
+    """
+    Score every Caesar shift of counted n-charts against model
+    :param codes: Array of distinct n-chart codes of encrypted text
+    :param counts: Array of their counts
+    :param n: Size of n-chart
+    :param alphabet_power: Number of letters in alphabet
+    :param model_codes: Sorted array of model n-chart codes, None if model_values are indexed by code
+    :param model_values: Array of model values for them, e.g. counts or log probabilities
+    :param floor: Value of n-charts missing in model
+    :return: List of alphabet_power scores, sums of model values of decoded n-charts
+    """
+    if not model_values.size:
+        return [0 for shift in range(alphabet_power)]
+    codes = numpy.asarray(codes, dtype=numpy.int64)
+    counts = numpy.asarray(counts, dtype=numpy.float64 if model_values.dtype.kind == 'f' else model_values.dtype)
+    powers = alphabet_power ** numpy.arange(n, dtype=numpy.int64)
+    digits = (codes[:, None] // powers) % alphabet_power
+
+    scores = []
+    for shift in range(alphabet_power):
+        rotated = ((digits - shift) % alphabet_power * powers).sum(axis=1)
+        if model_codes is None:
+            scores.append((model_values[rotated] * counts).sum().item())
+            continue
+        index = numpy.minimum(numpy.searchsorted(model_codes, rotated), model_codes.size - 1)
+        found = model_codes[index] == rotated
+        scores.append((numpy.where(found, model_values[index], floor) * counts).sum().item())
+    return scores
+
+
+def sorted_table(table: dict):
+    """
+    Convert dict to arrays for lookup with binary search
+    :param table: Dict with integer keys and numeric values
+    :return: Sorted array of keys and array of corresponding values
+    """
+    codes = numpy.fromiter(table.keys(), dtype=numpy.int64, count=len(table))
+    values = numpy.array(list(table.values()))
+    if not values.size:
+        values = values.astype(numpy.int64)
+    order = numpy.argsort(codes)
+    return codes[order], values[order]
+
+
+def int64_views(*buffers):
+    """
+    Get numpy arrays over buffers of 8 byte integers without copying
+    :param buffers: bytes-like buffers or None
+    :return: List of arrays, None stays None
+    """
+    return [None if buffer is None else numpy.frombuffer(buffer, dtype=numpy.int64) for buffer in buffers]
@@ -0,0 +1,12 @@
+from setuptools import setup
+
+setup(
+    name='encryptor',
+    version='0.1.0',
+    description='Caesar, Vigenere and Vernam ciphers with frequency analysis hacking',
+    python_requires='>=3.7',
+    py_modules=['encryptor'],
+    packages=['main', 'benchmarks'],
+    extras_require={'numpy': ['numpy']},
+    entry_points={'console_scripts': ['encryptor = encryptor:main']}
+)
@@ -1,17 +1,63 @@
+import asyncio
+import io
+import json
+import math
 import random
 import string
+import subprocess
+import sys
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
 
 import pytest
 
-from main.encode import CaesarEncoder, CaesarDecoder, VigenereEncoder, VigenereDecoder
-from main.hack import VigenereHacker, CaesarHacker, CaesarBonusHacker
-from main.train import DefaultTrainer, BonusTrainer
+import encryptor
+from main import vectorized
+from main.config import DEFAULT_PREFIX_SIZE
+from main.encode import Encoder, CaesarEncoder, CaesarDecoder, VigenereEncoder, VigenereDecoder, \
+    ByteVernamEncoder, ByteVernamDecoder, key_schedule_stats
+from main.hack import VigenereHacker, CaesarHacker, CaesarBonusHacker, VigenereBonusHacker
+from main.instrument import Profiler
+from main import instrument, key_length, ngram
+from main.key_length import letter_codes
+from main.model import compile_model, compile_log_model, dump_log_model, load_model, read_binary_model
+from main.model_host import ModelHost
+from main.ngram import NgramCounter, encode_ngram
+from main.server import EncryptorServer, send_request
+from main.text_checker import TextChecker, TextCheckError
+from main.train import DefaultTrainer, BonusTrainer, Trainer, get_trainer, load_checkpoint, train_files
 
 
 def get_random_string(text_length):
     return ''.join([random.choice(string.ascii_letters) for _ in range(text_length)])
 
 
+def to_cyrillic(text):
+    # english text with letters replaced by cyrillic ones keeps frequencies of a natural language
+    letters = 'абвгдежзийклмнопрстуфхцчшщ'
+    return text.translate(str.maketrans(string.ascii_lowercase + string.ascii_uppercase, letters + letters.upper()))
+
+
+def disable_numpy(monkeypatch):
+    # objects built afterwards see no numpy, as if it was not installed
+    monkeypatch.setattr(vectorized, 'HAS_NUMPY', False)
+    monkeypatch.setattr(vectorized, 'numpy', None)
+
+
+@pytest.fixture(params=['numpy', 'python'])
+def backend(request, monkeypatch):
+    if request.param == 'numpy' and not vectorized.HAS_NUMPY:
+        pytest.skip('numpy is not installed')
+    if request.param == 'python':
+        disable_numpy(monkeypatch)
+    return request.param
+
+
+def hack_with_handle(handle, text):
+    model = handle.get_model()
+    return CaesarHacker(model).hack(text) if handle.n is None else CaesarBonusHacker(model, handle.n).hack(text)
+
+
 class TestEncodeDecode:
 
     @pytest.mark.parametrize("text_length, key", [
@@ -27,6 +73,22 @@ class TestEncodeDecode:
         caesar_decoder = CaesarDecoder(key)
         assert caesar_decoder.encode(encrypted_text) == text
 
+    @pytest.mark.parametrize("text_filename", [
+        'tests/src/1.txt',
+        'tests/src/2.txt'
+    ])
+    def test_caesar_table_matches_calc(self, text_filename):
+        text = open(text_filename, 'r').read()
+        for key in range(26):
+            for coder in (CaesarEncoder(key), CaesarDecoder(key)):
+                assert coder.encode(text) == Encoder.encode_chunk(coder, text, 0)[0]
+
+    def test_caesar_encode_bytes(self):
+        text = get_random_string(1000)
+        for key in range(26):
+            assert CaesarEncoder(key).encode_bytes(text.encode('ascii')) == \
+                CaesarEncoder(key).encode(text).encode('ascii')
+
     @pytest.mark.parametrize("text_length, key_length", [
         (1, 3),
         (1000, 5),
@@ -42,6 +104,214 @@ class TestEncodeDecode:
         vigenere_decoder = VigenereDecoder(key)
         assert vigenere_decoder.encode(encrypted_text) == text
 
+    @pytest.mark.skipif(not vectorized.HAS_NUMPY, reason='numpy is not installed')
+    @pytest.mark.parametrize("text_filename, key_length", [
+        ('tests/src/1.txt', 1),
+        ('tests/src/2.txt', 7),
+        ('tests/src/3.txt', 31),
+        ('tests/src/4.txt', 300)
+    ])
+    def test_vigenere_backends(self, text_filename, key_length):
+        text = open(text_filename, 'r').read()
+        key = get_random_string(key_length)
+        for coder_class in (VigenereEncoder, VigenereDecoder):
+            assert coder_class(key, 'numpy').encode(text) == coder_class(key, 'python').encode(text)
+
+    @pytest.mark.skipif(not vectorized.HAS_NUMPY, reason='numpy is not installed')
+    def test_vigenere_backends_non_letters(self):
+        text = ''.join(random.choice(string.ascii_letters + string.punctuation + ' \n') for _ in range(10000))
+        key = get_random_string(13)
+        for coder_class in (VigenereEncoder, VigenereDecoder):
+            assert coder_class(key, 'numpy').encode(text) == coder_class(key, 'python').encode(text)
+
+    @pytest.mark.parametrize("text_filename, chunk_size", [
+        ('tests/src/1.txt', 1),
+        ('tests/src/2.txt', 17),
+        ('tests/src/4.txt', 1000)
+    ])
+    def test_encode_stream(self, text_filename, chunk_size):
+        text = open(text_filename, 'r').read()
+        key = get_random_string(11)
+        for coder in (VigenereEncoder(key), VigenereDecoder(key), CaesarEncoder(7), CaesarDecoder(7)):
+            chunks = [text[index:index + chunk_size] for index in range(0, len(text), chunk_size)]
+            assert ''.join(coder.encode_stream(chunks)) == coder.encode(text)
+
+            output_file = io.StringIO()
+            coder.encode_file(io.StringIO(text), output_file, chunk_size)
+            assert output_file.getvalue() == coder.encode(text)
+
+    @pytest.mark.parametrize("text_filename, chunk_size", [
+        ('tests/src/2.txt', 1),
+        ('tests/src/3.txt', 100),
+        ('tests/src/4.txt', 1 << 20)
+    ])
+    def test_encode_buffer(self, text_filename, chunk_size):
+        text = open(text_filename, 'r').read() + '\u2026 \u2014'
+        key = get_random_string(11)
+        for coder in (VigenereEncoder(key), VigenereDecoder(key, 'python'), CaesarEncoder(7), CaesarDecoder(7)):
+            source = text.encode('utf-8')
+            target = bytearray(len(source))
+            coder.encode_buffer(source, target, chunk_size=chunk_size)
+            assert target.decode('utf-8') == coder.encode(text)
+
+    def test_encode_parallel(self):
+        text = open('tests/src/2.txt', 'r').read()
+        key = get_random_string(13)
+        for coder in (VigenereEncoder(key), VigenereDecoder(key, 'python'), CaesarEncoder(7)):
+            assert coder.encode_parallel(text, 2, 1000) == coder.encode(text)
+
+    @pytest.mark.parametrize("alphabet, key", [
+        ('cyrillic', 'ключ'),
+        ('digits', '2718'),
+        ('latin+cyrillic', 'kлюч'),
+        ('\u03b1\u03b2\u03b3\u03b4\u03b5', '\u03b3\u03b1')
+    ])
+    def test_alphabet_encoder_decoder(self, alphabet, key, backend):
+        text = to_cyrillic(open('tests/src/2.txt', 'r').read())
+        text += ' 0123456789 \u0391\u03b2\u03b3 abc xyz ABC XYZ'
+        for encoder, decoder in ((CaesarEncoder(len(key), alphabet), CaesarDecoder(len(key), alphabet)),
+                                 (VigenereEncoder(key, alphabet=alphabet),
+                                  VigenereDecoder(key, alphabet=alphabet))):
+            encrypted_text = encoder.encode(text)
+            assert encrypted_text != text
+            assert decoder.encode(encrypted_text) == text
+            assert ''.join(encoder.encode_stream(text[start:start + 101] for start in range(0, len(text), 101))) \
+                == encrypted_text
+            source = text.encode('utf-8')
+            target = bytearray(len(source))
+            if alphabet == 'latin+cyrillic':
+                # latin letters shifted to cyrillic ones change utf-8 length, so buffers cannot be encoded
+                with pytest.raises(Exception):
+                    encoder.encode_buffer(source, target, chunk_size=101)
+                continue
+            encoder.encode_buffer(source, target, chunk_size=101)
+            assert target.decode('utf-8') == encrypted_text
+        assert VigenereEncoder(key, 'python', alphabet).encode(text) == \
+            VigenereEncoder(key, alphabet=alphabet).encode(text)
+
+    @pytest.mark.parametrize("alphabet", ['latin+digits', 'cyrillic+digits', 'ab1', 'aA'])
+    def test_invalid_alphabet(self, alphabet):
+        with pytest.raises(Exception):
+            CaesarEncoder(1, alphabet)
+
+    def test_key_schedule_cache(self):
+        key = get_random_string(17)
+        stats = key_schedule_stats()
+        encoder, decoder = VigenereEncoder(key), VigenereDecoder(key)
+        assert VigenereEncoder(key).tables is encoder.tables
+        assert key_schedule_stats()['misses'] == stats['misses'] + 2
+        assert key_schedule_stats()['hits'] == stats['hits'] + 1
+        text = open('tests/src/2.txt', 'r').read()
+        assert decoder.encode(encoder.encode(text)) == text
+        with pytest.raises(Exception):
+            VigenereDecoder('not a word')
+        for alphabet in (None, 'cyrillic'):
+            with pytest.raises(Exception, match='empty'):
+                VigenereEncoder('', alphabet=alphabet)
+            with pytest.raises(Exception, match='empty'):
+                VigenereDecoder('', alphabet=alphabet)
+
+    def test_cli_lazy_imports(self, tmp_path):
+        text = open('tests/src/3.txt', 'r').read()
+        input_path, output_path = tmp_path / 'input.txt', tmp_path / 'output.txt'
+        input_path.write_text(text)
+        script = "import sys, encryptor; encryptor.main(sys.argv[1:]); print(*sorted(set(sys.modules) & {}))".format(
+            {'numpy', 'json', 'concurrent.futures', 'main.hack', 'main.train', 'main.model', 'main.server'})
+        result = subprocess.run([sys.executable, '-c', script, 'encode', '--cipher', 'vigenere', '--key', 'lemon',
+                                 '--input-file', str(input_path), '--output-file', str(output_path)],
+                                capture_output=True, text=True, check=True)
+        assert result.stdout.strip() == ''
+        assert output_path.read_text() == VigenereEncoder('lemon').encode(text)
+
+    @pytest.mark.parametrize("metric", ['counts', 'log_likelihood'])
+    def test_cli_without_numpy(self, metric, tmp_path):
+        trainer = BonusTrainer(3)
+        trainer.feed(open('tests/src/3.txt', 'r').read())
+        text = open('tests/src/2.txt', 'r').read()
+        model_path, input_path, output_path = tmp_path / 'm3.json', tmp_path / 'input.txt', tmp_path / 'output.txt'
+        model_path.write_text(trainer.get_json_model())
+        input_path.write_text(CaesarEncoder(11).encode(text))
+        # numpy is blocked before main modules are imported, so that no object is built with numpy arrays
+        script = "import sys; sys.modules['numpy'] = None; import encryptor; from main import vectorized; " \
+                 "encryptor.main(sys.argv[1:]); print(vectorized.HAS_NUMPY)"
+        result = subprocess.run([sys.executable, '-c', script, 'hack', '--cipher', 'caesar', '--bonus', '--n', '3',
+                                 '--metric', metric, '--model-file', str(model_path), '--input-file', str(input_path),
+                                 '--output-file', str(output_path)], capture_output=True, text=True, check=True)
+        assert result.stdout.strip() == 'False'
+        assert output_path.read_text() == text
+
+    def test_cli_mmap_in_place(self, tmp_path):
+        text = open('tests/src/3.txt', 'r').read()
+        encrypted_text = VigenereEncoder('lemon').encode(text)
+        path = tmp_path / 'text.txt'
+        path.write_text(text)
+        arguments = ['--cipher', 'vigenere', '--key', 'lemon', '--input-file', str(path), '--output-file', str(path)]
+
+        encryptor.main(['encode', '--mmap'] + arguments)
+        assert path.read_text() == encrypted_text
+        with pytest.raises(Exception):
+            encryptor.main(['decode'] + arguments)
+        assert path.read_text() == encrypted_text
+        encryptor.main(['decode', '--mmap'] + arguments)
+        assert path.read_text() == text
+
+    @pytest.mark.parametrize("text_filename, key, output_format", [
+        ('tests/src/1.txt', 0, 'hex'),
+        ('tests/src/2.txt', 255, 'raw'),
+        ('tests/src/3.txt', 2 ** 100 + 7, 'hex'),
+        ('tests/src/4.txt', 2 ** 1000 - 1, 'raw')
+    ])
+    def test_byte_vernam_encoder_decoder(self, text_filename, key, output_format):
+        text = open(text_filename, 'r').read()
+        encrypted_text = ByteVernamEncoder(key, output_format).encode(text)
+        assert len(encrypted_text) == len(text.encode('utf-8')) * (2 if output_format == 'hex' else 1)
+        assert ByteVernamDecoder(key, output_format).encode(encrypted_text) == text
+
+
+class TestTextChecker:
+
+    @pytest.mark.parametrize("text, offset", [
+        ('plain ascii text', None),
+        ('dash \u2014 and ellipsis\u2026 are not letters', None),
+        ('russian \u0430 letter', 8),
+        ('\u2026\u2026\u00e9t\u00e9', 2),
+    ])
+    def test_check(self, text, offset):
+        assert TextChecker.find_error(text) == offset
+        text = 'x' * 10 + text
+        chunks = [text[start:start + 3] for start in range(0, len(text), 3)]
+        buffer = text.encode('utf-8')
+        if offset is None:
+            TextChecker.check(text)
+            assert ''.join(TextChecker.check_stream(chunks)) == text
+            TextChecker.check_buffer(buffer, 3)
+            return
+
+        for check in (lambda: TextChecker.check(text), lambda: list(TextChecker.check_stream(chunks))):
+            with pytest.raises(TextCheckError) as error:
+                check()
+            assert error.value.offset == offset + 10
+        with pytest.raises(TextCheckError) as error:
+            TextChecker.check_buffer(buffer, 3)
+        assert error.value.offset == len(text[:offset + 10].encode('utf-8'))
+
+    @pytest.mark.parametrize("alphabet, text, offset", [
+        ('cyrillic', '\u0401\u043b\u043a\u0430, 2 \u2026', None),
+        ('cyrillic', '\u0451\u043b\u043a\u0430 tree', 5),
+        ('latin+cyrillic', 'tree \u0451\u043b\u043a\u0430 \u00e9', 10),
+        ('digits', '3.14', None),
+        ('digits', '3.14 pi', 5),
+    ])
+    def test_check_alphabet(self, alphabet, text, offset):
+        assert TextChecker.find_error(text, alphabet) == offset
+        if offset is None:
+            TextChecker.check(text, 0, alphabet)
+            TextChecker.check_buffer(text.encode('utf-8'), 3, alphabet)
+            return
+        with pytest.raises(TextCheckError) as error:
+            TextChecker.check_buffer(text.encode('utf-8'), 3, alphabet)
+        assert error.value.offset == len(text[:offset].encode('utf-8'))
+
 
 class TestTrainerHacker:
 
@@ -67,6 +337,17 @@ class TestTrainerHacker:
         hacker = CaesarHacker(model)
         assert hacker.hack(encrypted_text) == text
 
+    @pytest.mark.parametrize("metric", ['squares', 'chi_squared', 'log_likelihood'])
+    def test_caesar_hacker_metrics(self, metric):
+        trainer = DefaultTrainer()
+        trainer.feed(open('tests/src/1.txt', 'r').read())
+        text = open('tests/src/3.txt', 'r').read()
+
+        hacker = CaesarHacker(trainer.get_model(), metric)
+        shift, scores = hacker.score(CaesarEncoder(17).encode(text))
+        assert shift == 17
+        assert len(scores) == 26 and min(scores) == scores[17]
+
     @pytest.mark.parametrize("train_filename, text_filename, key_length", [
         ('tests/src/1.txt', 'tests/src/2.txt', 2),
         ('tests/src/3.txt', 'tests/src/4.txt', 97),
@@ -90,13 +371,329 @@ class TestTrainerHacker:
         hacker = VigenereHacker(model)
         assert hacker.hack(encrypted_text) == text
 
+    @pytest.mark.parametrize("method", ['first-column', 'mean-ic', 'autocorrelation', 'kasiski'])
+    def test_vigenere_key_length_methods(self, method):
+        trainer = DefaultTrainer()
+        trainer.feed(open('tests/src/1.txt', 'r').read())
+        text = open('tests/src/4.txt', 'r').read()
+
+        key = 'thequickbrownfoxjumpsoverthelazydog'
+        encrypted_text = VigenereEncoder(key).encode(text)
+
+        hacker = VigenereHacker(trainer.get_model(), key_length_method=method)
+        assert hacker.estimate_key_length(letter_codes(encrypted_text))[0] == len(key)
+        assert hacker.hack(encrypted_text) == text
+
+    @pytest.mark.skipif(not vectorized.HAS_NUMPY, reason='numpy is not installed')
+    def test_key_length_backends(self, monkeypatch):
+        codes = letter_codes(VigenereEncoder(get_random_string(19)).encode(open('tests/src/2.txt', 'r').read()))
+        curves = [key_length.mean_coincidence_curve, key_length.autocorrelation_curve, key_length.kasiski_curve]
+        numpy_results = [curve(codes) for curve in curves]
+        monkeypatch.setattr(vectorized, 'HAS_NUMPY', False)
+        for curve, numpy_result in zip(curves, numpy_results):
+            assert curve(codes) == pytest.approx(numpy_result)
+
+    def test_vigenere_coincidence_curve(self):
+        trainer = DefaultTrainer()
+        trainer.feed(open('tests/src/1.txt', 'r').read())
+        hacker = VigenereHacker(trainer.get_model(), key_length_method='first-column')
+
+        encrypted_text = VigenereEncoder(get_random_string(7)).encode(open('tests/src/2.txt', 'r').read())
+        letter_text = ''.join(letter for letter in encrypted_text if letter.isalpha())
+
+        key_length, curve = hacker.estimate_key_length(letter_codes(encrypted_text))
+        assert key_length == 7
+        assert curve == [hacker.check_length(letter_text, length) for length in range(1, len(curve) + 1)]
+
+    def test_hack_many(self):
+        trainer = DefaultTrainer()
+        trainer.feed(open('tests/src/1.txt', 'r').read())
+        model = compile_model(trainer.get_model())
+
+        texts = [text for text in open('tests/src/2.txt', 'r').read().split('\n\n') if len(text) > 500][:10]
+        keys = [random.randrange(26) for _ in texts]
+        encrypted_texts = [CaesarEncoder(key).encode(text) for key, text in zip(keys, texts)]
+
+        assert list(CaesarHacker(model).hack_many(encrypted_texts)) == texts
+        assert VigenereHacker(model).caesar_hacker.model is model
+
+    def test_load_model_cache(self, tmp_path):
+        trainer = DefaultTrainer()
+        trainer.feed(open('tests/src/1.txt', 'r').read())
+        model_path = tmp_path / 'model.json'
+        model_path.write_text(trainer.get_json_model())
+
+        model = load_model(str(model_path))
+        assert load_model(str(model_path)) is model
+        assert model.frequencies == pytest.approx([trainer.get_model()[letter] for letter in string.ascii_lowercase])
+
+    @pytest.mark.parametrize("n", [1, 2, 4, 5])
+    def test_ngram_counter(self, n, backend, monkeypatch):
+        text = open('tests/src/3.txt', 'r').read()
+        expected = {}
+        for index in range(len(text) - n + 1):
+            current_slice = text[index:index + n].lower()
+            if current_slice.isalpha():
+                expected[current_slice] = expected.get(current_slice, 0) + 1
+
+        trainer = BonusTrainer(n)
+        trainer.feed(text)
+        assert trainer.get_model() == expected
+
+        counter = NgramCounter(n, not trainer.counter.dense)
+        counter.feed(text)
+        assert counter.get_dict() == expected
+        counter.update(trainer.counter)
+        assert counter.get_dict() == {ngram: 2 * count for ngram, count in expected.items()}
+
+        # chunks of text without separators overlap by n - 1 letters
+        letters = ''.join(symbol for symbol in text if symbol.isascii() and symbol.isalpha())
+        whole = NgramCounter(n)
+        whole.feed(letters)
+        monkeypatch.setattr(ngram, 'COUNT_CHUNK_SIZE', 7)
+        chunked = NgramCounter(n)
+        chunked.feed(letters)
+        assert chunked.get_dict() == whole.get_dict()
+
+    @pytest.mark.parametrize("n", [None, 3, 5])
+    def test_binary_model(self, n, tmp_path, backend):
+        trainer = DefaultTrainer() if n is None else BonusTrainer(n)
+        trainer.feed(open('tests/src/1.txt', 'r').read())
+        model_path = tmp_path / 'model.bin'
+        model_path.write_bytes(trainer.get_binary_model())
+
+        text = open('tests/src/2.txt', 'r').read()
+        encrypted_text = CaesarEncoder(9).encode(text)
+        model = read_binary_model(model_path.read_bytes(), n)
+        assert model.get_dict() == pytest.approx(trainer.get_model())
+        hacker = CaesarHacker(model) if n is None else CaesarBonusHacker(model, n)
+        assert hacker.hack(encrypted_text) == text
+
+    @pytest.mark.parametrize("margin", [None, 0.5])
+    def test_cli_mmap_hack(self, margin, tmp_path):
+        trainer = DefaultTrainer()
+        trainer.feed(open('tests/src/3.txt', 'r').read())
+        model_path, input_path, output_path = tmp_path / 'model.json', tmp_path / 'input.txt', tmp_path / 'output.txt'
+        model_path.write_text(trainer.get_json_model())
+        text = open('tests/src/2.txt', 'r').read()
+        input_path.write_text(CaesarEncoder(11).encode(text))
+
+        encryptor.main(['hack', '--cipher', 'caesar', '--mmap', '--model-file', str(model_path), '--input-file',
+                        str(input_path), '--output-file', str(output_path)] +
+                       (['--margin', str(margin)] if margin is not None else []))
+        assert output_path.read_text() == text
+        hacker = CaesarHacker(trainer.get_model(), margin=margin)
+        result = hacker.search_buffer(input_path.read_bytes())
+        assert result.key == 11 and (margin is None or result.size < len(text))
+
+    @pytest.mark.parametrize("smoothing, n", [('good_turing', 3), ('additive', 2), ('good_turing', 4)])
+    def test_log_model(self, smoothing, n, backend, monkeypatch):
+        trainer = BonusTrainer(n)
+        trainer.feed(open('tests/src/3.txt', 'r').read())
+        text = open('tests/src/2.txt', 'r').read()
+        encrypted_text = CaesarEncoder(9).encode(text)
+
+        model = read_binary_model(dump_log_model(compile_log_model(trainer.get_model(), n, smoothing)), n)
+        probabilities = [math.exp(value) for value in model.values]
+        assert len(probabilities) == 26 ** n and sum(probabilities) == pytest.approx(1, rel=1e-4)
+        assert model.get(encode_ngram('the'[:n])) > model.floor
+        assert CaesarBonusHacker(model, n).hack(encrypted_text) == text
+        with pytest.raises(Exception):
+            CaesarBonusHacker(model, n, metric='counts')
+        if backend == 'numpy':
+            with monkeypatch.context() as patch:
+                disable_numpy(patch)
+                python_model = read_binary_model(dump_log_model(compile_log_model(trainer.get_model(), n, smoothing)),
+                                                 n)
+            assert list(model.values) == list(python_model.values)
+        assert VigenereBonusHacker(model, n).hack(VigenereEncoder('lemon').encode(text)) == text
+
+    def test_alphabet_hacker(self, tmp_path, backend):
+        trainer = DefaultTrainer('cyrillic')
+        trainer.feed_file(io.StringIO(to_cyrillic(open('tests/src/1.txt', 'r').read())))
+        model_path = tmp_path / 'model.bin'
+        model_path.write_bytes(trainer.get_binary_model())
+        model = load_model(str(model_path))
+        assert model.get_dict() == pytest.approx(trainer.get_model())
+        assert Trainer.from_state(trainer.get_state()).get_model() == trainer.get_model()
+        with pytest.raises(Exception):
+            get_trainer(2, 'cyrillic')
+
+        text = to_cyrillic(open('tests/src/2.txt', 'r').read())
+        assert CaesarHacker(model).hack(CaesarEncoder(20, 'cyrillic').encode(text)) == text
+        result = VigenereHacker(trainer.get_model()).get_result(
+            VigenereEncoder('\u043b\u0438\u043c\u043e\u043d', alphabet='cyrillic').encode(text))
+        assert result.key == '\u043b\u0438\u043c\u043e\u043d' and result.text == text
+
+    @pytest.mark.parametrize("key, n", [
+        ('key', 2),
+        ('cipher', 3),
+        ('lemon', 3),
+        ('secret', 5),
+    ])
+    def test_vigenere_bonus_hacker(self, key, n, backend):
+        trainer = BonusTrainer(n)
+        trainer.feed(open('tests/src/1.txt', 'r').read())
+        text = open('tests/src/3.txt', 'r').read()[:160]
+        encrypted_text = VigenereEncoder(key).encode(text)
+
+        hacker = VigenereBonusHacker(trainer.get_model(), n)
+        assert hacker.hack(encrypted_text) == text
+
+    @pytest.mark.parametrize("cipher, n, key, margin", [
+        ('caesar', None, 3, 0.5),
+        ('caesar', 3, 17, 0.5),
+        ('vigenere', None, 'lemon', 0.2),
+        ('vigenere', 3, 'lemon', 0.1),
+    ])
+    def test_hack_result(self, cipher, n, key, margin):
+        trainer = get_trainer(n)
+        trainer.feed(open('tests/src/2.txt', 'r').read())
+        text = open('tests/src/4.txt', 'r').read() * 4
+        encrypted_text = (CaesarEncoder if cipher == 'caesar' else VigenereEncoder)(key).encode(text)
+
+        for current_margin in (None, margin):
+            if cipher == 'caesar':
+                hacker = CaesarHacker(trainer.get_model(), margin=current_margin) if n is None else \
+                    CaesarBonusHacker(trainer.get_model(), n, margin=current_margin)
+            else:
+                hacker = VigenereHacker(trainer.get_model(), margin=current_margin) if n is None else \
+                    VigenereBonusHacker(trainer.get_model(), n, margin=current_margin)
+            result = hacker.get_result(encrypted_text)
+            assert result.key == key
+            assert result.text == text
+            assert margin <= result.confidence <= 1
+            assert result.size == (len(text) if current_margin is None else DEFAULT_PREFIX_SIZE)
+
+        for prefix_size in (0, -DEFAULT_PREFIX_SIZE):
+            with pytest.raises(Exception, match='Prefix size'):
+                if cipher == 'caesar':
+                    CaesarHacker(trainer.get_model(), prefix_size=prefix_size) if n is None else \
+                        CaesarBonusHacker(trainer.get_model(), n, prefix_size=prefix_size)
+                else:
+                    VigenereHacker(trainer.get_model(), prefix_size=prefix_size) if n is None else \
+                        VigenereBonusHacker(trainer.get_model(), n, prefix_size=prefix_size)
+
+    @pytest.mark.parametrize("n", [None, 3, 5])
+    def test_mergeable_trainer(self, n, tmp_path):
+        texts = [open('tests/src/{}.txt'.format(index), 'r').read() for index in (2, 3, 4)]
+        expected = get_trainer(n)
+        expected.feed('\n'.join(texts))
+
+        trainers = []
+        for text in texts:
+            trainers.append(get_trainer(n))
+            trainers[-1].feed_file(io.StringIO(text), 7)
+        merged = Trainer.from_state(json.loads(json.dumps((trainers[0] + trainers[1]).get_state()))) + trainers[2]
+        assert merged.get_model() == expected.get_model()
+
+        letters = ''.join(symbol for symbol in texts[1] if symbol.isascii() and symbol.isalpha())
+        streamed, whole = get_trainer(n), get_trainer(n)
+        streamed.feed_file(io.StringIO(letters), 7)
+        whole.feed(letters)
+        assert streamed.get_model() == whole.get_model()
+
+        paths = []
+        for index, text in enumerate(texts):
+            paths.append(str(tmp_path / '{}.txt'.format(index)))
+            open(paths[-1], 'w').write(text)
+        checkpoint = str(tmp_path / 'checkpoint.json')
+        train_files(paths[:1], n, checkpoint=checkpoint)
+        assert train_files(paths, n, 2, checkpoint, 7).get_model() == expected.get_model()
+        assert sorted(load_checkpoint(checkpoint)[1]) == paths
+
+    def test_bonus_train_requires_n(self, tmp_path):
+        model_path = tmp_path / 'model.json'
+        for arguments in ([], ['--n', '0']):
+            with pytest.raises(Exception):
+                encryptor.main(['train', '--bonus', '--text-file', 'tests/src/3.txt', '--model-file', str(model_path)] +
+                               arguments)
+        encryptor.main(['train', '--bonus', '--n', '2', '--text-file', 'tests/src/3.txt', '--model-file',
+                        str(model_path)])
+        assert all(len(ngram) == 2 for ngram in json.loads(model_path.read_text()))
+
+    @pytest.mark.parametrize("n", [None, 2, 5])
+    def test_model_host(self, n, tmp_path):
+        trainer = DefaultTrainer() if n is None else BonusTrainer(n)
+        trainer.feed(open('tests/src/1.txt', 'r').read())
+
+        texts = [open(filename, 'r').read() for filename in ('tests/src/2.txt', 'tests/src/3.txt')]
+        encrypted_texts = [CaesarEncoder(key).encode(text) for key, text in zip((4, 21), texts)]
+
+        with ModelHost(str(tmp_path)) as host:
+            handle = host.host(trainer.get_model(), n)
+            with ProcessPoolExecutor(2) as executor:
+                assert list(executor.map(hack_with_handle, [handle] * 2, encrypted_texts)) == texts
+        assert not list(tmp_path.iterdir())
+
+    def test_profiler(self):
+        trainer = DefaultTrainer()
+        trainer.feed(open('tests/src/2.txt', 'r').read())
+        text = open('tests/src/3.txt', 'r').read()
+        encrypted_text = VigenereEncoder('lemon').encode(text)
+
+        with Profiler(allocations=True) as profiler:
+            assert VigenereHacker(trainer.get_model()).get_result(encrypted_text).text == text
+        assert not instrument.HOOKS
+
+        records = {record['stage']: record for record in profiler.records}
+        assert records['VigenereHacker.get_key']['parent'] == 'VigenereHacker.evaluate'
+        assert records['VigenereHacker.get_result']['depth'] == 0
+        assert records['VigenereDecoder.encode']['characters'] == len(text)
+        summary = {stage['stage']: stage for stage in json.loads(profiler.get_json())['stages']}
+        assert summary['CaesarHacker.score_counts']['calls'] == 2 * len('lemon')
+        if hasattr(tracemalloc, 'reset_peak'):
+            assert summary['VigenereHacker.get_result']['peak'] >= summary['VigenereHacker.get_key']['peak'] > 0
+        else:
+            assert summary['VigenereHacker.get_result']['peak'] is None
+        assert 'encryptor_stage_seconds_total{stage="VigenereHacker.search"}' in profiler.get_prometheus()
+
+        with Profiler() as profiler:
+            assert VigenereHacker(trainer.get_model()).search_buffer(encrypted_text.encode('ascii')).key == 'lemon'
+        assert [record['stage'] for record in profiler.records].count('VigenereHacker.search_buffer') == 1
+
+    def test_server(self, tmp_path):
+        trainer = DefaultTrainer()
+        trainer.feed(open('tests/src/2.txt', 'r').read())
+        model_path = tmp_path / 'model.bin'
+        model_path.write_bytes(trainer.get_binary_model())
+        text = open('tests/src/3.txt', 'r').read()
+
+        async def run():
+            server = EncryptorServer({'english': (str(model_path), None)}, workers=1, max_request_size=1 << 16)
+            try:
+                listener = await server.start('127.0.0.1', 0)
+                reader, writer = await asyncio.open_connection(*listener.sockets[0].getsockname()[:2])
+                requests = [
+                    {'id': 1, 'command': 'encode', 'cipher': 'caesar', 'key': 9, 'text': text},
+                    {'id': 2, 'command': 'hack', 'cipher': 'caesar', 'model': 'english',
+                     'text': CaesarEncoder(9).encode(text)},
+                    {'id': 3, 'command': 'encrypt', 'text': text},
+                    {'id': 4, 'command': 'hack', 'cipher': 'caesar', 'model': 'russian', 'text': text},
+                    {'id': 5, 'command': 'encode', 'cipher': 'caesar', 'key': 9, 'text': 'привет'},
+                    {'id': 6, 'command': 'encode', 'cipher': 'caesar', 'key': 9, 'text': 'a' * (1 << 16)}
+                ]
+                responses = [await send_request(reader, writer, request) for request in requests]
+                assert await reader.read() == b''
+                writer.close()
+                return responses
+            finally:
+                server.close()
+
+        responses = asyncio.run(run())
+        assert [response['id'] for response in responses] == [1, 2, 3, 4, 5, None]
+        assert [response['ok'] for response in responses] == [True, True, False, False, False, False]
+        assert responses[0]['text'] == CaesarEncoder(9).encode(text)
+        assert responses[1]['text'] == text and responses[1]['key'] == 9
+        assert 'exceeds limit' in responses[5]['error']
+
     @pytest.mark.parametrize("train_filename, text_filename, key, n", [
         ('tests/src/1.txt', 'tests/src/2.txt', 5, 3),
         ('tests/src/3.txt', 'tests/src/4.txt', 7, 4),
         ('tests/src/2.txt', 'tests/src/3.txt', 11, 2),
         ('tests/src/4.txt', 'tests/src/2.txt', 13, 6)
     ])
-    def test_bonus_caesar_hacker(self, train_filename, text_filename, key, n):
+    def test_bonus_caesar_hacker(self, train_filename, text_filename, key, n, backend):
         train_file = open(train_filename, 'r')
         text_file = open(text_filename, 'r')
 
@@ -111,3 +708,18 @@ class TestTrainerHacker:
 
         hacker = CaesarBonusHacker(model, n)
         assert hacker.hack(encrypted_text) == text
+
+    @pytest.mark.parametrize("train_filename, text_filename, key, n", [
+        ('tests/src/1.txt', 'tests/src/2.txt', 5, 3),
+        ('tests/src/3.txt', 'tests/src/4.txt', 7, 4)
+    ])
+    def test_bonus_caesar_hacker_log_likelihood(self, train_filename, text_filename, key, n, backend):
+        trainer = BonusTrainer(n)
+        trainer.feed(open(train_filename, 'r').read())
+        text = open(text_filename, 'r').read()
+        encrypted_text = CaesarEncoder(key).encode(text)
+
+        hacker = CaesarBonusHacker(trainer.get_model(), n, metric='log_likelihood')
+        result = hacker.get_result(encrypted_text)
+        assert result.key == key and result.text == text
+        assert result.scores[key] == min(result.scores)